@@ -0,0 +1,953 @@
+"""
+Benchmarks for the controller hot paths and headless course flights.
+
+    python benchmarks.py            # run all
+    python benchmarks.py control    # run one
+"""
+import sys
+import time
+from math import pi
+
+import numpy as np
+
+
+def timeit(func, repeat=5, number=1000):
+    """Best per-call time in microseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e6
+
+
+class _numpy_pid_controller():
+    # Pre-kernel pid_velocity_fixed_height_controller.pid, kept as the baseline
+    def __init__(self):
+        self.past_vx_error = 0.0
+        self.past_vy_error = 0.0
+        self.past_alt_error = 0.0
+        self.past_pitch_error = 0.0
+        self.past_roll_error = 0.0
+        self.altitude_integrator = 0.0
+
+    def pid(self, dt, desired_vx, desired_vy, desired_yaw_rate, desired_altitude, actual_roll, actual_pitch, actual_yaw_rate,
+            actual_altitude, actual_vx, actual_vy):
+        gains = {"kp_att_y": 1, "kd_att_y": 0.5, "kp_att_rp": 0.5, "kd_att_rp": 0.1,
+                 "kp_vel_xy": 2, "kd_vel_xy": 0.5, "kp_z": 10, "ki_z": 5, "kd_z": 5}
+        vx_error = desired_vx - actual_vx
+        vx_deriv = (vx_error - self.past_vx_error) / dt
+        vy_error = desired_vy - actual_vy
+        vy_deriv = (vy_error - self.past_vy_error) / dt
+        desired_pitch = gains["kp_vel_xy"] * np.clip(vx_error, -1, 1) + gains["kd_vel_xy"] * vx_deriv
+        desired_roll = -gains["kp_vel_xy"] * np.clip(vy_error, -1, 1) - gains["kd_vel_xy"] * vy_deriv
+        self.past_vx_error = vx_error
+        self.past_vy_error = vy_error
+        alt_error = desired_altitude - actual_altitude
+        alt_deriv = (alt_error - self.past_alt_error) / dt
+        self.altitude_integrator += alt_error * dt
+        alt_command = gains["kp_z"] * alt_error + gains["kd_z"] * alt_deriv + \
+            gains["ki_z"] * np.clip(self.altitude_integrator, -2, 2) + 48
+        self.past_alt_error = alt_error
+        pitch_error = desired_pitch - actual_pitch
+        pitch_deriv = (pitch_error - self.past_pitch_error) / dt
+        roll_error = desired_roll - actual_roll
+        roll_deriv = (roll_error - self.past_roll_error) / dt
+        yaw_rate_error = desired_yaw_rate - actual_yaw_rate
+        roll_command = gains["kp_att_rp"] * np.clip(roll_error, -1, 1) + gains["kd_att_rp"] * roll_deriv
+        pitch_command = -gains["kp_att_rp"] * np.clip(pitch_error, -1, 1) - gains["kd_att_rp"] * pitch_deriv
+        yaw_command = gains["kp_att_y"] * np.clip(yaw_rate_error, -1, 1)
+        self.past_pitch_error = pitch_error
+        self.past_roll_error = roll_error
+        m1 = alt_command - roll_command + pitch_command + yaw_command
+        m2 = alt_command - roll_command - pitch_command - yaw_command
+        m3 = alt_command + roll_command - pitch_command + yaw_command
+        m4 = alt_command + roll_command + pitch_command - yaw_command
+        return [np.clip(m1, 0, 600), np.clip(m2, 0, 600), np.clip(m3, 0, 600), np.clip(m4, 0, 600)]
+
+
+def _numpy_yaw_error(error_x, error_y, yaw):
+    # Pre-kernel heading computation from Octopus.goto
+    yaw_diff = np.arctan2(error_y, error_x) - yaw
+    while yaw_diff > np.pi:
+        yaw_diff -= 2 * np.pi
+    while yaw_diff < -np.pi:
+        yaw_diff += 2 * np.pi
+    return np.clip(yaw_diff * 0.5, -0.5, 0.5)
+
+
+def bench_control():
+    from math import atan2
+    from pid_controller import pid_velocity_fixed_height_controller
+    from control_kernels import wrap_angle, clip
+
+    args = (0.008, 0.4, -0.2, 0.1, 3.0, 0.01, -0.02, 0.05, 2.97, 0.35, -0.15)
+    legacy = _numpy_pid_controller()
+    kernel = pid_velocity_fixed_height_controller()
+    assert np.allclose(legacy.pid(*args), kernel.pid(*args))
+
+    before = timeit(lambda: legacy.pid(*args))
+    after = timeit(lambda: kernel.pid(*args))
+    print(f"pid step:      {before:7.2f} us -> {after:6.2f} us ({before / after:.1f}x)")
+
+    # The batch controller steps a fleet exactly as N scalar controllers would
+    from pid_controller import batch_pid_velocity_fixed_height_controller
+    n_drones = 64
+    rng = np.random.default_rng(2)
+    scalars = [pid_velocity_fixed_height_controller() for _ in range(n_drones)]
+    batch = batch_pid_velocity_fixed_height_controller(n_drones)
+    for _ in range(50):
+        inputs = rng.normal(args[1:], 0.5, size=(n_drones, len(args) - 1))
+        motors = batch.pid(args[0], *inputs.T)
+        expected = [list(scalar.pid(args[0], *row)) for scalar, row in zip(scalars, inputs.tolist())]
+        assert np.allclose(motors, expected, rtol=1e-12, atol=1e-9)
+    before = timeit(lambda: [scalar.pid(args[0], *row) for scalar, row in zip(scalars, inputs.tolist())], number=200)
+    after = timeit(lambda: batch.pid(args[0], *inputs.T), number=200)
+    print(f"fleet of {n_drones}:   {before:7.2f} us -> {after:6.2f} us ({before / after:.1f}x)")
+
+    # Worst case for the while-loop wrap: heading almost a full turn away
+    error_x, error_y, yaw = -1.0, -0.01, 3 * pi
+    before = timeit(lambda: _numpy_yaw_error(error_x, error_y, yaw))
+    after = timeit(lambda: clip(wrap_angle(atan2(error_y, error_x) - yaw) * 0.5, -0.5, 0.5))
+    print(f"goto heading:  {before:7.2f} us -> {after:6.2f} us ({before / after:.1f}x)")
+
+
+def fly_course(mode, laps=1, world=None, device_profile="race", on_step=None):
+    """
+    Flies the recorded course headless in the given course mode and
+    returns the drone after the run (lap_times, route_recorder). With a
+    world (GateTable) the range sensors see the rings; on_step(drone) is
+    called after every control step.
+    """
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import headless
+    import persistence
+    headless.install()
+    headless.configure(max_time=None)
+    from controller import Robot
+    Robot.world = world
+    from octopus import Octopus
+    from pid_controller import pid_velocity_fixed_height_controller
+    from checkpoint_manager import CheckpointManager
+    from key_controller import course_task
+
+    checkpoint_file = os.path.abspath("checkpoints.json")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        # Route logs go to the temporary directory
+        os.chdir(workdir)
+        try:
+            robot = Robot()
+            drone = Octopus(robot, int(robot.getBasicTimeStep()), pid_velocity_fixed_height_controller(),
+                            device_profile)
+            drone.checkpoint_manager = CheckpointManager(checkpoint_file)
+            drone.course_mode = mode
+            drone.max_laps = laps
+            drone.hover()
+            drone.run(course_task(drone) if on_step is None else _observed(course_task(drone), drone, on_step))
+            persistence.flush()
+        finally:
+            os.chdir(cwd)
+            Robot.world = None
+    return drone
+
+
+def _observed(task, drone, on_step):
+    # Runs task, calling on_step(drone) after each of its steps
+    try:
+        while True:
+            next(task)
+            yield
+            on_step(drone)
+    except StopIteration as stop:
+        return stop.value
+
+
+def bench_lap_time():
+    from checkpoint_manager import CheckpointManager
+    gates = np.array([[cp['position']['x'], cp['position']['y']]
+                      for cp in CheckpointManager(read_only=True).get_all_checkpoints().values()])
+    for mode in ("waypoint", "trajectory", "optimized"):
+        start = time.perf_counter()
+        drone = fly_course(mode)
+        wall = time.perf_counter() - start
+        route = drone.route_recorder.route['position'][:, :2]
+        # Closest horizontal approach to every gate centre
+        miss = np.sqrt(((route[None, :, :] - gates[:, None, :]) ** 2).sum(axis=2)).min(axis=1)
+        print(f"{mode:>10}: lap {drone.lap_times[0]:6.2f} s, worst gate miss {miss.max():.2f} m "
+              f"({wall:.1f} s wall)")
+
+
+def bench_persistence():
+    import os
+    import shutil
+    import tempfile
+    import persistence
+    from checkpoint_manager import CheckpointManager
+    from route_recorder import RouteRecorder
+
+    # A lap of the size the recorder produces on the full course
+    recorder = RouteRecorder()
+    recorder.start_recording(1)
+    n = 1500
+    while len(recorder.points) < n:
+        recorder._grow()
+    rows = recorder.points[:n]
+    rows['timestamp'] = np.arange(n) * 0.1
+    rows['position'] = np.random.default_rng(0).random((n, 3)) * 10
+    rows['checkpoint_id'] = -1
+    recorder.size = n
+
+    checkpoint_file = os.path.abspath("checkpoints.json")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            shutil.copy(checkpoint_file, "checkpoints.json")
+            for background in (False, True):
+                manager = CheckpointManager(background=background)
+                # Control-thread time only; background writes finish later
+                lap = timeit(lambda: recorder.save_route_data(background=background), repeat=3, number=5)
+                checkpoints = timeit(manager.save_data, repeat=3, number=20)
+                persistence.flush()
+                label = "background" if background else "synchronous"
+                print(f"{label:>12}: lap save stall {lap / 1000:7.2f} ms, "
+                      f"checkpoint save stall {checkpoints / 1000:6.2f} ms")
+        finally:
+            os.chdir(cwd)
+    stats = persistence.get_worker().stats
+    print(f"worker: {stats['submitted']} submitted, {stats['coalesced']} coalesced, "
+          f"{stats['written']} written in {stats['write_seconds'] * 1000:.0f} ms, "
+          f"max submit {stats['max_submit_seconds'] * 1e6:.0f} us")
+
+
+def _passage_data(rng):
+    return {
+        'passage_info': {'side': 'left', 'left_lidar': 1.0, 'right_lidar': 1.0},
+        'orientation': {'roll': 0.0, 'pitch': 0.0, 'yaw': float(rng.uniform(-pi, pi))},
+        'velocity': {'v_x': 0.0, 'v_y': 0.0, 'v_z': 0.0}
+    }
+
+
+def _random_position(rng, extent):
+    x, y, z = rng.uniform(0, extent, 3)
+    return {'x': float(x), 'y': float(y), 'z': float(z)}
+
+
+def bench_checkpoint_journal():
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+
+    rng = np.random.default_rng(0)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for n in (21, 200, 500):
+                for journaled in (False, True):
+                    for path in ("checkpoints.json", "checkpoints.journal"):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    manager = CheckpointManager(background=False)
+                    manager.storage.COMPACT_EVERY = 10 ** 9
+                    # Gate density of the real course (~21 gates in 25 x 10 m)
+                    extent = 10 * (n / 21) ** (1 / 3)
+                    for _ in range(n):
+                        manager.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+
+                    def record():
+                        manager.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+                        if not journaled:
+                            # What every mutation used to cost
+                            manager.save_data()
+                    per_add = timeit(record, repeat=3, number=10) / 1000
+                    label = "journal" if journaled else "full rewrite"
+                    print(f"{n:4d} gates, {label:>12}: {per_add:6.2f} ms per checkpoint")
+
+            # A viewer loading while the controller is mid-append skips the torn line and writes nothing
+            manager.save_data()
+            manager.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+            with open("checkpoints.journal", 'a') as f:
+                f.write('{"op": "add", "checkp')
+            files = {path: open(path, 'rb').read() for path in ("checkpoints.json", "checkpoints.journal")}
+            viewer = CheckpointManager(background=False, read_only=True)
+            viewer.close()
+            assert len(viewer.checkpoints) == len(manager.checkpoints)
+            assert files == {path: open(path, 'rb').read() for path in files}, "loading wrote the store"
+            # The writer compacts before its first append after the torn line
+            writer = CheckpointManager(background=False)
+            writer.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+            assert len(CheckpointManager(background=False, read_only=True).checkpoints) == len(manager.checkpoints) + 1
+            # A read-only viewer of a database that doesn't exist yet reads it as empty, without creating it
+            assert not CheckpointManager("checkpoints.db", background=False, read_only=True).checkpoints
+            assert not os.path.exists("checkpoints.db")
+
+            # SQLite answers range queries from its indexes, as the in-memory scan would
+            n = 2000
+            extent = 10 * (n / 21) ** (1 / 3)
+            writer = CheckpointManager("range.db")
+            writer.add_checkpoints([{'position': _random_position(rng, extent), 'passage_data': _passage_data(rng)}
+                                    for _ in range(n)])
+            viewer = CheckpointManager("range.db", read_only=True)
+            # Added after the viewer loaded: the viewer still finds it in the database
+            writer.add_checkpoint({'x': extent / 2, 'y': extent / 2, 'z': extent / 2}, _passage_data(rng))
+            low, high = (extent / 4,) * 3, (extent / 2,) * 3
+
+            def scan():
+                return sorted((checkpoint_id for checkpoint_id, checkpoint in writer.checkpoints.items()
+                               if all(lo <= checkpoint['position'][axis] <= hi
+                                      for lo, axis, hi in zip(low, 'xyz', high))), key=int)
+            expected = scan()
+            assert list(writer.get_checkpoints_in_box(low, high)) == expected
+            assert list(viewer.get_checkpoints_in_box(low, high)) == expected
+            timestamps = sorted(passage['timestamp'] for checkpoint in writer.checkpoints.values()
+                                for passage in checkpoint['passage_history'])
+            start, end = timestamps[n // 4], timestamps[n // 2]
+            assert sorted((checkpoint_id, passage['timestamp'])
+                          for checkpoint_id, passage in viewer.get_passages_between(start, end)) == sorted(
+                (checkpoint_id, passage['timestamp']) for checkpoint_id, checkpoint in writer.checkpoints.items()
+                for passage in checkpoint['passage_history'] if start <= passage['timestamp'] <= end)
+            before = timeit(scan, repeat=3, number=20)
+            after = timeit(lambda: viewer.get_checkpoints_in_box(low, high), repeat=3, number=20)
+            print(f"{n} gates, box query: scan {before / 1000:5.2f} ms, SQLite index {after / 1000:5.2f} ms")
+            viewer.close()
+            writer.close()
+        finally:
+            os.chdir(cwd)
+
+
+def _linear_update_connections(checkpoints, new_checkpoint_id):
+    # Pre-index CheckpointManager._update_connections, kept as the baseline
+    from math import sqrt
+    new_checkpoint = checkpoints[new_checkpoint_id]
+    new_pos = new_checkpoint['position']
+    for checkpoint_id, checkpoint in checkpoints.items():
+        if checkpoint_id == new_checkpoint_id:
+            continue
+        distance = sqrt(
+            (new_pos['x'] - checkpoint['position']['x'])**2 +
+            (new_pos['y'] - checkpoint['position']['y'])**2 +
+            (new_pos['z'] - checkpoint['position']['z'])**2
+        )
+        if distance <= 3.0:
+            connection = {'distance': distance, 'difficulty': 1.0, 'average_speed': 0.0, 'best_approach_angle': 0.0}
+            new_checkpoint['connections'].append(dict(connection, to_checkpoint_id=int(checkpoint_id)))
+            checkpoint['connections'].append(dict(connection, to_checkpoint_id=int(new_checkpoint_id)))
+
+
+def bench_spatial_index():
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in (200, 1000, 5000):
+            extent = 10 * (n / 21) ** (1 / 3)
+            checkpoints = [
+                {'id': i, 'position': _random_position(rng, extent), 'connections': [], 'passage_history': []}
+                for i in range(1, n + 1)
+            ]
+
+            legacy = {}
+            start = time.perf_counter()
+            for checkpoint in checkpoints:
+                legacy[str(checkpoint['id'])] = dict(checkpoint, connections=[])
+                _linear_update_connections(legacy, str(checkpoint['id']))
+            before = time.perf_counter() - start
+
+            manager = CheckpointManager(os.path.join(workdir, f"checkpoints_{n}.json"), background=False)
+            start = time.perf_counter()
+            for checkpoint in checkpoints:
+                manager._insert_checkpoint(dict(checkpoint, connections=[]))
+            after = time.perf_counter() - start
+
+            assert all(manager.checkpoints[key]['connections'] == legacy[key]['connections'] for key in legacy)
+            query = timeit(lambda: manager.find_nearest((extent / 2, extent / 2, extent / 2)), repeat=3, number=200)
+            print(f"{n:5d} gates: connect {before * 1000:8.1f} ms -> {after * 1000:6.1f} ms "
+                  f"({before / after:.0f}x), nearest {query:.0f} us")
+
+
+def bench_checkpoint_table():
+    import os
+    import tempfile
+    import tracemalloc
+    from checkpoint_manager import CheckpointManager
+
+    rng = np.random.default_rng(0)
+    n = 1000
+    extent = 10 * (n / 21) ** (1 / 3)
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = CheckpointManager(os.path.join(workdir, "checkpoints.json"), background=False)
+        tracemalloc.start()
+        for _ in range(n):
+            manager.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        checkpoints = manager.checkpoints
+
+        build = timeit(manager.table, repeat=1, number=1)
+        table = manager.table()
+        point = (extent / 2, extent / 2, extent / 2)
+
+        def dict_distances():
+            return [sqrt_sum(cp['position'], point) for cp in checkpoints.values()]
+
+        def sqrt_sum(position, p):
+            return ((position['x'] - p[0]) ** 2 + (position['y'] - p[1]) ** 2 + (position['z'] - p[2]) ** 2) ** 0.5
+
+        assert np.allclose(dict_distances(), table.distances_from(point))
+        before = timeit(dict_distances, repeat=3, number=20)
+        after = timeit(lambda: table.distances_from(point), repeat=3, number=20)
+        print(f"{n} checkpoints: {dict_bytes / n:.0f} B (dicts, incl. history) vs "
+              f"{table.nbytes / n:.0f} B (table) per checkpoint, table build {build / 1000:.1f} ms")
+        print(f"distances to a point: {before:7.1f} us -> {after:5.1f} us ({before / after:.0f}x)")
+
+
+def bench_batch_add():
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in (10, 1000, 10000):
+            extent = 10 * (n / 21) ** (1 / 3)
+            batch = [{'position': _random_position(rng, extent), 'passage_data': _passage_data(rng)}
+                     for _ in range(n)]
+
+            one_by_one = CheckpointManager(os.path.join(workdir, f"single_{n}.json"), background=False)
+            one_by_one.storage.COMPACT_EVERY = 10 ** 9
+            start = time.perf_counter()
+            for entry in batch:
+                one_by_one.add_checkpoint(entry['position'], entry['passage_data'])
+            before = time.perf_counter() - start
+
+            batched = CheckpointManager(os.path.join(workdir, f"batch_{n}.json"), background=False)
+            start = time.perf_counter()
+            batched.add_checkpoints(batch)
+            after = time.perf_counter() - start
+
+            assert all(batched.checkpoints[key]['connections'] == checkpoint['connections']
+                       for key, checkpoint in one_by_one.checkpoints.items())
+            print(f"{n:6d} gates: add_checkpoint x n {before * 1000:9.1f} ms, "
+                  f"add_checkpoints {after * 1000:8.1f} ms ({before / after:.1f}x)")
+
+
+def _dijkstra_cost(start, goal):
+    # Same search without the heuristic, as the baseline
+    import heapq
+    from pathfinding import edge_cost
+
+    best = {start.id: 0.0}
+    heap = [(0.0, 0, start)]
+    counter = 1
+    while heap:
+        cost, _, node = heapq.heappop(heap)
+        if node is goal:
+            return cost
+        if cost > best[node.id]:
+            continue
+        for neighbour, distance, difficulty, average_speed in node.edges:
+            new_cost = cost + edge_cost(distance, difficulty, average_speed)
+            if new_cost < best.get(neighbour.id, float('inf')):
+                best[neighbour.id] = new_cost
+                heapq.heappush(heap, (new_cost, counter, neighbour))
+                counter += 1
+    return None
+
+
+def bench_pathfinding():
+    import contextlib
+    import io
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from pathfinding import CheckpointNode, edge_cost, find_path_between_checkpoints, shortest_path
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in (1000, 10000):
+            # Denser than Parkour so the connection graph spans the volume
+            extent = 10 * (n / 80) ** (1 / 3)
+            manager = CheckpointManager(os.path.join(workdir, f"plan_{n}.json"), background=False)
+            manager.add_checkpoints([{'position': _random_position(rng, extent), 'passage_data': _passage_data(rng)}
+                                     for _ in range(n)])
+            nodes = manager.table().nodes()
+            # Opposite corners of the course
+            start = min(nodes, key=lambda node: sum(node.position))
+            goal = max(nodes, key=lambda node: sum(node.position))
+
+            path = shortest_path(start, goal)
+            assert path is not None
+            cost = sum(edge_cost(*next(edge[1:] for edge in a.edges if edge[0] is b)) for a, b in zip(path, path[1:]))
+            assert abs(cost - _dijkstra_cost(start, goal)) < 1e-9
+            before = timeit(lambda: _dijkstra_cost(start, goal), repeat=3, number=5)
+            after = timeit(lambda: shortest_path(start, goal), repeat=3, number=5)
+            print(f"{n:6d} gates, {len(path)} hops: Dijkstra {before / 1000:7.2f} ms, "
+                  f"A* {after / 1000:7.2f} ms ({before / after:.1f}x)")
+
+            # Nodes without the manager's graph are connected the way the manager connects them
+            bare = [CheckpointNode(node.id, node.position, node.orientation) for node in nodes]
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                expected = [cp.id for cp in find_path_between_checkpoints(start.id, goal.id, nodes)]
+                assert [cp.id for cp in find_path_between_checkpoints(start.id, goal.id, bare)] == expected
+            assert "bağlantısı" not in output.getvalue()
+
+
+def bench_plan_cache():
+    import contextlib
+    import io
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from course_planner import CoursePlanner
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in (21, 1000):
+            extent = 10 * (n / 21) ** (1 / 3)
+            manager = CheckpointManager(os.path.join(workdir, f"plan_cache_{n}.json"), background=False)
+            manager.add_checkpoints([{'position': _random_position(rng, extent), 'passage_data': _passage_data(rng)}
+                                     for _ in range(n)])
+            # The planner prints every connection and path() the route; time them as a lap start runs them
+            with contextlib.redirect_stdout(io.StringIO()):
+                planner = CoursePlanner(manager)
+                expected = [(cp.id, cp.position) for cp in planner.path()]
+                # Every lap used to plan the course from scratch
+                before = timeit(lambda: (planner.rebuild(), planner.path()), repeat=3, number=5)
+                after = timeit(planner.path, repeat=3, number=5)
+                assert [(cp.id, cp.position) for cp in planner.path()] == expected
+                # Any change to the checkpoints drops the assembled path
+                manager.add_checkpoint(_random_position(rng, extent), _passage_data(rng))
+                assert planner._path is None and len(planner.path()) > len(expected)
+            planner.close()
+            print(f"{n:6d} gates, per-lap plan: {before / 1000:8.2f} ms -> {after / 1000:6.3f} ms cached "
+                  f"({before / after:.0f}x)")
+
+
+def _scalar_route_geometry(route):
+    # Per-pair CheckpointNode methods, the pre-vectorization path
+    from pathfinding import calculate_optimal_intermediate_point
+
+    pairs, points = [], []
+    for i in range(len(route) - 1):
+        current, next_cp = route[i], route[i + 1]
+        pairs.append((current.calculate_transition_type(next_cp), current.calculate_approach_angle(next_cp),
+                      current.calculate_exit_angle(next_cp)))
+        next_next_cp = route[i + 2] if i + 2 < len(route) else None
+        optimal_pos = calculate_optimal_intermediate_point(current, next_cp, next_next_cp)
+        points.append(optimal_pos if optimal_pos != next_cp.position else None)
+    return pairs, points
+
+
+def bench_route_geometry():
+    from pathfinding import CheckpointNode, TRANSITION_TYPES, route_geometry
+
+    rng = np.random.default_rng(0)
+    for n in (21, 1000, 10000):
+        # A wandering course with gates at assorted headings
+        steps = rng.normal(0.0, 1.0, (n, 3)) + (1.5, 0.0, 0.0)
+        positions = np.cumsum(steps, axis=0)
+        yaws = rng.uniform(-2 * pi, 2 * pi, n)
+        route = [CheckpointNode(i + 1, tuple(position), (0.0, 0.0, yaw))
+                 for i, (position, yaw) in enumerate(zip(positions.tolist(), yaws.tolist()))]
+
+        geometry = route_geometry(route)
+        pairs, points = _scalar_route_geometry(route)
+        assert pairs == [(TRANSITION_TYPES[t], a, e) for t, a, e in zip(
+            geometry['transitions'], geometry['approach_angles'], geometry['exit_angles'])]
+        assert points == [tuple(point) if turn else None
+                          for turn, point in zip(geometry['turns'], geometry['intermediate_points'].tolist())]
+
+        before = timeit(lambda: _scalar_route_geometry(route), repeat=3, number=3)
+        after = timeit(lambda: route_geometry(route), repeat=3, number=3)
+        print(f"{n:6d} gates ({int(geometry['turns'].sum())} turns): per pair {before / 1000:8.2f} ms, "
+              f"arrays {after / 1000:6.2f} ms ({before / after:.0f}x)")
+
+
+def bench_trajectory_optimizer():
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from trajectory_optimizer import GATE_TOLERANCE, load_or_optimize
+    import persistence
+
+    gates = [(cp['position']['x'], cp['position']['y'], 3.0)
+             for cp in CheckpointManager(read_only=True).get_all_checkpoints().values()]
+    with tempfile.TemporaryDirectory() as workdir:
+        cache_dir = os.path.join(workdir, "trajectories")
+        start = time.perf_counter()
+        trajectory = load_or_optimize((0.0, 0.0, 3.0), gates, cache_dir=cache_dir)
+        optimize = time.perf_counter() - start
+        persistence.flush()
+        start = time.perf_counter()
+        cached = load_or_optimize((0.0, 0.0, 3.0), gates, cache_dir=cache_dir)
+        load = time.perf_counter() - start
+        assert np.array_equal(cached.positions, trajectory.positions)
+
+    speed = np.linalg.norm(trajectory.velocities, axis=1)
+    acceleration = np.linalg.norm(np.diff(trajectory.velocities, axis=0), axis=1) / np.diff(trajectory.times)
+    # Closest horizontal approach of the reference to every gate centre
+    positions = trajectory.positions[:, :2]
+    miss = np.sqrt(((positions[None, :, :] - np.array(gates)[:, None, :2]) ** 2).sum(axis=2)).min(axis=1)
+    assert miss.max() <= GATE_TOLERANCE + 0.01
+    print(f"{len(gates)} gates: {trajectory.duration:.2f} s planned, peak {speed.max():.2f} m/s, "
+          f"{acceleration.max():.2f} m/s^2, worst gate offset {miss.max():.2f} m")
+    print(f"optimize {optimize * 1000:.1f} ms, cached load {load * 1000:.1f} ms")
+
+
+def bench_gate_order():
+    from gate_order import cost_matrix, nearest_neighbour, solve_gate_order, tour_cost
+
+    rng = np.random.default_rng(0)
+    for n in (21, 100, 300, 500):
+        # A wavy loop recorded in random id order, headings along the loop
+        angle = np.linspace(0, 2 * pi, n, endpoint=False)
+        radius = 10 * (n / 21) ** 0.5 * (1 + 0.2 * np.sin(3 * angle))
+        positions = np.column_stack([radius * np.cos(angle), radius * np.sin(angle), np.full(n, 3.0)])
+        legs = np.diff(np.vstack([positions, positions[:1]]), axis=0)
+        headings = np.arctan2(legs[:, 1], legs[:, 0]) + rng.normal(0.0, 0.1, n)
+        shuffle = rng.permutation(n)
+        flight_order = np.argsort(shuffle).tolist()
+        start = time.perf_counter()
+        order = solve_gate_order(positions[shuffle], headings[shuffle], start=flight_order[0])
+        loop = time.perf_counter() - start
+        assert order == flight_order
+
+        # Scattered gates without headings: plain tour quality
+        scattered = np.column_stack([rng.uniform(0, 50, (n, 2)), np.full(n, 3.0)])
+        cost = cost_matrix(scattered)
+        start = time.perf_counter()
+        order = solve_gate_order(scattered)
+        scatter = time.perf_counter() - start
+        greedy = nearest_neighbour(cost, 0)
+        print(f"{n:4d} gates: shuffled loop recovered in {loop * 1000:6.1f} ms; scattered tour "
+              f"{tour_cost(cost, greedy + greedy[:1]):6.1f} m (nearest neighbour) -> "
+              f"{tour_cost(cost, order + order[:1]):6.1f} m in {scatter * 1000:6.1f} ms")
+
+
+def bench_course_planner():
+    import contextlib
+    import io
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from course_planner import CoursePlanner
+
+    def loop_gate(angle, radius):
+        # Gate on a circle, heading along the loop
+        passage = {
+            'passage_info': {'side': 'left', 'left_lidar': 1.0, 'right_lidar': 1.0},
+            'orientation': {'roll': 0.0, 'pitch': 0.0, 'yaw': float(angle + pi / 2)},
+            'velocity': {'v_x': 0.0, 'v_y': 0.0, 'v_z': 0.0}
+        }
+        position = {'x': float(radius * np.cos(angle)), 'y': float(radius * np.sin(angle)), 'z': 3.0}
+        return {'position': position, 'passage_data': passage}
+
+    def scattered_gate(rng, extent):
+        # Gate anywhere on a square, heading anywhere: legs of several hops and gates the graph doesn't link
+        angle = rng.uniform(-pi, pi)
+        gate = loop_gate(angle - pi / 2, 0.0)
+        gate['position'] = {'x': float(rng.uniform(0, extent)), 'y': float(rng.uniform(0, extent)), 'z': 3.0}
+        return gate
+
+    def snapshot(path):
+        return [(cp.id, tuple(float(v) for v in cp.position)) for cp in path]
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        for layout, n in (('loop', 100), ('loop', 500), ('scattered', 20), ('scattered', 100)):
+            if layout == 'loop':
+                # 2.5 m between gates, like Parkour
+                radius = 2.5 * n / (2 * pi)
+                new_gate = lambda: loop_gate(rng.uniform(0, 2 * pi), radius + 0.3)
+                gates = [loop_gate(angle, radius) for angle in np.linspace(0, 2 * pi, n, endpoint=False)]
+            else:
+                # About 10 m^2 per gate: sparser than the 3 m connection radius links everywhere
+                extent = np.sqrt(10.0 * n)
+                new_gate = lambda: scattered_gate(rng, extent)
+                gates = [new_gate() for _ in range(n)]
+            manager = CheckpointManager(os.path.join(workdir, f"planner_{layout}_{n}.json"), background=False)
+            manager.add_checkpoints(gates)
+            # The planner prints its connections and routes
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                planner = CoursePlanner(manager)
+                planner.path()
+                rebuild = time.perf_counter() - start
+
+                changes = {
+                    'add': lambda: manager.add_checkpoint(**new_gate()),
+                    'batch': lambda: manager.add_checkpoints([new_gate() for _ in range(3)]),
+                    'move': lambda: manager.update_checkpoint(
+                        planner.order[int(rng.integers(len(planner.order)))], {'position': new_gate()['position']}),
+                    'delete': lambda: manager.delete_checkpoint(planner.order[int(rng.integers(len(planner.order)))]),
+                    'passage': lambda: manager.record_passage(planner.order[0], loop_gate(0.0, 0.0)['passage_data']),
+                }
+                timings = {}
+                for name, change in changes.items():
+                    seconds = 0.0
+                    for _ in range(10):
+                        start = time.perf_counter()
+                        change()
+                        seconds += time.perf_counter() - start
+                        # The incremental plan is the plan a full rebuild makes for the same order
+                        incremental = snapshot(planner.path())
+                        fresh = CoursePlanner(manager, planner.order)
+                        assert incremental == snapshot(fresh.path()), (layout, name)
+                        fresh.close()
+                    timings[name] = seconds / 10
+                # Every change was repaired in place
+                assert planner.stats['rebuilds'] == 1
+                planner.close()
+            # Replaying the journal reconnects moved gates the same way
+            reloaded = CheckpointManager(os.path.join(workdir, f"planner_{layout}_{n}.json"), background=False,
+                                         read_only=True)
+            assert reloaded.checkpoints == manager.checkpoints
+            print(f"{layout:9s} {n:4d} gates: full plan {rebuild * 1000:5.1f} ms; per change " + ", ".join(
+                f"{name} {seconds * 1000:5.2f} ms" for name, seconds in timings.items()))
+
+
+def bench_world_geometry():
+    import os
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from world_geometry import DEFAULT_WORLD, GateTable, load_gate_table, parse_world
+    import persistence
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        table = load_gate_table(cache_dir=cache_dir)
+        parse = time.perf_counter() - start
+        persistence.flush()
+        cached = load_gate_table(cache_dir=cache_dir)
+        assert os.listdir(cache_dir) and cached.names == table.names
+        assert np.array_equal(cached.centres, table.centres) and np.array_equal(cached.normals, table.normals)
+        load = timeit(lambda: load_gate_table(cache_dir=cache_dir), number=50)
+    with open(DEFAULT_WORLD, encoding='utf-8') as f:
+        text = f.read()
+    parse_only = timeit(lambda: GateTable.from_world(parse_world(text)), number=50)
+
+    # Recorded checkpoints against the ring they were recorded in
+    checkpoints = CheckpointManager(read_only=True).get_all_checkpoints().values()
+    offsets = [table.nearest((cp['position']['x'], cp['position']['y'], table.centres[0, 2]))[1] for cp in checkpoints]
+    centre, normal = table.centres[0], table.normals[0]
+    side = np.cross(normal, (0.0, 0.0, 1.0))
+    assert abs(table.raycast(centre, side / np.linalg.norm(side), 2.0) - table.inner_radii[0]) < 1e-9
+    assert table.crossings(centre - normal, centre + normal) == [0]
+    hit = timeit(lambda: table.raycast(centre, (0.0, 1.0, 0.0), 2.0), number=200)
+    # Between gates, looking sideways at nothing
+    between = 0.5 * (table.centres[0] + table.centres[1])
+    miss = timeit(lambda: table.raycast(between + (0.0, 0.0, 1.0), (0.0, 1.0, 0.0), 2.0), number=200)
+    print(f"{len(table)} gates: first load {parse * 1000:.1f} ms, cached load {load / 1000:.2f} ms, "
+          f"parse alone {parse_only / 1000:.2f} ms")
+    print(f"checkpoints within {max(offsets):.2f} m of a gate centre, raycast {hit:.1f} us through a ring, {miss:.1f} us clear")
+
+
+def bench_clearance_field():
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from clearance_field import DRONE_RADIUS, TRUNCATION, load_clearance_field, ring_distance
+    from trajectory_optimizer import load_or_optimize
+    from world_geometry import load_gate_table
+    import persistence
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        table = load_gate_table(cache_dir=cache_dir)
+        start = time.perf_counter()
+        field = load_clearance_field(table, cache_dir=cache_dir)
+        build = time.perf_counter() - start
+        persistence.flush()
+        start = time.perf_counter()
+        mapped = load_clearance_field(table, cache_dir=cache_dir)
+        load = time.perf_counter() - start
+        assert isinstance(mapped.distances, np.memmap) and np.array_equal(mapped.distances, field.distances)
+        scalar = timeit(lambda: mapped.clearance(-2.0, 0.2, 3.0), number=2000)
+        del mapped
+
+    # Interpolated against exact distances around the rings
+    rng = np.random.default_rng(0)
+    points = table.centres[rng.integers(0, len(table), 20000)] + rng.normal(0.0, 0.6, (20000, 3))
+    exact = np.min([ring_distance(points, table.centres[row], table.normals[row], table.inner_radii[row],
+                                  table.outer_radii[row], table.depths[row]) for row in range(len(table))], axis=0)
+    exact = np.minimum(np.minimum(exact, points[:, 2]), TRUNCATION)
+    batch = field.clearances(points)
+    assert np.allclose([field.clearance(*point) for point in points[:500].tolist()], batch[:500])
+    error = np.abs(batch - exact)
+    batched = timeit(lambda: field.clearances(points), number=20)
+
+    gates = [(cp['position']['x'], cp['position']['y'], 3.0)
+             for cp in CheckpointManager(read_only=True).get_all_checkpoints().values()]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        trajectory = load_or_optimize((0.0, 0.0, 3.0), gates, cache_dir=cache_dir)
+        persistence.flush()
+    clearance = field.clearances(trajectory.positions)
+    assert field.first_collision(trajectory.positions) is None and clearance.min() >= DRONE_RADIUS
+    print(f"{field.shape} grid, {field.distances.nbytes / 1e6:.1f} MB: build {build * 1000:.0f} ms, "
+          f"memory-mapped load {load * 1000:.2f} ms")
+    print(f"interpolation error mean {error.mean() * 1000:.1f} mm, max {error.max() * 1000:.1f} mm")
+    print(f"clearance {scalar:.1f} us per point, {batched / len(points) * 1000:.0f} ns per point batched; "
+          f"optimized trajectory ({len(trajectory)} samples) clears by {clearance.min():.2f} m")
+
+
+def bench_passage_detector():
+    import tempfile
+    from passage_detector import PassageDetector, detect_route_passages
+    from world_geometry import load_gate_table
+    import persistence
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        table = load_gate_table(cache_dir=cache_dir)
+        persistence.flush()
+    detector = PassageDetector()
+    passages = []
+    # Samples where a side range first drops below the threshold, as the old per-sample check fired
+    edges = [0, False]
+
+    def on_step(drone):
+        frame = drone.sense()
+        below = frame.range_left < detector.threshold or frame.range_right < detector.threshold
+        edges[0] += below and not edges[1]
+        edges[1] = below
+        passage = detector.update_frame(frame)
+        if passage is not None:
+            passages.append(passage)
+
+    drone = fly_course("trajectory", world=table, device_profile="record", on_step=on_step)
+    # The last ring may still be open when the flight ends
+    passage = detector.finish()
+    if passage is not None:
+        passages.append(passage)
+    gates = [table.nearest((p['position']['x'], p['position']['y'], p['position']['z'])) for p in passages]
+    assert len({row for row, _ in gates}) == len(gates), "one passage per gate"
+    route = drone.route_recorder.route
+    offline = detect_route_passages(route)
+    assert [p['position'] for p in offline] == [p['position'] for p in passages], "live and offline agree"
+    # Every ring a side range saw closer than the threshold, and no other, has its passage
+    with np.errstate(invalid='ignore'):
+        below = np.nonzero(np.any(route['lidar'][:, 2:4] < detector.threshold, axis=1))[0]
+    crossed = {table.nearest(route['position'][row])[0] for row in below}
+    assert {row for row, _ in gates} == crossed, "a passage for every ring the side ranges crossed"
+
+    idle = timeit(lambda: detector.update(0.0, 0.0, 0.0, 3.0, 0.0, 0.0, 0.0, 2.0, 2.0), number=20000)
+    detector.reset()
+    inside = timeit(lambda: detector.update(0.0, 0.0, 0.0, 3.0, 0.0, 0.0, 0.0, 0.45, 0.45), number=20000)
+    print(f"{len(table)} rings, {edges[0]} threshold crossings -> {len(passages)} passages "
+          f"(rings {', '.join(str(row + 1) for row, _ in gates)}; side ranges never below "
+          f"{detector.threshold} m at rings {', '.join(str(row + 1) for row in sorted(set(range(len(table))) - crossed))})")
+    print(f"centre within {max(distance for _, distance in gates):.2f} m of the ring "
+          f"(median {np.median([distance for _, distance in gates]):.3f} m); "
+          f"recorded log ({len(route)} samples): {len(offline)} passages")
+    print(f"update {idle:.2f} us per sample clear, {inside:.2f} us inside a ring")
+
+
+def bench_gate_extraction():
+    import os
+    import shutil
+    import tempfile
+    from checkpoint_manager import CheckpointManager
+    from gate_extraction import detect_passages, extract_gates, load_route
+    from passage_detector import detect_route_passages
+    from route_recorder import write_route_data
+    from world_geometry import load_gate_table
+    import persistence
+
+    with tempfile.TemporaryDirectory() as workdir:
+        table = load_gate_table(cache_dir=workdir)
+        persistence.flush()
+        paths = []
+        for mode in ("trajectory", "waypoint"):
+            route = fly_course(mode, world=table).route_recorder.route.copy()
+            path = os.path.join(workdir, f"route_data_lap_{len(paths) + 1}.json")
+            write_route_data(path, {'lap_number': len(paths) + 1, 'start_time': None, 'checkpoint_times': {},
+                                    'route': route})
+            paths.append(path)
+
+            # Vectorized detection finds exactly what the streaming detector finds
+            start = time.perf_counter()
+            streamed = detect_route_passages(route)
+            stream = time.perf_counter() - start
+            start = time.perf_counter()
+            passages = detect_passages(route)
+            vectorized = time.perf_counter() - start
+            assert len(streamed) == len(passages['centre'])
+            assert np.allclose([[p['position'][axis] for axis in 'xyz'] for p in streamed], passages['centre'])
+            loaded = load_route(path)
+            assert all(np.array_equal(loaded[name], route[name], equal_nan=route[name].dtype.kind == 'f')
+                       for name in route.dtype.names)
+            print(f"{mode} lap, {len(route)} samples: {len(streamed)} passages, "
+                  f"streaming {stream * 1000:.1f} ms, vectorized {vectorized * 1000:.2f} ms")
+        # Ten sessions of the same two laps
+        for copy in range(2, 21):
+            paths.append(os.path.join(workdir, f"route_data_lap_{copy + 1}.json"))
+            shutil.copy(paths[copy % 2], paths[-1])
+
+        start = time.perf_counter()
+        entries = extract_gates(paths)
+        extract = time.perf_counter() - start
+        manager = CheckpointManager(os.path.join(workdir, "checkpoints.json"), background=False)
+        start = time.perf_counter()
+        ids = manager.add_checkpoints(entries)
+        write = time.perf_counter() - start
+        manager.close()
+
+        # A dry run leaves the stores exactly as it found them, missing ones included
+        import contextlib
+        import io
+        import gate_extraction
+        stores = [os.path.join(workdir, "checkpoints.json"), os.path.join(workdir, "dry_run.json"),
+                  os.path.join(workdir, "dry_run.db")]
+        before = {path: open(path, 'rb').read()
+                  for path in (stores[0], os.path.join(workdir, "checkpoints.journal")) if os.path.exists(path)}
+        argv = sys.argv
+        try:
+            for store in stores:
+                sys.argv = ["gate_extraction.py", *paths[:2], "--checkpoints", store, "--dry-run"]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    gate_extraction.main()
+        finally:
+            sys.argv = argv
+        assert not any(os.path.exists(store) for store in stores[1:]), "dry run created a store"
+        assert before == {path: open(path, 'rb').read() for path in before}, "dry run wrote the store"
+
+    rings = [table.nearest((e['position']['x'], e['position']['y'], e['position']['z'])) for e in entries]
+    assert sorted(row for row, _ in rings) == list(range(len(table))), "one checkpoint per ring"
+    assert [row for row, _ in rings] == list(range(len(table))), "ids in flight order"
+    print(f"{len(paths)} lap files -> {len(ids)} checkpoints in {extract * 1000:.0f} ms "
+          f"(+{write * 1000:.1f} ms batch write), within {max(d for _, d in rings):.2f} m of the rings "
+          f"(median {np.median([d for _, d in rings]):.3f} m)")
+
+
+BENCHMARKS = {
+    'control': bench_control,
+    'lap_time': bench_lap_time,
+    'persistence': bench_persistence,
+    'checkpoint_journal': bench_checkpoint_journal,
+    'spatial_index': bench_spatial_index,
+    'checkpoint_table': bench_checkpoint_table,
+    'batch_add': bench_batch_add,
+    'pathfinding': bench_pathfinding,
+    'plan_cache': bench_plan_cache,
+    'route_geometry': bench_route_geometry,
+    'trajectory_optimizer': bench_trajectory_optimizer,
+    'gate_order': bench_gate_order,
+    'course_planner': bench_course_planner,
+    'world_geometry': bench_world_geometry,
+    'clearance_field': bench_clearance_field,
+    'passage_detector': bench_passage_detector,
+    'gate_extraction': bench_gate_extraction,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
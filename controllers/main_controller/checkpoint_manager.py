@@ -1,48 +1,122 @@
-import json
-import os
+import copy
 from datetime import datetime
-from math import sqrt
+from math import isfinite
+import numpy as np
+import persistence
+from checkpoint_storage import open_storage
+from spatial_index import GridIndex, radius_pairs
+from checkpoint_table import CheckpointTable
+from passage_stats import stats_from_history, update_stats, upgrade_stats
 
 class CheckpointManager:
-    def __init__(self, json_file_path="checkpoints.json"):
+    """
+    Keeps the checkpoints in memory and reports every mutation to a storage
+    backend (see checkpoint_storage): the JSON snapshot + journal by
+    default, SQLite for .db/.sqlite paths, or any `storage` passed in.
+    Viewers open it read_only: loading never writes, and a read-only
+    manager refuses to persist changes.
+    """
+    CONNECTION_RADIUS = 3.0
+    # Passages kept per checkpoint; older ones live on only in passage_stats
+    HISTORY_DEPTH = 20
+
+    def __init__(self, json_file_path="checkpoints.json", background=True, storage=None, history_depth=None,
+                 read_only=False):
         self.json_file_path = json_file_path
+        self.history_depth = history_depth or self.HISTORY_DEPTH
+        self.storage = storage if storage is not None else open_storage(json_file_path, background, read_only)
         self.checkpoints = {}
         self.metadata = {
             "last_checkpoint_id": 0,
-            "last_update": datetime.now().isoformat()
+            "last_update": datetime.now().isoformat(),
+            "journal_seq": 0
         }
+        # Checkpoint positions by id, for radius and nearest queries
+        self.index = GridIndex(self.CONNECTION_RADIUS)
+        # Bumped on every change; derived data (table()) is rebuilt when it moves
+        self.version = 0
+        self._table = None
+        self._table_version = -1
+        # Called as listener(record, changed_ids) after every change
+        self.listeners = []
         self.load_data()
 
     def load_data(self):
-        if os.path.exists(self.json_file_path):
+        # Don't read files the worker is still writing
+        persistence.flush()
+        self.checkpoints, metadata, records = self.storage.load()
+        if metadata:
+            self.metadata = metadata
+        self.metadata.setdefault('journal_seq', 0)
+        for checkpoint in self.checkpoints.values():
+            self._prepare(checkpoint)
+        self.index.rebuild((checkpoint_id, self._position(checkpoint))
+                           for checkpoint_id, checkpoint in self.checkpoints.items())
+        for record in records:
+            self._apply(record)
+            self.metadata['journal_seq'] = record['seq']
+        self.version += 1
+        self._notify({'op': 'load'}, list(self.checkpoints))
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'add':
+            self._insert_checkpoint(record['checkpoint'])
+        elif op == 'add_batch':
+            self._insert_checkpoints(record['checkpoints'])
+        elif str(record['id']) not in self.checkpoints:
+            return
+        elif op == 'update':
+            self._update_checkpoint(record['id'], record['data'])
+        elif op == 'delete':
+            self._remove_checkpoint(record['id'])
+        elif op == 'passage':
+            self._append_passage(record['id'], record['passage'])
+
+    def _prepare(self, checkpoint):
+        # Files written before passage_stats existed get them from their history
+        if 'passage_stats' not in checkpoint:
+            checkpoint['passage_stats'] = stats_from_history(checkpoint['passage_history'])
+        elif 'angles' not in checkpoint['passage_stats']:
+            upgrade_stats(checkpoint['passage_stats'], checkpoint['passage_history'])
+        del checkpoint['passage_history'][:-self.history_depth]
+
+    def _journal(self, record, changed):
+        """Hands one mutation record (and the ids it touched) to the storage."""
+        self.metadata['journal_seq'] += 1
+        record['seq'] = self.metadata['journal_seq']
+        self.version += 1
+        self.storage.append(record, changed, self.checkpoints, self.metadata)
+        self._notify(record, changed)
+
+    def subscribe(self, listener):
+        """Calls listener(record, changed_ids) after every change (records as journaled, or {'op': 'load'})."""
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _notify(self, record, changed):
+        for listener in list(self.listeners):
             try:
-                with open(self.json_file_path, 'r') as f:
-                    data = json.load(f)
-                    self.checkpoints = data.get('checkpoints', {})
-                    self.metadata = data.get('metadata', self.metadata)
-            except json.JSONDecodeError:
-                print("Error: Invalid JSON file. Starting with empty data.")
-                self.checkpoints = {}
+                listener(record, changed)
             except Exception as e:
-                print(f"Error loading data: {e}")
-                self.checkpoints = {}
+                print(f"Checkpoint listener error: {e}")
 
     def save_data(self):
+        """Writes everything (compacts the JSON journal)."""
         try:
-            data = {
-                'checkpoints': self.checkpoints,
-                'metadata': {
-                    'last_checkpoint_id': self.metadata['last_checkpoint_id'],
-                    'last_update': datetime.now().isoformat()
-                }
-            }
-            with open(self.json_file_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            self.storage.save(self.checkpoints, self.metadata)
             return True
         except Exception as e:
             print(f"Error saving data: {e}")
             return False
 
+    def close(self):
+        """Final write at shutdown."""
+        self.storage.close(self.checkpoints, self.metadata)
+
     def add_checkpoint(self, position, passage_data, orientation=None):
         new_id = str(self.metadata['last_checkpoint_id'] + 1)
         
@@ -54,65 +128,221 @@ class CheckpointManager:
                 'z': position['z']
             },
             'connections': [],
-            'passage_history': [{
-                'timestamp': datetime.now().isoformat(),
-                'approach_side': passage_data['passage_info']['side'],
-                'lidar_readings': {
-                    'left': passage_data['passage_info']['left_lidar'],
-                    'right': passage_data['passage_info']['right_lidar']
-                },
-                'orientation': {
-                    'roll': orientation[0] if orientation else passage_data['orientation']['roll'],
-                    'pitch': orientation[1] if orientation else passage_data['orientation']['pitch'],
-                    'yaw': orientation[2] if orientation else passage_data['orientation']['yaw']
-                },
-                'velocity': {
-                    'vx': passage_data['velocity']['v_x'],
-                    'vy': passage_data['velocity']['v_y'],
-                    'vz': passage_data['velocity']['v_z']
-                }
-            }]
+            'passage_history': [self._passage_entry(passage_data, orientation)]
         }
 
-        self.checkpoints[new_id] = checkpoint_data
-        self.metadata['last_checkpoint_id'] = int(new_id)
-        
-        self._update_connections(new_id)
-        
-        self.save_data()
+        # Journaled as recorded; connections are rebuilt on replay
+        record = {'op': 'add', 'checkpoint': copy.deepcopy(checkpoint_data)}
+        self._insert_checkpoint(checkpoint_data)
+        changed = [new_id] + [str(conn['to_checkpoint_id']) for conn in checkpoint_data['connections']]
+        self._journal(record, changed)
         
         return new_id
 
+    def add_checkpoints(self, batch):
+        """
+        Adds many checkpoints at once: every entry is validated before
+        anything changes, connections are found in one vectorized pass and
+        the batch is persisted as a single record. Entries are dicts with a
+        'position' ({'x', 'y', 'z'}) and optionally 'passage_data' and
+        'orientation' as for add_checkpoint. Returns the new ids.
+        """
+        checkpoints = []
+        for number, entry in enumerate(batch):
+            position = entry.get('position') if isinstance(entry, dict) else None
+            try:
+                valid = all(isfinite(position[axis]) for axis in ('x', 'y', 'z'))
+            except (TypeError, KeyError):
+                valid = False
+            if not valid:
+                raise ValueError(f"Checkpoint batch entry {number} has no finite x/y/z position")
+            passage_history = []
+            if entry.get('passage_data') is not None:
+                try:
+                    passage_history.append(self._passage_entry(entry['passage_data'], entry.get('orientation')))
+                except (TypeError, KeyError) as e:
+                    raise ValueError(f"Checkpoint batch entry {number} has incomplete passage_data: {e}")
+            checkpoints.append({
+                'id': self.metadata['last_checkpoint_id'] + 1 + number,
+                'position': {'x': position['x'], 'y': position['y'], 'z': position['z']},
+                'connections': [],
+                'passage_history': passage_history
+            })
+        if not checkpoints:
+            return []
+
+        # Own copies of what _insert_checkpoints mutates; passage entries never change
+        record = {'op': 'add_batch', 'checkpoints': [
+            dict(checkpoint, position=dict(checkpoint['position']), connections=[],
+                 passage_history=list(checkpoint['passage_history']))
+            for checkpoint in checkpoints
+        ]}
+        changed = self._insert_checkpoints(checkpoints)
+        self._journal(record, changed)
+        return [str(checkpoint['id']) for checkpoint in checkpoints]
+
+    def _insert_checkpoints(self, checkpoints):
+        """
+        Inserts checkpoints with increasing ids and connects them exactly as
+        one _insert_checkpoint per entry would. Returns the touched ids.
+        """
+        ids = [int(checkpoint_id) for checkpoint_id in self.checkpoints]
+        positions = [self._position(checkpoint) for checkpoint in self.checkpoints.values()]
+        new_ids = np.array([checkpoint['id'] for checkpoint in checkpoints], dtype=np.int64)
+        new_positions = np.array([self._position(checkpoint) for checkpoint in checkpoints], dtype=float)
+        all_ids = np.concatenate([np.array(ids, dtype=np.int64), new_ids])
+        all_positions = np.concatenate([np.array(positions, dtype=float).reshape(-1, 3), new_positions])
+
+        for checkpoint in checkpoints:
+            checkpoint_id = str(checkpoint['id'])
+            self._prepare(checkpoint)
+            self.checkpoints[checkpoint_id] = checkpoint
+            self.index.insert(checkpoint_id, self._position(checkpoint))
+        self.metadata['last_checkpoint_id'] = max(self.metadata['last_checkpoint_id'], int(new_ids.max()))
+
+        # A pair connects when the other checkpoint existed as this one was added
+        i, j, distance = radius_pairs(new_positions, all_positions, self.CONNECTION_RADIUS)
+        keep = all_ids[j] < new_ids[i]
+        later, earlier, distance = new_ids[i][keep], all_ids[j][keep], distance[keep]
+
+        # Each side appends its new connections in increasing id order
+        owners = np.concatenate([later, earlier])
+        others = np.concatenate([earlier, later])
+        distances = np.concatenate([distance, distance])
+        order = np.lexsort((others, owners))
+        for owner, other, distance in zip(owners[order].tolist(), others[order].tolist(),
+                                          distances[order].tolist()):
+            self.checkpoints[str(owner)]['connections'].append({
+                'to_checkpoint_id': other,
+                'distance': distance,
+                'difficulty': 1.0,
+                'average_speed': 0.0,
+                'best_approach_angle': 0.0
+            })
+        return sorted(set(str(checkpoint_id) for checkpoint_id in owners.tolist()) |
+                      set(str(checkpoint_id) for checkpoint_id in new_ids.tolist()), key=int)
+
+    @staticmethod
+    def _passage_entry(passage_data, orientation=None):
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'approach_side': passage_data['passage_info']['side'],
+            'lidar_readings': {
+                'left': passage_data['passage_info']['left_lidar'],
+                'right': passage_data['passage_info']['right_lidar']
+            },
+            'orientation': {
+                'roll': orientation[0] if orientation else passage_data['orientation']['roll'],
+                'pitch': orientation[1] if orientation else passage_data['orientation']['pitch'],
+                'yaw': orientation[2] if orientation else passage_data['orientation']['yaw']
+            },
+            'velocity': {
+                'vx': passage_data['velocity']['v_x'],
+                'vy': passage_data['velocity']['v_y'],
+                'vz': passage_data['velocity']['v_z']
+            }
+        }
+
+    def record_passage(self, checkpoint_id, passage_data, orientation=None):
+        """Adds another passage through an existing checkpoint."""
+        if str(checkpoint_id) not in self.checkpoints:
+            return False
+        passage = self._passage_entry(passage_data, orientation)
+        self._append_passage(checkpoint_id, passage)
+        self._journal({'op': 'passage', 'id': int(checkpoint_id), 'passage': passage}, [str(checkpoint_id)])
+        return True
+
+    def _append_passage(self, checkpoint_id, passage):
+        checkpoint = self.checkpoints[str(checkpoint_id)]
+        history = checkpoint['passage_history']
+        history.append(passage)
+        del history[:-self.history_depth]
+        update_stats(checkpoint['passage_stats'], passage)
+
+    def _insert_checkpoint(self, checkpoint_data):
+        new_id = str(checkpoint_data['id'])
+        self._prepare(checkpoint_data)
+        self.checkpoints[new_id] = checkpoint_data
+        self.metadata['last_checkpoint_id'] = max(self.metadata['last_checkpoint_id'], int(new_id))
+        self.index.insert(new_id, self._position(checkpoint_data))
+        self._update_connections(new_id)
+
+    @staticmethod
+    def _position(checkpoint):
+        position = checkpoint['position']
+        return (position['x'], position['y'], position['z'])
+
     def _update_connections(self, new_checkpoint_id):
         new_checkpoint = self.checkpoints[new_checkpoint_id]
-        new_pos = new_checkpoint['position']
+        neighbours = self.index.within(self._position(new_checkpoint), self.CONNECTION_RADIUS)
+        # Same order as a scan over self.checkpoints (ids are assigned increasing)
+        neighbours.sort(key=lambda item: int(item[0]))
 
-        for checkpoint_id, checkpoint in self.checkpoints.items():
+        for checkpoint_id, distance in neighbours:
             if checkpoint_id == new_checkpoint_id:
                 continue
-            distance = sqrt(
-                (new_pos['x'] - checkpoint['position']['x'])**2 +
-                (new_pos['y'] - checkpoint['position']['y'])**2 +
-                (new_pos['z'] - checkpoint['position']['z'])**2
-            )
-
-
-            if distance <= 3.0:
-                new_checkpoint['connections'].append({
-                    'to_checkpoint_id': int(checkpoint_id),
-                    'distance': distance,
-                    'difficulty': 1.0,
-                    'average_speed': 0.0,
-                    'best_approach_angle': 0.0
-                })
-
-                checkpoint['connections'].append({
-                    'to_checkpoint_id': int(new_checkpoint_id),
-                    'distance': distance,
-                    'difficulty': 1.0,
-                    'average_speed': 0.0,
-                    'best_approach_angle': 0.0
-                })
+            checkpoint = self.checkpoints[checkpoint_id]
+            new_checkpoint['connections'].append({
+                'to_checkpoint_id': int(checkpoint_id),
+                'distance': distance,
+                'difficulty': 1.0,
+                'average_speed': 0.0,
+                'best_approach_angle': 0.0
+            })
+
+            checkpoint['connections'].append({
+                'to_checkpoint_id': int(new_checkpoint_id),
+                'distance': distance,
+                'difficulty': 1.0,
+                'average_speed': 0.0,
+                'best_approach_angle': 0.0
+            })
+
+    def find_within(self, position, radius):
+        """(checkpoint_id, distance) of every checkpoint within radius, closest first."""
+        found = self.index.within(position, radius)
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def find_nearest(self, position, k=1):
+        """(checkpoint_id, distance) of the k checkpoints closest to position."""
+        return self.index.nearest(position, k)
+
+    def get_checkpoints_in_box(self, low, high):
+        """Checkpoints whose position lies in the axis-aligned box [low, high]."""
+        if hasattr(self.storage, 'checkpoint_ids_in_box'):
+            # Indexed query on the stored rows, once the queued writes are in. A viewer
+            # also gets checkpoints the controller added after it loaded.
+            persistence.flush()
+            found = {}
+            for checkpoint_id in self.storage.checkpoint_ids_in_box(low, high):
+                checkpoint = self.checkpoints.get(checkpoint_id) or self.storage.get_checkpoint(checkpoint_id)
+                if checkpoint is not None:
+                    found[checkpoint_id] = checkpoint
+            return found
+        return {
+            checkpoint_id: checkpoint for checkpoint_id, checkpoint in self.checkpoints.items()
+            if all(lo <= value <= hi for lo, value, hi in zip(low, self._position(checkpoint), high))
+        }
+
+    def get_passages_between(self, start, end):
+        """(checkpoint_id, passage) for passages with start <= timestamp <= end (ISO strings)."""
+        if hasattr(self.storage, 'passages_between'):
+            persistence.flush()
+            return self.storage.passages_between(start, end)
+        passages = [
+            (checkpoint_id, passage) for checkpoint_id, checkpoint in self.checkpoints.items()
+            for passage in checkpoint['passage_history'] if start <= passage['timestamp'] <= end
+        ]
+        passages.sort(key=lambda item: item[1]['timestamp'])
+        return passages
+
+    def table(self):
+        """CheckpointTable of the current checkpoints (cached until the next change)."""
+        if self._table_version != self.version:
+            self._table = CheckpointTable.from_checkpoints(self.checkpoints)
+            self._table_version = self.version
+        return self._table
 
     def get_checkpoint(self, checkpoint_id):
         return self.checkpoints.get(str(checkpoint_id))
@@ -122,20 +352,53 @@ class CheckpointManager:
 
     def update_checkpoint(self, checkpoint_id, new_data):
         if str(checkpoint_id) in self.checkpoints:
-            self.checkpoints[str(checkpoint_id)].update(new_data)
-            self.save_data()
+            changed = self._update_checkpoint(checkpoint_id, new_data)
+            self._journal({'op': 'update', 'id': int(checkpoint_id), 'data': new_data}, changed)
             return True
         return False
 
+    def _update_checkpoint(self, checkpoint_id, new_data):
+        """Applies new_data; returns the ids whose stored form changed."""
+        checkpoint_id = str(checkpoint_id)
+        checkpoint = self.checkpoints[checkpoint_id]
+        checkpoint.update(new_data)
+        changed = [checkpoint_id]
+        if 'position' in new_data:
+            # A moved checkpoint is connected to the ones around its new place instead
+            changed += self._disconnect(checkpoint_id)
+            self.index.insert(checkpoint_id, self._position(checkpoint))
+            self._update_connections(checkpoint_id)
+            changed += [str(conn['to_checkpoint_id']) for conn in checkpoint['connections']]
+        return list(dict.fromkeys(changed))
+
+    def _disconnect(self, checkpoint_id):
+        """Drops a checkpoint's connections both ways; returns the ids it was connected to."""
+        checkpoint = self.checkpoints[checkpoint_id]
+        neighbours = [str(conn['to_checkpoint_id']) for conn in checkpoint['connections']]
+        for neighbour_id in neighbours:
+            neighbour = self.checkpoints[neighbour_id]
+            neighbour['connections'] = [
+                conn for conn in neighbour['connections']
+                if conn['to_checkpoint_id'] != int(checkpoint_id)
+            ]
+        checkpoint['connections'] = []
+        return neighbours
+
     def delete_checkpoint(self, checkpoint_id):
         if str(checkpoint_id) in self.checkpoints:
-            for checkpoint in self.checkpoints.values():
-                checkpoint['connections'] = [
-                    conn for conn in checkpoint['connections']
-                    if conn['to_checkpoint_id'] != int(checkpoint_id)
-                ]
-            
-            del self.checkpoints[str(checkpoint_id)]
-            self.save_data()
+            changed = [str(conn['to_checkpoint_id'])
+                       for conn in self.checkpoints[str(checkpoint_id)]['connections']]
+            self._remove_checkpoint(checkpoint_id)
+            self._journal({'op': 'delete', 'id': int(checkpoint_id)}, changed)
             return True
-        return False 
\ No newline at end of file
+        return False
+
+    def _remove_checkpoint(self, checkpoint_id):
+        for checkpoint in self.checkpoints.values():
+            checkpoint['connections'] = [
+                conn for conn in checkpoint['connections']
+                if conn['to_checkpoint_id'] != int(checkpoint_id)
+            ]
+        
+        del self.checkpoints[str(checkpoint_id)]
+        self.index.remove(str(checkpoint_id)) 
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+Storage backends for CheckpointManager. The manager keeps the checkpoints
+in memory and tells the backend about every mutation:
+
+    load()                                   -> (checkpoints, metadata, records)
+    append(record, changed, checkpoints, metadata)
+    save(checkpoints, metadata)              full rewrite
+    close(checkpoints, metadata)
+
+`records` are journaled mutations the manager still has to replay and
+`changed` the ids whose stored form the mutation modified. Loading never
+writes. A backend opened read_only (viewers running next to the
+controller) refuses every write and leaves the files as it found them.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import persistence
+
+
+def journal_path(json_file_path):
+    """Journal that goes with a checkpoint snapshot file."""
+    return os.path.splitext(json_file_path)[0] + ".journal"
+
+
+def open_storage(path, background=True, read_only=False):
+    """Picks the backend from the file extension (.db/.sqlite -> SQLite)."""
+    if os.path.splitext(path)[1] in (".db", ".sqlite"):
+        return SqliteCheckpointStorage(path, background, read_only)
+    return JsonCheckpointStorage(path, background, read_only)
+
+
+def _refuse_write(path):
+    raise PermissionError(f"{path} is opened read-only")
+
+
+def _metadata_snapshot(metadata):
+    return {
+        'last_checkpoint_id': metadata['last_checkpoint_id'],
+        'last_update': datetime.now().isoformat(),
+        'journal_seq': metadata['journal_seq']
+    }
+
+
+def _write_journal(path, payload):
+    # A snapshot (compaction) replaces the JSON file and restarts the journal
+    if payload['snapshot'] is not None:
+        persistence.write_json(payload['json_file_path'], payload['snapshot'])
+        mode = 'w'
+    else:
+        mode = 'a'
+    with open(path, mode) as f:
+        f.writelines(payload['records'])
+
+
+def _merge_journal(old, new):
+    # A queued snapshot already contains every record queued before it
+    if new['snapshot'] is not None:
+        return new
+    return dict(old, records=old['records'] + new['records'])
+
+
+class JsonCheckpointStorage:
+    """
+    The original checkpoints.json document plus an append-only journal of
+    the mutations made since. save() compacts (rewrites the snapshot and
+    empties the journal), which happens every COMPACT_EVERY records, on
+    the first append after a torn journal line and at close().
+    """
+    COMPACT_EVERY = 256
+
+    def __init__(self, json_file_path="checkpoints.json", background=True, read_only=False):
+        self.json_file_path = json_file_path
+        self.journal_path = journal_path(json_file_path)
+        # Writes go through the persistence worker instead of blocking the caller
+        self.background = background
+        self.read_only = read_only
+        # Records in the journal since the last snapshot
+        self.journal_length = 0
+        self.needs_compaction = False
+
+    def load(self):
+        checkpoints = {}
+        metadata = None
+        if os.path.exists(self.json_file_path):
+            try:
+                with open(self.json_file_path, 'r') as f:
+                    data = json.load(f)
+                    checkpoints = data.get('checkpoints', {})
+                    metadata = data.get('metadata')
+            except json.JSONDecodeError:
+                print("Error: Invalid JSON file. Starting with empty data.")
+            except Exception as e:
+                print(f"Error loading data: {e}")
+        snapshot_seq = metadata.get('journal_seq', 0) if metadata else 0
+        return checkpoints, metadata, self._read_journal(snapshot_seq)
+
+    def _read_journal(self, snapshot_seq):
+        records = []
+        self.journal_length = 0
+        if not os.path.exists(self.journal_path):
+            return records
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Interrupted (or still being written) while appending; everything before
+                    # is intact. The writer compacts before appending after the torn line.
+                    print(f"Warning: ignoring incomplete journal record in {self.journal_path}")
+                    self.needs_compaction = True
+                    break
+                # Records at or before the snapshot were already compacted into it
+                if record['seq'] <= snapshot_seq:
+                    continue
+                records.append(record)
+                self.journal_length += 1
+        return records
+
+    def _submit(self, snapshot, records):
+        if self.read_only:
+            _refuse_write(self.json_file_path)
+        payload = {'json_file_path': self.json_file_path, 'snapshot': snapshot, 'records': records}
+        if self.background:
+            persistence.get_worker().submit(self.journal_path, payload, _write_journal, merge=_merge_journal)
+        else:
+            _write_journal(self.journal_path, payload)
+
+    def append(self, record, changed, checkpoints, metadata):
+        """Appends one mutation record; compacts when the journal gets long."""
+        self.journal_length += 1
+        if self.journal_length >= self.COMPACT_EVERY or self.needs_compaction:
+            self.save(checkpoints, metadata)
+        else:
+            self._submit(None, [json.dumps(record) + "\n"])
+
+    def save(self, checkpoints, metadata):
+        data = {'checkpoints': checkpoints, 'metadata': _metadata_snapshot(metadata)}
+        self._submit(copy.deepcopy(data) if self.background else data, [])
+        self.journal_length = 0
+        self.needs_compaction = False
+
+    def close(self, checkpoints, metadata):
+        if self.read_only:
+            return
+        if self.journal_length or self.needs_compaction:
+            self.save(checkpoints, metadata)
+
+
+class SqliteCheckpointStorage:
+    """
+    One row per checkpoint (position columns indexed, the rest as JSON) and
+    one row per passage (indexed by timestamp) in a WAL-mode SQLite file,
+    so readers can query single checkpoints or ranges while the controller
+    writes. Mutations rewrite only the rows of the checkpoints they touch.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            id INTEGER PRIMARY KEY, x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS checkpoints_position ON checkpoints (x, y, z);
+        CREATE TABLE IF NOT EXISTS passages (
+            checkpoint_id INTEGER NOT NULL, seq INTEGER NOT NULL, timestamp TEXT NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (checkpoint_id, seq));
+        CREATE INDEX IF NOT EXISTS passages_timestamp ON passages (timestamp);
+        CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, db_path="checkpoints.db", background=True, read_only=False):
+        self.db_path = db_path
+        self.background = background
+        self.read_only = read_only
+        # Writes run on the persistence worker's thread and reads on the caller's:
+        # every use of the shared connection holds the lock
+        self.lock = threading.Lock()
+        if read_only:
+            # A missing database reads as empty instead of being created
+            self.connection = None
+            if os.path.exists(db_path):
+                self.connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def _query(self, sql, parameters=()):
+        if self.connection is None:
+            return []
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def load(self):
+        checkpoints = {}
+        for checkpoint_id, data in self._query("SELECT id, data FROM checkpoints ORDER BY id"):
+            checkpoint = json.loads(data)
+            checkpoint['passage_history'] = []
+            checkpoints[str(checkpoint_id)] = checkpoint
+        for checkpoint_id, data in self._query("SELECT checkpoint_id, data FROM passages ORDER BY checkpoint_id, seq"):
+            checkpoints[str(checkpoint_id)]['passage_history'].append(json.loads(data))
+        metadata = {key: json.loads(value) for key, value in self._query("SELECT key, value FROM metadata")}
+        return checkpoints, metadata or None, []
+
+    @staticmethod
+    def _rows(checkpoint):
+        # Serialized on the caller's thread: the payload must not share state
+        position = checkpoint['position']
+        data = {key: value for key, value in checkpoint.items() if key != 'passage_history'}
+        passages = [(seq, passage['timestamp'], json.dumps(passage))
+                    for seq, passage in enumerate(checkpoint['passage_history'])]
+        return (position['x'], position['y'], position['z'], json.dumps(data)), passages
+
+    def _write(self, path, payload):
+        with self.lock, self.connection:
+            for checkpoint_id, rows in payload['checkpoints'].items():
+                self.connection.execute("DELETE FROM passages WHERE checkpoint_id = ?", (checkpoint_id,))
+                if rows is None:
+                    self.connection.execute("DELETE FROM checkpoints WHERE id = ?", (checkpoint_id,))
+                    continue
+                checkpoint_row, passages = rows
+                self.connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                                        (checkpoint_id,) + checkpoint_row)
+                self.connection.executemany("INSERT INTO passages VALUES (?, ?, ?, ?)",
+                                            [(checkpoint_id,) + passage for passage in passages])
+            self.connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                        [(key, json.dumps(value)) for key, value in payload['metadata'].items()])
+
+    @staticmethod
+    def _merge(old, new):
+        return {'checkpoints': {**old['checkpoints'], **new['checkpoints']}, 'metadata': new['metadata']}
+
+    def _submit(self, rows, metadata):
+        if self.read_only:
+            _refuse_write(self.db_path)
+        payload = {'checkpoints': rows, 'metadata': _metadata_snapshot(metadata)}
+        if self.background:
+            persistence.get_worker().submit(self.db_path, payload, self._write, merge=self._merge)
+        else:
+            self._write(self.db_path, payload)
+
+    def append(self, record, changed, checkpoints, metadata):
+        rows = {int(checkpoint_id): self._rows(checkpoints[checkpoint_id]) for checkpoint_id in changed}
+        if record['op'] == 'delete':
+            rows[int(record['id'])] = None
+        self._submit(rows, metadata)
+
+    def save(self, checkpoints, metadata):
+        stored = [checkpoint_id for (checkpoint_id,) in self._query("SELECT id FROM checkpoints")]
+        rows = {checkpoint_id: None for checkpoint_id in stored}
+        rows.update({int(checkpoint_id): self._rows(checkpoint) for checkpoint_id, checkpoint in checkpoints.items()})
+        self._submit(rows, metadata)
+
+    def close(self, checkpoints, metadata):
+        # Every mutation is already queued; closing the last connection checkpoints the WAL
+        if self.background and not self.read_only:
+            persistence.flush()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+
+    # Queries straight from the database, for readers that don't load everything
+
+    def get_checkpoint(self, checkpoint_id):
+        if self.connection is None:
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM checkpoints WHERE id = ?", (int(checkpoint_id),)).fetchone()
+            passages = self.connection.execute("SELECT data FROM passages WHERE checkpoint_id = ? ORDER BY seq",
+                                               (int(checkpoint_id),)).fetchall()
+        if row is None:
+            return None
+        checkpoint = json.loads(row[0])
+        checkpoint['passage_history'] = [json.loads(data) for (data,) in passages]
+        return checkpoint
+
+    def checkpoint_ids_in_box(self, low, high):
+        return [str(checkpoint_id) for (checkpoint_id,) in self._query(
+            "SELECT id FROM checkpoints WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ? AND z BETWEEN ? AND ? "
+            "ORDER BY id", (low[0], high[0], low[1], high[1], low[2], high[2]))]
+
+    def passages_between(self, start, end):
+        return [(str(checkpoint_id), json.loads(data)) for checkpoint_id, data in self._query(
+            "SELECT checkpoint_id, data FROM passages WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp",
+            (start, end))]
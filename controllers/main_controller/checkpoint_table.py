@@ -0,0 +1,102 @@
+import numpy as np
+from pathfinding import CheckpointNode
+
+
+class CheckpointTable:
+    """
+    Struct-of-arrays view of the checkpoints: one row per checkpoint (in
+    CheckpointManager order), the last passage of each as orientation,
+    velocity and lidar baseline columns, and the connections as a CSR
+    adjacency (neighbours of row i are indices[indptr[i]:indptr[i + 1]]).
+    """
+    def __init__(self, ids, positions, orientations, velocities, lidar, has_passage,
+                 indptr, indices, distances, difficulty, average_speed):
+        self.ids = ids
+        self.positions = positions
+        self.orientations = orientations
+        self.velocities = velocities
+        # Left / right lidar at the last passage
+        self.lidar = lidar
+        self.has_passage = has_passage
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.difficulty = difficulty
+        self.average_speed = average_speed
+        self.row_of = {int(checkpoint_id): row for row, checkpoint_id in enumerate(ids.tolist())}
+
+    @classmethod
+    def from_checkpoints(cls, checkpoints):
+        n = len(checkpoints)
+        ids = np.empty(n, dtype=np.int64)
+        positions = np.zeros((n, 3))
+        orientations = np.zeros((n, 3))
+        velocities = np.zeros((n, 3))
+        lidar = np.zeros((n, 2))
+        has_passage = np.zeros(n, dtype=bool)
+        degree = np.zeros(n + 1, dtype=np.int64)
+        for row, (checkpoint_id, checkpoint) in enumerate(checkpoints.items()):
+            ids[row] = int(checkpoint_id)
+            position = checkpoint['position']
+            positions[row] = (position['x'], position['y'], position['z'])
+            if checkpoint['passage_history']:
+                last_passage = checkpoint['passage_history'][-1]
+                orientation = last_passage['orientation']
+                velocity = last_passage['velocity']
+                orientations[row] = (orientation['roll'], orientation['pitch'], orientation['yaw'])
+                velocities[row] = (velocity['vx'], velocity['vy'], velocity['vz'])
+                lidar[row] = (last_passage['lidar_readings']['left'], last_passage['lidar_readings']['right'])
+                has_passage[row] = True
+            degree[row + 1] = len(checkpoint['connections'])
+
+        indptr = np.cumsum(degree)
+        row_of = {int(checkpoint_id): row for row, checkpoint_id in enumerate(ids.tolist())}
+        connections = [(row_of.get(conn['to_checkpoint_id'], -1), conn['distance'], conn['difficulty'],
+                        conn['average_speed'])
+                       for checkpoint in checkpoints.values() for conn in checkpoint['connections']]
+        edges = np.array(connections, dtype=np.float64).reshape(-1, 4)
+        return cls(ids, positions, orientations, velocities, lidar, has_passage, indptr,
+                   edges[:, 0].astype(np.int64), edges[:, 1].copy(), edges[:, 2].copy(), edges[:, 3].copy())
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self.ids, self.positions, self.orientations, self.velocities, self.lidar, self.has_passage,
+            self.indptr, self.indices, self.distances, self.difficulty, self.average_speed))
+
+    def neighbours(self, row):
+        """Rows connected to `row` and the connection distances."""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:end], self.distances[start:end]
+
+    def distances_from(self, point):
+        return np.linalg.norm(self.positions - np.asarray(point, dtype=float), axis=1)
+
+    def id_order(self):
+        """Rows sorted by checkpoint id."""
+        return np.argsort(self.ids, kind='stable')
+
+    def nodes(self):
+        """CheckpointNodes for the planner, one per row, with the weighted connections as edges."""
+        nodes = []
+        for checkpoint_id, position, orientation, lidar, has_passage in zip(
+                self.ids.tolist(), self.positions.tolist(), self.orientations.tolist(),
+                self.lidar.tolist(), self.has_passage.tolist()):
+            node = CheckpointNode(checkpoint_id, tuple(position), tuple(orientation))
+            if has_passage:
+                node.potential_field['lidar_left'] = lidar[0]
+                node.potential_field['lidar_right'] = lidar[1]
+            nodes.append(node)
+        for row, node in enumerate(nodes):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            node.edges = [
+                (nodes[other], distance, difficulty, average_speed)
+                for other, distance, difficulty, average_speed in zip(
+                    self.indices[start:end].tolist(), self.distances[start:end].tolist(),
+                    self.difficulty[start:end].tolist(), self.average_speed[start:end].tolist())
+                if other >= 0
+            ]
+        return nodes
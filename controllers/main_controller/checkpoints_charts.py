@@ -1,15 +1,14 @@
 import matplotlib.pyplot as plt
-import json
 from mpl_toolkits.mplot3d import Axes3D
+from checkpoint_manager import CheckpointManager
 
 def visualize_checkpoints():
-    """Visualize checkpoint data from checkpoints.json file"""
+    """Visualize checkpoint data from checkpoints.json file (and its journal)"""
     try:
-        with open("checkpoints.json", 'r') as f:
-            data = json.load(f)
-            checkpoints = data['checkpoints']
+        manager = CheckpointManager(read_only=True)
+        table = manager.table()
         
-        if not checkpoints:
+        if not len(table):
             print("No checkpoint data found!")
             return
         
@@ -18,17 +17,9 @@ def visualize_checkpoints():
         
         # 3D Trajectory Plot
         ax1 = fig.add_subplot(221, projection='3d')
-        x_coords = []
-        y_coords = []
-        z_coords = []
-        
         # Sort checkpoints by ID to ensure correct order
-        sorted_checkpoints = sorted(checkpoints.items(), key=lambda x: int(x[0]))
-        
-        for cp_id, cp in sorted_checkpoints:
-            x_coords.append(cp['position']['x'])
-            y_coords.append(cp['position']['y'])
-            z_coords.append(cp['position']['z'])
+        order = table.id_order()
+        x_coords, y_coords, z_coords = table.positions[order].T
         
         ax1.plot(x_coords, y_coords, z_coords, 'b-', label='Trajectory')
         ax1.scatter(x_coords, y_coords, z_coords, c='r', marker='o', label='Checkpoints')
@@ -49,16 +40,9 @@ def visualize_checkpoints():
         
         # Orientation Plot
         ax3 = fig.add_subplot(223)
-        roll = []
-        pitch = []
-        yaw = []
-        
-        for cp_id, cp in sorted_checkpoints:
-            if cp['passage_history']:
-                last_passage = cp['passage_history'][-1]
-                roll.append(last_passage['orientation']['roll'])
-                pitch.append(last_passage['orientation']['pitch'])
-                yaw.append(last_passage['orientation']['yaw'])
+        # Only checkpoints with a recorded passage
+        passed = order[table.has_passage[order]]
+        roll, pitch, yaw = table.orientations[passed].T
         
         ax3.plot(roll, 'r-', label='Roll')
         ax3.plot(pitch, 'g-', label='Pitch')
@@ -71,16 +55,7 @@ def visualize_checkpoints():
         
         # Velocity Plot
         ax4 = fig.add_subplot(224)
-        v_x = []
-        v_y = []
-        v_z = []
-        
-        for cp_id, cp in sorted_checkpoints:
-            if cp['passage_history']:
-                last_passage = cp['passage_history'][-1]
-                v_x.append(last_passage['velocity']['vx'])  # Changed from v_x to vx
-                v_y.append(last_passage['velocity']['vy'])  # Changed from v_y to vy
-                v_z.append(last_passage['velocity']['vz'])  # Changed from v_z to vz
+        v_x, v_y, v_z = table.velocities[passed].T
         
         ax4.plot(v_x, 'r-', label='Vx')
         ax4.plot(v_y, 'g-', label='Vy')
@@ -92,7 +67,7 @@ def visualize_checkpoints():
         ax4.legend()
         
         # Add metadata information
-        metadata = data.get('metadata', {})
+        metadata = manager.metadata
         if metadata:
             last_update = metadata.get('last_update', 'N/A')
             last_checkpoint_id = metadata.get('last_checkpoint_id', 'N/A')
@@ -0,0 +1,94 @@
+from math import pi
+
+TWO_PI = 2 * pi
+
+
+def wrap_angle(angle):
+    """Wraps an angle to [-pi, pi) in constant time."""
+    return (angle + pi) % TWO_PI - pi
+
+
+def clip(value, low, high):
+    return low if value < low else (high if value > high else value)
+
+
+class VelocityHeightKernel:
+    """
+    Scalar hot path of the velocity / fixed-height PID controller.
+    Gains are frozen at construction, the arithmetic stays on Python floats
+    and step() writes into the same 4-element motor list every call.
+    """
+    __slots__ = ('kp_att_y', 'kd_att_y', 'kp_att_rp', 'kd_att_rp', 'kp_vel_xy', 'kd_vel_xy',
+                 'kp_z', 'ki_z', 'kd_z', 'base_thrust', 'max_motor',
+                 'past_vx_error', 'past_vy_error', 'past_alt_error', 'past_pitch_error',
+                 'past_roll_error', 'altitude_integrator', 'motor_power')
+
+    def __init__(self, kp_att_y=1.0, kd_att_y=0.5, kp_att_rp=0.5, kd_att_rp=0.1,
+                 kp_vel_xy=2.0, kd_vel_xy=0.5, kp_z=10.0, ki_z=5.0, kd_z=5.0,
+                 base_thrust=48.0, max_motor=600.0):
+        self.kp_att_y = kp_att_y
+        self.kd_att_y = kd_att_y
+        self.kp_att_rp = kp_att_rp
+        self.kd_att_rp = kd_att_rp
+        self.kp_vel_xy = kp_vel_xy
+        self.kd_vel_xy = kd_vel_xy
+        self.kp_z = kp_z
+        self.ki_z = ki_z
+        self.kd_z = kd_z
+        self.base_thrust = base_thrust
+        self.max_motor = max_motor
+
+        self.past_vx_error = 0.0
+        self.past_vy_error = 0.0
+        self.past_alt_error = 0.0
+        self.past_pitch_error = 0.0
+        self.past_roll_error = 0.0
+        self.altitude_integrator = 0.0
+        self.motor_power = [0.0, 0.0, 0.0, 0.0]
+
+    def step(self, dt, desired_vx, desired_vy, desired_yaw_rate, desired_altitude, actual_roll, actual_pitch,
+             actual_yaw_rate, actual_altitude, actual_vx, actual_vy):
+        # Velocity PID control
+        vx_error = desired_vx - actual_vx
+        vy_error = desired_vy - actual_vy
+        vx_deriv = (vx_error - self.past_vx_error) / dt
+        vy_deriv = (vy_error - self.past_vy_error) / dt
+        desired_pitch = self.kp_vel_xy * clip(vx_error, -1.0, 1.0) + self.kd_vel_xy * vx_deriv
+        desired_roll = -self.kp_vel_xy * clip(vy_error, -1.0, 1.0) - self.kd_vel_xy * vy_deriv
+        self.past_vx_error = vx_error
+        self.past_vy_error = vy_error
+
+        # Altitude PID control
+        alt_error = desired_altitude - actual_altitude
+        alt_deriv = (alt_error - self.past_alt_error) / dt
+        integrator = self.altitude_integrator + alt_error * dt
+        self.altitude_integrator = integrator
+        alt_command = self.kp_z * alt_error + self.kd_z * alt_deriv + \
+            self.ki_z * clip(integrator, -2.0, 2.0) + self.base_thrust
+        self.past_alt_error = alt_error
+
+        # Attitude PID control
+        pitch_error = desired_pitch - actual_pitch
+        pitch_deriv = (pitch_error - self.past_pitch_error) / dt
+        roll_error = desired_roll - actual_roll
+        roll_deriv = (roll_error - self.past_roll_error) / dt
+        roll_command = self.kp_att_rp * clip(roll_error, -1.0, 1.0) + self.kd_att_rp * roll_deriv
+        pitch_command = -self.kp_att_rp * clip(pitch_error, -1.0, 1.0) - self.kd_att_rp * pitch_deriv
+        yaw_command = self.kp_att_y * clip(desired_yaw_rate - actual_yaw_rate, -1.0, 1.0)
+        self.past_pitch_error = pitch_error
+        self.past_roll_error = roll_error
+
+        # Motor mixing and limits
+        max_motor = self.max_motor
+        motor_power = self.motor_power
+        motor_power[0] = clip(alt_command - roll_command + pitch_command + yaw_command, 0.0, max_motor)
+        motor_power[1] = clip(alt_command - roll_command - pitch_command - yaw_command, 0.0, max_motor)
+        motor_power[2] = clip(alt_command + roll_command - pitch_command + yaw_command, 0.0, max_motor)
+        motor_power[3] = clip(alt_command + roll_command + pitch_command - yaw_command, 0.0, max_motor)
+        return motor_power
+
+    def step_frame(self, dt, desired_vx, desired_vy, desired_yaw_rate, desired_altitude, frame,
+                   actual_vx, actual_vy):
+        """step() with attitude, yaw rate and altitude taken from a SensorFrame."""
+        return self.step(dt, desired_vx, desired_vy, desired_yaw_rate, desired_altitude,
+                         frame.roll, frame.pitch, frame.yaw_rate, frame.z, actual_vx, actual_vy)
@@ -0,0 +1,284 @@
+"""
+Course plan kept up to date from CheckpointManager changes.
+
+The plan is the gate order plus one A* leg per consecutive pair. When a
+checkpoint is added, moved or deleted only the nodes around it are
+refreshed and only the legs that can change are planned again: those that
+start, end or pass at a touched gate, and those that the new connections
+of an added or moved gate could make cheaper or link for the first time.
+Finding the latter searches the graph only as far as the costliest leg
+(the whole connected part while some leg is unlinked). A new gate goes
+where it is cheapest to fly in the order; a moved one keeps its place.
+The lap path (legs joined, cornering points added) is assembled lazily,
+once per change, when path() is asked for it; until the next change every
+lap start gets it back without planning anything.
+"""
+import heapq
+from gate_order import best_insertion
+from pathfinding import CheckpointNode, add_intermediate_points, create_checkpoint_connections, edge_cost, shortest_path
+
+# Leg costs equal up to this are ties, which A* may break either way
+COST_TOLERANCE = 1e-9
+
+
+def checkpoint_node(checkpoint):
+    """CheckpointNode of a CheckpointManager checkpoint, as CheckpointTable.nodes() builds it."""
+    position = checkpoint['position']
+    orientation = (0.0, 0.0, 0.0)
+    history = checkpoint['passage_history']
+    if history:
+        last_passage = history[-1]
+        orientation = (last_passage['orientation']['roll'], last_passage['orientation']['pitch'],
+                       last_passage['orientation']['yaw'])
+    node = CheckpointNode(int(checkpoint['id']), (position['x'], position['y'], position['z']), orientation)
+    if history:
+        node.potential_field['lidar_left'] = history[-1]['lidar_readings']['left']
+        node.potential_field['lidar_right'] = history[-1]['lidar_readings']['right']
+    return node
+
+
+class CoursePlanner:
+    def __init__(self, manager, order=None, closed=True):
+        self.manager = manager
+        self.closed = closed
+        # CheckpointNode by checkpoint id (int)
+        self.nodes = {}
+        # Checkpoint ids in flight order
+        self.order = []
+        # (from_id, to_id) -> A* route between consecutive gates, both ends included
+        self.legs = {}
+        # (from_id, to_id) -> cost of that route, inf when the graph does not link the gates
+        self.leg_costs = {}
+        # Checkpoint id -> legs whose route visits it
+        self.legs_through = {}
+        self._path = None
+        self.stats = {'rebuilds': 0, 'updates': 0, 'legs_planned': 0}
+        self.rebuild(order)
+        manager.subscribe(self.on_change)
+
+    def close(self):
+        self.manager.unsubscribe(self.on_change)
+
+    def rebuild(self, order=None):
+        """Plans the whole course again, in `order` (default: the current order, then new ids)."""
+        self.nodes = {node.id: node for node in self.manager.table().nodes()}
+        if order is None:
+            order = self.order + sorted(set(self.nodes) - set(self.order))
+        self.order = [checkpoint_id for checkpoint_id in order if checkpoint_id in self.nodes]
+        self.legs = {}
+        self.leg_costs = {}
+        self.legs_through = {}
+        sequence = [self.nodes[checkpoint_id] for checkpoint_id in self.order]
+        create_checkpoint_connections(sequence)
+        for current, next_cp in zip(self.order, self.order[1:]):
+            self._plan_leg(current, next_cp)
+        self._path = None
+        self.stats['rebuilds'] += 1
+
+    def on_change(self, record, changed):
+        op = record['op']
+        if op == 'load':
+            self.rebuild()
+            return
+        if op == 'passage':
+            self._refresh_node(record['id'])
+            self._refresh_transitions({record['id']})
+            self._path = None
+            return
+
+        touched = {int(checkpoint_id) for checkpoint_id in changed}
+        if op == 'add':
+            added = [int(record['checkpoint']['id'])]
+        elif op == 'add_batch':
+            added = [int(checkpoint['id']) for checkpoint in record['checkpoints']]
+        else:
+            added = []
+        deleted = record['id'] if op == 'delete' else None
+        # Every connection of a moved gate is new; its old ones are gone from the legs through it
+        moved = [record['id']] if op == 'update' and 'position' in record['data'] else []
+        if op == 'update':
+            touched.add(record['id'])
+
+        replan = set()
+        if deleted is not None and deleted in self.nodes:
+            del self.nodes[deleted]
+            position = self.order.index(deleted)
+            self.order.pop(position)
+            for key in [key for key in self.legs if deleted in key]:
+                self._drop_leg(key)
+            replan |= self.legs_through.pop(deleted, set())
+            if 0 < position < len(self.order):
+                replan.add((self.order[position - 1], self.order[position]))
+        for checkpoint_id in added:
+            self.nodes[checkpoint_id] = checkpoint_node(self.manager.get_checkpoint(checkpoint_id))
+        for checkpoint_id in touched - set(added):
+            self._refresh_node(checkpoint_id)
+        for checkpoint_id in touched:
+            self._refresh_edges(checkpoint_id)
+        for checkpoint_id in added:
+            replan |= self._insert(checkpoint_id)
+
+        # Routes that start, end or pass at a touched gate may have changed
+        for checkpoint_id in touched:
+            replan |= self.legs_through.get(checkpoint_id, set())
+        # New connections all end at an added or moved gate: any other leg they improve goes through one
+        if added or moved:
+            replan |= self._improvable_legs(added + moved, replan)
+        replan = {key for key in replan if self._is_leg(key)}
+        for key in replan:
+            self._drop_leg(key)
+            self._plan_leg(*key)
+        self._refresh_transitions(touched | set(added) | {key[0] for key in replan})
+        self._path = None
+        self.stats['updates'] += 1
+        self.stats['legs_planned'] += len(replan)
+
+    def _is_leg(self, key):
+        # Still consecutive in the order
+        current, next_cp = key
+        if current not in self.nodes or next_cp not in self.nodes:
+            return False
+        position = self.order.index(current)
+        return position + 1 < len(self.order) and self.order[position + 1] == next_cp
+
+    def _insert(self, checkpoint_id):
+        """Puts a new gate where it is cheapest to fly; returns the legs to plan."""
+        self.order = [other for other in self.order if other != checkpoint_id]
+        node = self.nodes[checkpoint_id]
+        positions = [self.nodes[other].position for other in self.order]
+        headings = [self._heading(self.nodes[other]) for other in self.order]
+        position = best_insertion(positions, headings, node.position, self._heading(node), self.closed)
+        self.order.insert(position, checkpoint_id)
+        legs = set()
+        if position > 0:
+            legs.add((self.order[position - 1], checkpoint_id))
+        if position + 1 < len(self.order):
+            legs.add((checkpoint_id, self.order[position + 1]))
+        if 0 < position < len(self.order) - 1:
+            self._drop_leg((self.order[position - 1], self.order[position + 1]))
+        return legs
+
+    def _heading(self, node):
+        # Gates without a recorded passage have no heading
+        return node.orientation[2] if self.manager.get_checkpoint(node.id)['passage_history'] else float('nan')
+
+    def _refresh_node(self, checkpoint_id):
+        checkpoint = self.manager.get_checkpoint(checkpoint_id)
+        node = self.nodes.get(int(checkpoint_id))
+        if checkpoint is None or node is None:
+            return
+        fresh = checkpoint_node(checkpoint)
+        node.position = fresh.position
+        node.orientation = fresh.orientation
+        node.potential_field['lidar_left'] = fresh.potential_field['lidar_left']
+        node.potential_field['lidar_right'] = fresh.potential_field['lidar_right']
+
+    def _refresh_edges(self, checkpoint_id):
+        checkpoint = self.manager.get_checkpoint(checkpoint_id)
+        node = self.nodes.get(int(checkpoint_id))
+        if checkpoint is None or node is None:
+            return
+        node.edges = [
+            (self.nodes[conn['to_checkpoint_id']], conn['distance'], conn['difficulty'], conn['average_speed'])
+            for conn in checkpoint['connections'] if conn['to_checkpoint_id'] in self.nodes
+        ]
+
+    def _refresh_transitions(self, checkpoint_ids):
+        # Same per-node attributes as create_checkpoint_connections, for the gates around a change
+        order = self.order
+        for checkpoint_id in checkpoint_ids:
+            if checkpoint_id not in self.nodes:
+                continue
+            position = order.index(checkpoint_id)
+            for index in (position - 1, position):
+                if 0 <= index < len(order) - 1:
+                    current, next_cp = self.nodes[order[index]], self.nodes[order[index + 1]]
+                    current.transition_type = current.calculate_transition_type(next_cp)
+                    current.approach_angle = current.calculate_approach_angle(next_cp)
+                    current.exit_angle = current.calculate_exit_angle(next_cp)
+                    current.connections = [next_cp]
+            if position == len(order) - 1:
+                self.nodes[checkpoint_id].connections = []
+
+    def _improvable_legs(self, sources, replan):
+        """
+        Legs not in `replan` for which a route through one of the source
+        gates could be cheaper than (or as cheap as) the planned one, or
+        link gates the graph did not link before.
+        """
+        sources = [checkpoint_id for checkpoint_id in sources if checkpoint_id in self.nodes]
+        if not sources:
+            return set()
+        # A route through a source costs at least each of its halves: no need to look further
+        bound = max((cost for key, cost in self.leg_costs.items() if key not in replan), default=0.0)
+        to_sources = self._costs(sources, bound, reverse=True)
+        from_sources = self._costs(sources, bound, reverse=False)
+        legs = set()
+        for checkpoint_id, cost_to in to_sources.items():
+            for key in self.legs_through.get(checkpoint_id, ()):
+                if key[0] != checkpoint_id or key in replan:
+                    continue
+                # Lower bound of the cheapest route through any source
+                through = cost_to + from_sources.get(key[1], float('inf'))
+                if through < float('inf') and through <= self.leg_costs[key] + COST_TOLERANCE:
+                    legs.add(key)
+        return legs
+
+    def _costs(self, sources, bound, reverse):
+        """Dijkstra costs up to `bound` from the source gates (to them when reverse) over the edges."""
+        costs = {checkpoint_id: 0.0 for checkpoint_id in sources}
+        heap = [(0.0, checkpoint_id) for checkpoint_id in sources]
+        while heap:
+            cost, checkpoint_id = heapq.heappop(heap)
+            if cost > costs[checkpoint_id]:
+                continue
+            for neighbour_id, step in self._steps(self.nodes[checkpoint_id], reverse):
+                new_cost = cost + step
+                if new_cost <= bound + COST_TOLERANCE and new_cost < costs.get(neighbour_id, float('inf')):
+                    costs[neighbour_id] = new_cost
+                    heapq.heappush(heap, (new_cost, neighbour_id))
+        return costs
+
+    @staticmethod
+    def _steps(node, reverse):
+        # Connections are made both ways, so the gates with an edge into a node are its neighbours
+        for neighbour, distance, difficulty, average_speed in node.edges:
+            if reverse:
+                edge = next((edge for edge in neighbour.edges if edge[0] is node), None)
+                if edge is None:
+                    continue
+                distance, difficulty, average_speed = edge[1:]
+            yield neighbour.id, edge_cost(distance, difficulty, average_speed)
+
+    def _plan_leg(self, current, next_cp):
+        route = shortest_path(self.nodes[current], self.nodes[next_cp])
+        key = (current, next_cp)
+        if route is None:
+            route = [self.nodes[current], self.nodes[next_cp]]
+            self.leg_costs[key] = float('inf')
+        else:
+            self.leg_costs[key] = sum(edge_cost(*next(edge[1:] for edge in node.edges if edge[0] is next_node))
+                                      for node, next_node in zip(route, route[1:]))
+        self.legs[key] = route
+        for node in route:
+            self.legs_through.setdefault(node.id, set()).add(key)
+
+    def _drop_leg(self, key):
+        route = self.legs.pop(key, None)
+        self.leg_costs.pop(key, None)
+        for node in route or ():
+            through = self.legs_through.get(node.id)
+            if through is not None:
+                through.discard(key)
+
+    def path(self):
+        """The lap path through every gate in order, with the cornering points."""
+        if self._path is None:
+            if not self.order:
+                return None
+            route = [self.nodes[self.order[0]]]
+            for key in zip(self.order, self.order[1:]):
+                route.extend(self.legs[key][1:])
+            self._path = add_intermediate_points(route)
+            print(f"\nBulunan yol: {' -> '.join(str(cp.id) for cp in self._path)}")
+        return list(self._path)
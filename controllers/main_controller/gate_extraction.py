@@ -0,0 +1,267 @@
+"""
+Gates extracted offline from recorded laps.
+
+Every route_data_lap_*.json holds the position, attitude and the four
+range readings of each sample. The passages of a lap are found in one
+vectorized pass over its whole range series with the PassageDetector
+rules (open below the threshold, close after RELEASE_SAMPLES clear
+samples and RELEASE_DISTANCE of flight, measured here along the path
+rather than straight), passages of all laps that lie within
+CLUSTER_RADIUS of each other are merged into one gate, and the new gates
+go into the checkpoint store as a single add_checkpoints batch.
+
+    cd controllers/main_controller
+    python gate_extraction.py                        # every route_data_lap_*.json here
+    python gate_extraction.py logs/*.json --min-passages 2 --dry-run
+"""
+import argparse
+import glob
+import json
+import numpy as np
+from passage_detector import EXIT_MARGIN, RELEASE_DISTANCE, RELEASE_SAMPLES, VELOCITY_WINDOW, WALL_RANGE
+from route_recorder import LIDAR_NAMES, ROUTE_DTYPE
+from spatial_index import radius_pairs
+
+# Passages this close are the same gate (as key_controller.SAME_GATE_RADIUS)
+CLUSTER_RADIUS = 0.5
+MIN_PASSAGES = 1
+PASSAGE_FIELDS = ('centre', 'two_sided', 'heading', 'speed', 'velocity', 'orientation', 'left', 'right', 'timestamp',
+                  'phase', 'samples')
+
+
+def load_route(path):
+    """A route_data_lap_*.json file as ROUTE_DTYPE rows."""
+    with open(path) as f:
+        points = json.load(f)['points']
+    route = np.zeros(len(points), dtype=ROUTE_DTYPE)
+    if not points:
+        return route
+    route['timestamp'] = [point['timestamp'] for point in points]
+    route['position'] = [point['position'] for point in points]
+    route['orientation'] = [point['orientation'] for point in points]
+    route['velocity'] = [point['velocity'] for point in points]
+    # null (NaN in the recorder) for a disabled sensor
+    route['lidar'] = np.array([[point['lidar_readings'][name] for name in LIDAR_NAMES] for point in points],
+                              dtype=float)
+    route['checkpoint_id'] = [-1 if point['checkpoint_id'] is None else point['checkpoint_id'] for point in points]
+    route['is_checkpoint'] = [point['is_checkpoint'] for point in points]
+    return route
+
+
+def detect_passages(route, threshold=0.5, exit_margin=EXIT_MARGIN, release_samples=RELEASE_SAMPLES,
+                    release_distance=RELEASE_DISTANCE, velocity_window=VELOCITY_WINDOW):
+    """
+    Passages of one lap as arrays (one row each): centre (two_sided when
+    both side ranges saw the ring, else the drone position), heading, speed,
+    velocity, the attitude and side ranges of the most balanced sample,
+    its timestamp and lap phase (fraction of the lap time) and the number
+    of samples inside the ring.
+    """
+    t = route['timestamp']
+    position = route['position']
+    yaw = route['orientation'][:, 2]
+    left, right = route['lidar'][:, 2], route['lidar'][:, 3]
+    with np.errstate(invalid='ignore'):
+        inside = (left < threshold) | (right < threshold)
+        near = (left < threshold + exit_margin) | (right < threshold + exit_margin)
+    # While a passage is open every sample that is not clear belongs to it
+    rows = np.nonzero(near)[0]
+    if not inside.any():
+        return _no_passages()
+
+    # Longest run of clear samples and path flown between consecutive samples that are not clear
+    clear_count = np.cumsum(~near)
+    clear_run = clear_count - np.maximum.accumulate(np.where(near, clear_count, 0))
+    flown = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(position, axis=0), axis=1))])
+    gap = np.diff(rows) > 1
+    longest = np.zeros(len(rows) - 1, dtype=int)
+    if gap.any():
+        # Each segment runs to the next gap (no clear samples in between); the one after the last row is dropped
+        starts = np.append(rows[:-1][gap] + 1, rows[-1] + 1)
+        longest[gap] = np.maximum.reduceat(np.append(clear_run, 0), starts)[:-1]
+    released = gap & (longest >= release_samples) & (flown[rows[1:]] - flown[rows[:-1]] >= release_distance)
+    label = np.concatenate([[0], np.cumsum(released)])
+
+    # A passage opens at its first sample inside; earlier near samples and groups never inside drop out
+    first_inside = np.full(label[-1] + 1, len(rows))
+    np.minimum.at(first_inside, label[inside[rows]], np.nonzero(inside[rows])[0])
+    keep = np.arange(len(rows)) >= first_inside[label]
+    rows = rows[keep]
+    label = np.unique(label[keep], return_inverse=True)[1]
+    count = label[-1] + 1
+    samples = np.bincount(label, minlength=count)
+
+    # Wall points seen by each side range; the centre is midway between the two sides
+    left_hit = left[rows] < WALL_RANGE
+    right_hit = right[rows] < WALL_RANGE
+    across = np.column_stack([-np.sin(yaw[rows]), np.cos(yaw[rows])])
+    left_wall = position[rows, :2] + left[rows, None] * across
+    right_wall = position[rows, :2] - right[rows, None] * across
+    left_samples = np.bincount(label, left_hit, count)
+    right_samples = np.bincount(label, right_hit, count)
+    both = (left_samples > 0) & (right_samples > 0)
+    centre = np.zeros((count, 3))
+    for k in range(2):
+        left_mean = np.bincount(label, np.where(left_hit, left_wall[:, k], 0.0), count) / np.maximum(left_samples, 1)
+        right_mean = np.bincount(label, np.where(right_hit, right_wall[:, k], 0.0), count) / np.maximum(right_samples, 1)
+        centre[:, k] = 0.5 * (left_mean + right_mean)
+    centre[:, 2] = np.bincount(label, position[rows, 2], count) / samples
+
+    # Most balanced sample of each passage (first of its passage after sorting)
+    balance = np.abs(left[rows] - right[rows])
+    balance = np.where(np.isnan(balance), np.inf, balance)
+    order = np.lexsort((balance, label))
+    best = rows[order[np.concatenate([[0], np.cumsum(samples)[:-1]])]]
+    centre[~both, :2] = position[best[~both], :2]
+
+    # Velocity over the last samples up to the last one inside
+    last = rows[np.cumsum(samples) - 1]
+    first = np.maximum(last - velocity_window, 0)
+    elapsed = t[last] - t[first]
+    velocity = np.divide(position[last] - position[first], elapsed[:, None], out=np.zeros((count, 3)),
+                         where=elapsed[:, None] > 0)
+    heading = np.where(np.any(velocity[:, :2] != 0, axis=1), np.arctan2(velocity[:, 1], velocity[:, 0]), np.nan)
+
+    return {
+        'centre': centre,
+        'two_sided': both,
+        'heading': heading,
+        'speed': np.linalg.norm(velocity, axis=1),
+        'velocity': velocity,
+        'orientation': route['orientation'][best],
+        'left': left[best],
+        'right': right[best],
+        'timestamp': t[best],
+        'phase': (t[best] - t[0]) / max(t[-1] - t[0], 1e-9),
+        'samples': samples,
+    }
+
+
+def _no_passages():
+    passages = {name: np.empty(0) for name in PASSAGE_FIELDS}
+    for name in ('centre', 'velocity', 'orientation'):
+        passages[name] = np.empty((0, 3))
+    passages['two_sided'] = np.empty(0, dtype=bool)
+    passages['samples'] = np.empty(0, dtype=int)
+    return passages
+
+
+def cluster(centres, radius=CLUSTER_RADIUS):
+    """Cluster label of every centre: centres chained by distances <= radius share one."""
+    labels = np.arange(len(centres))
+    i, j, _ = radius_pairs(centres, centres, radius)
+    while True:
+        merged = labels.copy()
+        np.minimum.at(merged, i, labels[j])
+        merged = merged[merged]
+        if np.array_equal(merged, labels):
+            break
+        labels = merged
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def consolidate(passages, radius=CLUSTER_RADIUS, min_passages=MIN_PASSAGES):
+    """
+    Gates from the passages of many laps (detect_passages outputs), as
+    add_checkpoints entries in flight order (median lap phase). Each gate
+    is the median of its passages, of the two-sided ones when there are
+    any; its passage data is the passage closest to that median.
+    """
+    merged = {name: np.concatenate([lap[name] for lap in passages]) for name in passages[0]}
+    labels = cluster(merged['centre'], radius)
+    entries = []
+    for label in np.unique(labels):
+        members = np.nonzero(labels == label)[0]
+        if len(members) < min_passages:
+            continue
+        phase = np.median(merged['phase'][members])
+        if merged['two_sided'][members].any():
+            members = members[merged['two_sided'][members]]
+        centre = np.median(merged['centre'][members], axis=0)
+        closest = members[np.argmin(np.linalg.norm(merged['centre'][members] - centre, axis=1))]
+        entries.append((phase, {
+            'position': {'x': float(centre[0]), 'y': float(centre[1]), 'z': float(centre[2])},
+            'passage_data': _passage_data(merged, closest),
+        }))
+    entries.sort(key=lambda entry: entry[0])
+    return [entry for _, entry in entries]
+
+
+def _passage_data(passages, row):
+    # Same layout as PassageDetector passages
+    roll, pitch, yaw = passages['orientation'][row].tolist()
+    v_x, v_y, v_z = passages['velocity'][row].tolist()
+    left, right = float(passages['left'][row]), float(passages['right'][row])
+    return {
+        'position': dict(zip('xyz', passages['centre'][row].tolist())),
+        'orientation': {'roll': roll, 'pitch': pitch, 'yaw': yaw},
+        'velocity': {'v_x': v_x, 'v_y': v_y, 'v_z': v_z},
+        'passage_info': {
+            'side': "left" if left < right else "right",
+            'left_lidar': left,
+            'right_lidar': right,
+            'timestamp': float(passages['timestamp'][row]),
+            'heading': float(passages['heading'][row]),
+            'speed': float(passages['speed'][row]),
+            'samples': int(passages['samples'][row])
+        }
+    }
+
+
+def extract_gates(paths, threshold=0.5, radius=CLUSTER_RADIUS, min_passages=MIN_PASSAGES):
+    """add_checkpoints entries for the gates flown in the given lap files."""
+    passages = []
+    for path in paths:
+        try:
+            passages.append(detect_passages(load_route(path), threshold))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{path} dosyası okunurken hata: {e}")
+    if not passages:
+        return []
+    return consolidate(passages, radius, min_passages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract gates from recorded laps into the checkpoint store")
+    parser.add_argument('paths', nargs='*', help="lap files (default: route_data_lap_*.json)")
+    parser.add_argument('--checkpoints', default="checkpoints.json", help="checkpoint store to add the gates to")
+    parser.add_argument('--threshold', type=float, default=0.5, help="side range that opens a passage")
+    parser.add_argument('--min-passages', type=int, default=MIN_PASSAGES,
+                        help="drop gates seen fewer times than this")
+    parser.add_argument('--dry-run', action='store_true', help="print the gates without writing them")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob("route_data_lap_*.json"))
+    if not paths:
+        print("Hiç tur verisi bulunamadı!")
+        return
+    entries = extract_gates(paths, args.threshold, min_passages=args.min_passages)
+    print(f"{len(paths)} tur dosyasından {len(entries)} kapı çıkarıldı")
+
+    from checkpoint_manager import CheckpointManager
+    import persistence
+    # A dry run only reads the store: nothing is created, compacted or written
+    manager = CheckpointManager(args.checkpoints, read_only=args.dry_run)
+    # Gates already in the store are left alone
+    new_entries = []
+    for entry in entries:
+        position = entry['position']
+        nearest = manager.find_nearest((position['x'], position['y'], position['z']))
+        if not nearest or nearest[0][1] >= CLUSTER_RADIUS:
+            new_entries.append(entry)
+    for entry in new_entries:
+        position = entry['position']
+        print(f"  X={position['x']:.2f}, Y={position['y']:.2f}, Z={position['z']:.2f} "
+              f"({entry['passage_data']['passage_info']['samples']} samples)")
+    print(f"{len(entries) - len(new_entries)} kapı zaten kayıtlı, {len(new_entries)} yeni kapı")
+    if args.dry_run:
+        return
+    if new_entries:
+        ids = manager.add_checkpoints(new_entries)
+        print(f"Eklenen checkpoint ID'leri: {', '.join(ids)}")
+    manager.close()
+    persistence.flush()
+
+
+if __name__ == '__main__':
+    main()
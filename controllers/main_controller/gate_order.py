@@ -0,0 +1,196 @@
+"""
+Flight order of the gates, independent of checkpoint ids.
+
+The order is a tour over a precomputed cost matrix: leg length plus a
+penalty for leaving a gate, or arriving at one, against the heading it was
+recorded with. A nearest-neighbour tour is improved with 2-opt (segment
+reversal) and Or-opt (moving runs of up to three gates) until neither
+finds a better tour. Both moves are evaluated for every position at once
+with NumPy, and segment costs come from prefix sums since the matrix is
+asymmetric.
+"""
+import numpy as np
+
+# Meters added per unit of (1 - cos) between a leg and the heading of the gate it leaves or enters
+HEADING_WEIGHT = 2.0
+OR_OPT_LENGTHS = (1, 2, 3)
+MAX_ROUNDS = 50
+
+
+def _heading_penalty(delta, headings):
+    # (1 - cos) between leg directions and headings; gates without a recorded passage have none (NaN)
+    length = np.maximum(np.hypot(delta[..., 0], delta[..., 1]), 1e-9)
+    penalty = 1.0 - (delta[..., 0] * np.cos(headings) + delta[..., 1] * np.sin(headings)) / length
+    return np.nan_to_num(penalty)
+
+
+def leg_costs(from_positions, to_positions, from_headings=None, to_headings=None,
+              heading_weight=HEADING_WEIGHT):
+    """Cost of flying between gates, broadcast over the leading dimensions."""
+    delta = np.asarray(to_positions, dtype=float) - np.asarray(from_positions, dtype=float)
+    cost = np.sqrt(np.einsum('...k,...k->...', delta, delta))
+    if heading_weight:
+        if from_headings is not None:
+            cost = cost + heading_weight * _heading_penalty(delta, np.asarray(from_headings, dtype=float))
+        if to_headings is not None:
+            cost = cost + heading_weight * _heading_penalty(delta, np.asarray(to_headings, dtype=float))
+    return cost
+
+
+def cost_matrix(positions, headings=None, heading_weight=HEADING_WEIGHT):
+    """cost[i, j] of flying from gate i to gate j; headings are yaws in radians or NaN."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    if headings is not None:
+        headings = np.asarray(headings, dtype=float)
+        cost = leg_costs(positions[:, None, :], positions[None, :, :], headings[:, None], headings[None, :],
+                         heading_weight)
+    else:
+        cost = leg_costs(positions[:, None, :], positions[None, :, :])
+    np.fill_diagonal(cost, 0.0)
+    return cost
+
+
+def entry_costs(positions, start_position, headings=None, heading_weight=HEADING_WEIGHT):
+    """Cost of flying from start_position to every gate."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    return leg_costs(np.asarray(start_position, dtype=float)[None, :], positions, None, headings, heading_weight)
+
+
+def best_insertion(positions, headings, position, heading=np.nan, closed=True, heading_weight=HEADING_WEIGHT):
+    """
+    Where a new gate is cheapest to fly in a tour given as gate positions
+    and headings in flight order: the index it should be inserted at.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    if len(positions) == 0:
+        return 0
+    headings = np.full(len(positions), np.nan) if headings is None else np.asarray(headings, dtype=float)
+    position = np.asarray(position, dtype=float)
+    to_new = leg_costs(positions, position[None, :], headings, heading, heading_weight)
+    from_new = leg_costs(position[None, :], positions, heading, headings, heading_weight)
+    # Between gate k and k + 1 (and from the last gate back to the first when closed)
+    following = np.roll(np.arange(len(positions)), -1)
+    insert = to_new + from_new[following] - leg_costs(positions, positions[following], headings,
+                                                      headings[following], heading_weight)
+    if not closed:
+        # After the last gate nothing follows
+        insert[-1] = to_new[-1]
+        # Before the first gate nothing precedes
+        if from_new[0] < insert.min():
+            return 0
+    return int(np.argmin(insert)) + 1
+
+
+def nearest_neighbour(cost, start):
+    n = len(cost)
+    visited = np.zeros(n, dtype=bool)
+    tour = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[tour[-1]])
+        tour.append(int(np.argmin(row)))
+        visited[tour[-1]] = True
+    return tour
+
+
+def tour_cost(cost, sequence):
+    sequence = np.asarray(sequence)
+    return float(cost[sequence[:-1], sequence[1:]].sum())
+
+
+def _two_opt(cost, seq):
+    """Best segment reversal for each start position; both ends of seq stay fixed."""
+    m = len(seq)
+    improved = False
+    a = 1
+    while a < m - 2:
+        forward = np.concatenate([[0.0], np.cumsum(cost[seq[:-1], seq[1:]])])
+        backward = np.concatenate([[0.0], np.cumsum(cost[seq[1:], seq[:-1]])])
+        b = np.arange(a + 1, m - 1)
+        before, first = seq[a - 1], seq[a]
+        delta = (cost[before, seq[b]] + cost[first, seq[b + 1]] + backward[b] - backward[a]
+                 - cost[before, first] - cost[seq[b], seq[b + 1]] - forward[b] + forward[a])
+        best = int(np.argmin(delta))
+        if delta[best] < -1e-9:
+            end = b[best]
+            seq[a:end + 1] = seq[a:end + 1][::-1].copy()
+            improved = True
+        else:
+            a += 1
+    return improved
+
+
+def _or_opt(cost, seq):
+    """Moves runs of OR_OPT_LENGTHS gates (optionally reversed) to their best position."""
+    improved = False
+    for length in OR_OPT_LENGTHS:
+        a = 1
+        while a + length < len(seq):
+            end = a + length - 1
+            run = seq[a:end + 1]
+            before, after = seq[a - 1], seq[end + 1]
+            inner = tour_cost(cost, run)
+            inner_reversed = tour_cost(cost, run[::-1])
+            removal = cost[before, run[0]] + cost[run[-1], after] - cost[before, after]
+
+            # Insert between rest[k] and rest[k + 1] of the sequence without the run
+            rest = np.concatenate([seq[:a], seq[end + 1:]])
+            x, y = rest[:-1], rest[1:]
+            insert = cost[x, run[0]] + cost[run[-1], y] - cost[x, y]
+            insert_reversed = cost[x, run[-1]] + cost[run[0], y] - cost[x, y] + inner_reversed - inner
+            # Putting it back where it was is no move (reversing it in place is)
+            insert[a - 1] = np.inf
+            k = int(np.argmin(insert))
+            k_reversed = int(np.argmin(insert_reversed))
+            reverse = insert_reversed[k_reversed] < insert[k]
+            if reverse:
+                k = k_reversed
+            gain = (insert_reversed[k] if reverse else insert[k]) - removal
+            if gain < -1e-9:
+                moved = run[::-1] if reverse else run
+                seq[:] = np.concatenate([rest[:k + 1], moved, rest[k + 1:]])
+                improved = True
+            else:
+                a += 1
+    return improved
+
+
+def solve_gate_order(positions, headings=None, closed=True, start=None, start_position=None,
+                     heading_weight=HEADING_WEIGHT):
+    """
+    Indices of the gates in flight order, starting with `start` (default:
+    the cheapest gate to enter from start_position, else gate 0). A closed
+    tour also pays for the leg from the last gate back to the first.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    n = len(positions)
+    if n <= 2:
+        return list(range(n))
+    cost = cost_matrix(positions, headings, heading_weight)
+    if start is None:
+        start = 0 if start_position is None else int(np.argmin(
+            entry_costs(positions, start_position, headings, heading_weight)))
+
+    tour = nearest_neighbour(cost, start)
+    if closed:
+        # Back to the start, which stays put
+        seq = np.array(tour + [start])
+    else:
+        # Free end: a virtual gate that costs nothing to reach
+        cost = np.pad(cost, ((0, 1), (0, 1)))
+        seq = np.array(tour + [n])
+
+    for _ in range(MAX_ROUNDS):
+        improved = _two_opt(cost, seq)
+        improved = _or_opt(cost, seq) or improved
+        if not improved:
+            break
+    return seq[:-1].tolist()
+
+
+def course_order(table, closed=True, start_position=None, heading_weight=HEADING_WEIGHT):
+    """Checkpoint ids of a CheckpointTable in flight order."""
+    headings = np.where(table.has_passage, table.orientations[:, 2], np.nan)
+    rows = solve_gate_order(table.positions, headings, closed, start_position=start_position,
+                            heading_weight=heading_weight)
+    return [int(table.ids[row]) for row in rows]
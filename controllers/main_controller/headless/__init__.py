@@ -0,0 +1,38 @@
+"""
+Headless stand-in for the Webots ``controller`` module.
+
+Exposes Robot, Keyboard and the devices used by the controller (motors,
+GPS, InertialUnit, Gyro, DistanceSensor, Camera) backed by a simple
+quadrotor rigid-body model, so the flight stack can run without a Webots
+GUI and faster than real time:
+
+    import headless
+    headless.install()          # `from controller import Robot` now resolves here
+    headless.configure(max_time=60, keys=[(5.0, 0.5, 'C')])
+"""
+import sys
+
+from .robot import Robot
+from .devices import Keyboard, Motor, GPS, InertialUnit, Gyro, DistanceSensor, Camera
+from .quadrotor import QuadrotorModel
+
+
+def install():
+    """Registers this package as the `controller` module."""
+    sys.modules['controller'] = sys.modules[__name__]
+
+
+def configure(basic_time_step=None, max_time=None, start_position=None,
+              start_yaw=None, world=None, keys=None):
+    """Sets the parameters used by the next Robot() instance."""
+    if basic_time_step is not None:
+        Robot.basic_time_step = int(basic_time_step)
+    if start_position is not None:
+        Robot.start_position = tuple(start_position)
+    if start_yaw is not None:
+        Robot.start_yaw = start_yaw
+    if world is not None:
+        Robot.world = world
+    if keys is not None:
+        Keyboard.script = list(keys)
+    Robot.max_time = max_time
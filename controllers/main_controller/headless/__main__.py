@@ -0,0 +1,51 @@
+"""
+Runs main_controller headless:
+
+    cd controllers/main_controller
+    python -m headless --max-time 120 --key C@5
+"""
+import argparse
+import time
+
+import headless
+
+
+def parse_key(spec):
+    # KEY@START[:DURATION], e.g. "C@5" or "UP@10:2"
+    key, _, timing = spec.partition('@')
+    start, _, duration = timing.partition(':')
+    if len(key) > 1:
+        key = getattr(headless.Keyboard, key.upper())
+    return (float(start or 0), float(duration or 0.1), key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the drone controller without Webots")
+    parser.add_argument('--max-time', type=float, default=60.0, help="simulated seconds")
+    parser.add_argument('--key', action='append', default=[], type=parse_key,
+                        help="scripted key press KEY@START[:DURATION]")
+    parser.add_argument('--world', nargs='?', const='', default=None,
+                        help="range sensors see the gate rings of this .wbt (default: Parkour.wbt)")
+    args = parser.parse_args()
+
+    headless.install()
+    world = None
+    if args.world is not None:
+        import world_geometry
+        world = world_geometry.load_gate_table(args.world or world_geometry.DEFAULT_WORLD)
+    headless.configure(max_time=args.max_time, keys=args.key, world=world)
+
+    import main_controller
+
+    wall_start = time.perf_counter()
+    main_controller.main()
+    wall_time = time.perf_counter() - wall_start
+
+    robot = headless.Robot.instance
+    sim_time = robot.getTime() if robot is not None else 0.0
+    print(f"\nSimulated {sim_time:.1f}s in {wall_time:.2f}s wall "
+          f"({sim_time / max(wall_time, 1e-9):.0f}x real time)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+from math import nan
+
+
+class Device:
+    def __init__(self, robot, name):
+        self.robot = robot
+        self.name = name
+
+    def getName(self):
+        return self.name
+
+
+class Sensor(Device):
+    """
+    Base class for sampled devices. Like in Webots, a sensor returns NaN
+    until it is enabled and only refreshes its value every sampling period.
+    """
+    def __init__(self, robot, name):
+        super().__init__(robot, name)
+        self.sampling_period = 0
+        self.last_sample_time = None
+
+    def enable(self, sampling_period):
+        self.sampling_period = int(sampling_period)
+        self.last_sample_time = None
+        self.robot._sensor_enabled(self)
+
+    def disable(self):
+        self.sampling_period = 0
+        self.robot._sensor_disabled(self)
+
+    def getSamplingPeriod(self):
+        return self.sampling_period
+
+    def _update(self, time_ms):
+        if self.last_sample_time is not None and time_ms - self.last_sample_time < self.sampling_period:
+            return
+        self.last_sample_time = time_ms
+        self._sample()
+
+    def _sample(self):
+        raise NotImplementedError
+
+
+class Motor(Device):
+    def __init__(self, robot, name, max_velocity=600.0):
+        super().__init__(robot, name)
+        self.position = 0.0
+        self.velocity = 0.0
+        self.max_velocity = max_velocity
+
+    def setPosition(self, position):
+        self.position = position
+
+    def setVelocity(self, velocity):
+        velocity = float(velocity)
+        if velocity > self.max_velocity:
+            velocity = self.max_velocity
+        elif velocity < -self.max_velocity:
+            velocity = -self.max_velocity
+        self.velocity = velocity
+
+    def getVelocity(self):
+        return self.velocity
+
+    def getMaxVelocity(self):
+        return self.max_velocity
+
+
+class GPS(Sensor):
+    def __init__(self, robot, name):
+        super().__init__(robot, name)
+        self.values = [nan, nan, nan]
+        self.speed = nan
+
+    def _sample(self):
+        body = self.robot.body
+        self.values = [body.x, body.y, body.z]
+        self.speed = (body.vx * body.vx + body.vy * body.vy + body.vz * body.vz) ** 0.5
+
+    def getValues(self):
+        return self.values
+
+    def getSpeed(self):
+        return self.speed
+
+
+class InertialUnit(Sensor):
+    def __init__(self, robot, name):
+        super().__init__(robot, name)
+        self.values = [nan, nan, nan]
+
+    def _sample(self):
+        self.values = list(self.robot.body.roll_pitch_yaw())
+
+    def getRollPitchYaw(self):
+        return self.values
+
+
+class Gyro(Sensor):
+    def __init__(self, robot, name):
+        super().__init__(robot, name)
+        self.values = [nan, nan, nan]
+
+    def _sample(self):
+        body = self.robot.body
+        self.values = [body.p, body.q, body.r]
+
+    def getValues(self):
+        return self.values
+
+
+class DistanceSensor(Sensor):
+    """
+    Range finder with the Crazyflie lookup table (0-2 m mapped to 0-2000).
+    The ray is only cast when the value is read, from the pose captured
+    at the last sampling time.
+    """
+    def __init__(self, robot, name, direction, max_range=2.0):
+        super().__init__(robot, name)
+        self.direction = direction
+        self.max_range = max_range
+        self.pose = None
+        self.value = nan
+
+    def _sample(self):
+        body = self.robot.body
+        rotation = self.robot.body_rotation()
+        dx, dy, dz = self.direction
+        world_direction = (
+            rotation[0][0] * dx + rotation[0][1] * dy + rotation[0][2] * dz,
+            rotation[1][0] * dx + rotation[1][1] * dy + rotation[1][2] * dz,
+            rotation[2][0] * dx + rotation[2][1] * dy + rotation[2][2] * dz,
+        )
+        self.pose = ((body.x, body.y, body.z), world_direction)
+        self.value = None
+
+    def getValue(self):
+        if self.value is None:
+            origin, direction = self.pose
+            distance = self.robot.raycast(origin, direction, self.max_range)
+            self.value = distance * 1000.0
+        return self.value
+
+    def getMaxValue(self):
+        return self.max_range * 1000.0
+
+    def getMinValue(self):
+        return 0.0
+
+
+class Camera(Sensor):
+    def __init__(self, robot, name, width=324, height=324):
+        super().__init__(robot, name)
+        self.width = width
+        self.height = height
+        self.image = None
+
+    def _sample(self):
+        pass
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def getImage(self):
+        # No renderer: an empty BGRA frame
+        if self.sampling_period and self.image is None:
+            self.image = bytes(self.width * self.height * 4)
+        return self.image
+
+
+class Keyboard:
+    """
+    Replays a scripted list of (start_time, duration, key) presses instead
+    of reading a real keyboard. Keys may be given as characters.
+    """
+    END = 312
+    HOME = 313
+    LEFT = 314
+    UP = 315
+    RIGHT = 316
+    DOWN = 317
+    PAGEUP = 366
+    PAGEDOWN = 367
+    NUMPAD_HOME = 375
+    NUMPAD_LEFT = 376
+    NUMPAD_UP = 377
+    NUMPAD_RIGHT = 378
+    NUMPAD_DOWN = 379
+    NUMPAD_END = 382
+    KEY = 0xffff
+    SHIFT = 0x10000
+    CONTROL = 0x20000
+    ALT = 0x40000
+
+    script = []
+    robot = None
+
+    def __init__(self, sampling_period=None):
+        self.sampling_period = 0
+        if sampling_period is not None:
+            self.enable(sampling_period)
+
+    def enable(self, sampling_period):
+        self.sampling_period = int(sampling_period)
+
+    def disable(self):
+        self.sampling_period = 0
+
+    def getSamplingPeriod(self):
+        return self.sampling_period
+
+    def getKey(self):
+        if not self.sampling_period:
+            return -1
+        now = self.robot.getTime() if self.robot is not None else 0.0
+        for start_time, duration, key in self.script:
+            if start_time <= now < start_time + duration:
+                return ord(key) if isinstance(key, str) else key
+        return -1
@@ -0,0 +1,121 @@
+from math import sqrt, atan2, asin, cos, sin
+
+
+class QuadrotorModel:
+    """
+    Rigid-body model of the Crazyflie used in Parkour.wbt.
+    Motor velocities (rad/s, signed like the Webots motors) go in,
+    position/attitude/body rates come out. Plain floats only so that one
+    step stays in the microsecond range.
+    """
+    MASS = 0.05
+    INERTIA = (1.4e-5, 1.4e-5, 2.17e-5)
+    THRUST_CONSTANT = 4e-05
+    TORQUE_CONSTANT = 2.4e-06
+    GRAVITY = 9.81
+    # WorldInfo.defaultDamping in Parkour.wbt
+    LINEAR_DAMPING = 0.5
+    ANGULAR_DAMPING = 0.5
+    # First-order lag between commanded and actual rotor velocity (s)
+    MOTOR_TIME_CONSTANT = 0.05
+    # Rotor acceleration limit (rad/s^2)
+    MAX_ROTOR_ACCELERATION = 2000.0
+    # Motor positions (x, y) in the body frame, m1..m4
+    MOTOR_LAYOUT = ((0.031, -0.031), (-0.031, -0.031), (-0.031, 0.031), (0.031, 0.031))
+
+    def __init__(self, position=(0.0, 0.0, 0.0), yaw=0.0):
+        self.reset(position, yaw)
+
+    def reset(self, position=(0.0, 0.0, 0.0), yaw=0.0):
+        self.x, self.y, self.z = (float(v) for v in position)
+        self.vx = self.vy = self.vz = 0.0
+        # Attitude quaternion (w, x, y, z)
+        self.qw = cos(yaw / 2)
+        self.qx = 0.0
+        self.qy = 0.0
+        self.qz = sin(yaw / 2)
+        # Body rates
+        self.p = self.q = self.r = 0.0
+        self.rotor_velocities = [0.0, 0.0, 0.0, 0.0]
+
+    def rotation_matrix(self):
+        qw, qx, qy, qz = self.qw, self.qx, self.qy, self.qz
+        return (
+            (1 - 2 * (qy * qy + qz * qz), 2 * (qx * qy - qw * qz), 2 * (qx * qz + qw * qy)),
+            (2 * (qx * qy + qw * qz), 1 - 2 * (qx * qx + qz * qz), 2 * (qy * qz - qw * qx)),
+            (2 * (qx * qz - qw * qy), 2 * (qy * qz + qw * qx), 1 - 2 * (qx * qx + qy * qy)),
+        )
+
+    def roll_pitch_yaw(self):
+        qw, qx, qy, qz = self.qw, self.qx, self.qy, self.qz
+        roll = atan2(2 * (qw * qx + qy * qz), 1 - 2 * (qx * qx + qy * qy))
+        sin_pitch = 2 * (qw * qy - qz * qx)
+        sin_pitch = 1.0 if sin_pitch > 1.0 else (-1.0 if sin_pitch < -1.0 else sin_pitch)
+        pitch = asin(sin_pitch)
+        yaw = atan2(2 * (qw * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))
+        return roll, pitch, yaw
+
+    def step(self, dt, motor_velocities):
+        kf = self.THRUST_CONSTANT
+        thrust = 0.0
+        torque_x = 0.0
+        torque_y = 0.0
+        torque_z = 0.0
+        rotors = self.rotor_velocities
+        alpha = dt / (self.MOTOR_TIME_CONSTANT + dt)
+        max_change = self.MAX_ROTOR_ACCELERATION * dt
+        for i, command in enumerate(motor_velocities):
+            change = alpha * (command - rotors[i])
+            if change > max_change:
+                change = max_change
+            elif change < -max_change:
+                change = -max_change
+            rotors[i] += change
+
+        for (mx, my), w in zip(self.MOTOR_LAYOUT, rotors):
+            force = kf * w * w
+            thrust += force
+            torque_x += my * force
+            torque_y -= mx * force
+            torque_z -= self.TORQUE_CONSTANT * w * abs(w)
+
+        # Translational dynamics (thrust along body z)
+        qw, qx, qy, qz = self.qw, self.qx, self.qy, self.qz
+        acc = thrust / self.MASS
+        ax = acc * 2 * (qx * qz + qw * qy)
+        ay = acc * 2 * (qy * qz - qw * qx)
+        az = acc * (1 - 2 * (qx * qx + qy * qy)) - self.GRAVITY
+
+        linear_decay = (1.0 - self.LINEAR_DAMPING) ** dt
+        self.vx = (self.vx + ax * dt) * linear_decay
+        self.vy = (self.vy + ay * dt) * linear_decay
+        self.vz = (self.vz + az * dt) * linear_decay
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        self.z += self.vz * dt
+
+        # Rotational dynamics (Euler equations in the body frame)
+        ix, iy, iz = self.INERTIA
+        p, q, r = self.p, self.q, self.r
+        angular_decay = (1.0 - self.ANGULAR_DAMPING) ** dt
+        self.p = (p + (torque_x - (iz - iy) * q * r) / ix * dt) * angular_decay
+        self.q = (q + (torque_y - (ix - iz) * r * p) / iy * dt) * angular_decay
+        self.r = (r + (torque_z - (iy - ix) * p * q) / iz * dt) * angular_decay
+
+        p, q, r = self.p, self.q, self.r
+        half_dt = 0.5 * dt
+        qw, qx, qy, qz = (
+            qw + (-qx * p - qy * q - qz * r) * half_dt,
+            qx + (qw * p + qy * r - qz * q) * half_dt,
+            qy + (qw * q - qx * r + qz * p) * half_dt,
+            qz + (qw * r + qx * q - qy * p) * half_dt,
+        )
+        norm = sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+        self.qw, self.qx, self.qy, self.qz = qw / norm, qx / norm, qy / norm, qz / norm
+
+        # Ground contact
+        if self.z < 0.0:
+            self.z = 0.0
+            if self.vz < 0.0:
+                self.vx = self.vy = self.vz = 0.0
+                self.p = self.q = self.r = 0.0
@@ -0,0 +1,99 @@
+from .quadrotor import QuadrotorModel
+from .devices import Motor, GPS, InertialUnit, Gyro, DistanceSensor, Camera, Keyboard
+
+
+class Robot:
+    """
+    Drop-in replacement for webots.controller.Robot driving a QuadrotorModel.
+    There is no wall-clock synchronisation, so step() returns as soon as the
+    physics has been integrated.
+    """
+    basic_time_step = 8
+    start_position = (0.0, 0.0, 0.0)
+    start_yaw = 3.14159
+    max_time = None
+    # Optional obstacle model exposing raycast(origin, direction, max_range)
+    world = None
+
+    instance = None
+
+    def __init__(self):
+        self.body = QuadrotorModel(self.start_position, self.start_yaw)
+        self.time_ms = 0
+        self.enabled_sensors = []
+        self.rotation = None
+        self.rotation_time = None
+
+        self.devices = {
+            "m1_motor": Motor(self, "m1_motor"),
+            "m2_motor": Motor(self, "m2_motor"),
+            "m3_motor": Motor(self, "m3_motor"),
+            "m4_motor": Motor(self, "m4_motor"),
+            "inertial_unit": InertialUnit(self, "inertial_unit"),
+            "gps": GPS(self, "gps"),
+            "gyro": Gyro(self, "gyro"),
+            "range_front": DistanceSensor(self, "range_front", (1.0, 0.0, 0.0)),
+            "range_back": DistanceSensor(self, "range_back", (-1.0, 0.0, 0.0)),
+            "range_left": DistanceSensor(self, "range_left", (0.0, 1.0, 0.0)),
+            "range_right": DistanceSensor(self, "range_right", (0.0, -1.0, 0.0)),
+            "camera": Camera(self, "camera"),
+        }
+        self.motors = [self.devices[f"m{i}_motor"] for i in range(1, 5)]
+
+        Robot.instance = self
+        Keyboard.robot = self
+
+    def getDevice(self, name):
+        return self.devices.get(name)
+
+    def getBasicTimeStep(self):
+        return float(self.basic_time_step)
+
+    def getTime(self):
+        return self.time_ms / 1000.0
+
+    def getName(self):
+        return "Crazyflie"
+
+    def step(self, duration=None):
+        if duration is None:
+            duration = self.basic_time_step
+        if self.max_time is not None and self.getTime() >= self.max_time:
+            return -1
+
+        dt = self.basic_time_step / 1000.0
+        elapsed = 0
+        while elapsed < duration:
+            velocities = [motor.velocity for motor in self.motors]
+            self.body.step(dt, velocities)
+            self.time_ms += self.basic_time_step
+            elapsed += self.basic_time_step
+            for sensor in self.enabled_sensors:
+                sensor._update(self.time_ms)
+        return 0
+
+    def body_rotation(self):
+        # Shared by the range sensors sampled in the same step
+        if self.rotation_time != self.time_ms:
+            self.rotation = self.body.rotation_matrix()
+            self.rotation_time = self.time_ms
+        return self.rotation
+
+    def raycast(self, origin, direction, max_range):
+        if self.world is not None:
+            return self.world.raycast(origin, direction, max_range)
+        # Only the floor (z = 0)
+        if direction[2] < 0.0:
+            distance = -origin[2] / direction[2]
+            if distance < max_range:
+                return distance
+        return max_range
+
+    def _sensor_enabled(self, sensor):
+        if sensor not in self.enabled_sensors:
+            self.enabled_sensors.append(sensor)
+        sensor._update(self.time_ms)
+
+    def _sensor_disabled(self, sensor):
+        if sensor in self.enabled_sensors:
+            self.enabled_sensors.remove(sensor)
@@ -1,12 +1,23 @@
 from controller import Keyboard
-from math import sqrt
-from passage_point import PassagePointFilter
+from passage_detector import PassageDetector
 from checkpoint_manager import CheckpointManager
-from pathfinding import CheckpointNode, create_checkpoint_connections, find_path_between_checkpoints, is_in_potential_field
+from checkpoint_storage import journal_path
+from pathfinding import is_in_potential_field
+from gate_order import course_order
+from course_planner import CoursePlanner
+from trajectory_optimizer import load_or_optimize
 from checkpoints_charts import visualize_checkpoints
+import persistence
 import os
 import numpy as np
 
+# Name of the task that owns the motors (take-off hover, course)
+FLIGHT_TASK = 'flight'
+# Cycled with T: stop at every checkpoint, pure pursuit through them, optimized minimum-time trajectory
+COURSE_MODES = ("waypoint", "trajectory", "optimized")
+# A passage this close to a recorded checkpoint is another pass through that gate
+SAME_GATE_RADIUS = 0.5
+
 def controller(drone, keyboard, timestep):
     ALTITUDE_CHANGE_STEP = 0.03
     last_altitude_change_time = 0
@@ -20,13 +31,10 @@ def controller(drone, keyboard, timestep):
     yaw_desired = 0
     target_altitude = drone.FLYING_ATTITUDE
 
-    if not hasattr(drone, 'last_position'):
-        x, y, z = drone.gps.getValues()
-        drone.last_position = (x, y, z)
-        drone.last_time = drone.robot.getTime()
-    
-    if not hasattr(drone, 'passage_filter'):
-        drone.passage_filter = PassagePointFilter()
+    frame = drone.sense()
+
+    if not hasattr(drone, 'passage_detector'):
+        drone.passage_detector = PassageDetector(drone.LIDAR_THRESHOLD)
         
     if not hasattr(drone, 'checkpoint_manager'):
         drone.checkpoint_manager = CheckpointManager()
@@ -58,43 +66,65 @@ def controller(drone, keyboard, timestep):
     elif key == ord('R'):
         if key not in drone.key_states or not drone.key_states[key]:
             drone.recording = not drone.recording
+            # A passage still open when recording stops is the ring just flown through
+            passage = drone.passage_detector.finish()
+            if passage is not None:
+                record_passage(drone, passage)
+            drone.passage_detector.reset()
             if drone.recording:
+                drone.set_device_profile("record")
                 print("\nRecording checkpoints...")
             else:
+                drone.set_device_profile("race")
                 print("\nStopped recording checkpoints.")
         drone.key_states[key] = True
     elif key == ord('C'):
         if key not in drone.key_states or not drone.key_states[key]:
-            if os.path.exists("checkpoints.json"):
+            if drone.tasks.is_running(FLIGHT_TASK):
+                print("\nA flight task is already running.")
+            elif os.path.exists("checkpoints.json"):
                 print("\nStarting course with recorded checkpoints...")
-                start_course_with_checkpoints(drone)
+                drone.tasks.spawn(course_task(drone), name=FLIGHT_TASK)
             else:
                 print("\nNo checkpoint data found. Please record checkpoints first.")
         drone.key_states[key] = True
+    elif key == ord('T'):
+        if key not in drone.key_states or not drone.key_states[key]:
+            if drone.tasks.is_running(FLIGHT_TASK):
+                print("\nCourse mode cannot change during a flight task.")
+            else:
+                drone.course_mode = COURSE_MODES[(COURSE_MODES.index(drone.course_mode) + 1) % len(COURSE_MODES)]
+                print(f"\nCourse mode: {drone.course_mode}")
+        drone.key_states[key] = True
     elif key == ord('X'):
         if key not in drone.key_states or not drone.key_states[key]:
             reset_checkpoints(drone)
         drone.key_states[key] = True
     elif key == ord('V'):
         if key not in drone.key_states or not drone.key_states[key]:
+            persistence.flush()
             visualize_checkpoints()
         drone.key_states[key] = True
     elif key == ord('Q'):
-        return False
+        if drone.tasks.is_running(FLIGHT_TASK):
+            if key not in drone.key_states or not drone.key_states[key]:
+                drone.tasks.cancel(FLIGHT_TASK)
+                print("\nFlight task aborted, back to manual control.")
+            drone.key_states[key] = True
+        elif key not in drone.key_states or not drone.key_states[key]:
+            return False
     else:
         for k in drone.key_states:
             if k != key:
                 drone.key_states[k] = False
 
+    # The running flight task drives the motors this step
+    if drone.tasks.is_running(FLIGHT_TASK):
+        return True
 
-    roll, pitch, yaw = drone.imu.getRollPitchYaw()
-    yaw_rate = drone.gyro.getValues()[2]
-    altitude = drone.gps.getValues()[2]
-
-    motor_power = drone.pid_controller.pid(timestep/1000.0, forward_desired, sideways_desired,
-                                        yaw_desired, target_altitude,
-                                        roll, pitch, yaw_rate,
-                                        altitude, 0, 0)
+    motor_power = drone.pid_controller.pid_frame(timestep/1000.0, forward_desired, sideways_desired,
+                                              yaw_desired, target_altitude,
+                                              frame, 0, 0)
 
     drone.m1_motor.setVelocity(-motor_power[0])
     drone.m2_motor.setVelocity(motor_power[1])
@@ -102,140 +132,91 @@ def controller(drone, keyboard, timestep):
     drone.m4_motor.setVelocity(motor_power[3])
 
     if drone.recording:
-        passage_data = detect_circle_passage(drone, drone.passage_filter)
-        if passage_data:
-            drone.last_position = (passage_data['position']['x'], 
-                                 passage_data['position']['y'], 
-                                 passage_data['position']['z'])
-            drone.last_time = drone.robot.getTime()
+        detect_circle_passage(drone, drone.passage_detector, frame)
 
     return True
 
-def detect_circle_passage(drone, passage_filter):
-    left_distance = drone.left_lidar.getValue() / 1000
-    right_distance = drone.right_lidar.getValue() / 1000
-    
-    if left_distance < drone.LIDAR_THRESHOLD or right_distance < drone.LIDAR_THRESHOLD:
-     
-        x, y, z = drone.gps.getValues()
-        roll, pitch, yaw = drone.imu.getRollPitchYaw()
-        
-        v_x = (x - drone.last_position[0]) / (drone.robot.getTime() - drone.last_time) if hasattr(drone, 'last_position') else 0
-        v_y = (y - drone.last_position[1]) / (drone.robot.getTime() - drone.last_time) if hasattr(drone, 'last_position') else 0
-        v_z = (z - drone.last_position[2]) / (drone.robot.getTime() - drone.last_time) if hasattr(drone, 'last_position') else 0
-        
-        side = "left" if left_distance < right_distance else "right"
-        
-        passage_data = {
-            'position': {
-                'x': x,
-                'y': y,
-                'z': z
-            },
-            'orientation': {
-                'roll': roll,
-                'pitch': pitch,
-                'yaw': yaw
-            },
-            'velocity': {
-                'v_x': v_x,
-                'v_y': v_y,
-                'v_z': v_z
-            },
-            'passage_info': {
-                'side': side,
-                'left_lidar': left_distance,
-                'right_lidar': right_distance,
-                'timestamp': drone.robot.getTime()
-            }
-        }
-        
-        best_point = passage_filter.add_point(passage_data)
-        if best_point:
-            
-            if hasattr(drone, 'last_checkpoint_position'):
-                last_x, last_y, last_z = drone.last_checkpoint_position
-                distance = sqrt((x - last_x)**2 + (y - last_y)**2 + (z - last_z)**2)
-                if distance < 1.0:  
-                    return None
-            
-        
-            checkpoint_id = drone.checkpoint_manager.add_checkpoint(
-                best_point['position'],
-                best_point,
-                orientation=(roll, pitch, yaw)  
-            )
-            if checkpoint_id is not None:
-                print(f"\nNew checkpoint added with ID: {checkpoint_id}")
-                print(f"Position: X={best_point['position']['x']:.2f}, Y={best_point['position']['y']:.2f}, Z={best_point['position']['z']:.2f}")
-                print(f"Orientation: Roll={roll:.2f}, Pitch={pitch:.2f}, Yaw={yaw:.2f}")
-                print(f"Velocity: Vx={best_point['velocity']['v_x']:.2f}, Vy={best_point['velocity']['v_y']:.2f}, Vz={best_point['velocity']['v_z']:.2f}")
-                print(f"Passing from {best_point['passage_info']['side']} side")
-                
-
-                drone.last_checkpoint_position = (x, y, z)
-                return best_point
-        
+def detect_circle_passage(drone, passage_detector, frame=None):
+    """
+    Feeds one sample to the passage detector. When a passage through a
+    ring has just ended it is recorded, as another pass through the
+    nearest checkpoint or as a new one, and returned.
+    """
+    if frame is None:
+        frame = drone.sense()
+    passage = passage_detector.update_frame(frame)
+    if passage is None:
         return None
-    
-    return None
+    return record_passage(drone, passage)
+
+def record_passage(drone, passage):
+    """Records a detected passage against the nearest checkpoint, or as a new one."""
+    position = passage['position']
+    orientation = passage['orientation']
+    orientation = (orientation['roll'], orientation['pitch'], orientation['yaw'])
+    nearest = drone.checkpoint_manager.find_nearest((position['x'], position['y'], position['z']))
+    if nearest and nearest[0][1] < SAME_GATE_RADIUS:
+        drone.checkpoint_manager.record_passage(nearest[0][0], passage, orientation=orientation)
+        print(f"\nPassage recorded for checkpoint {nearest[0][0]}")
+        return passage
+
+    checkpoint_id = drone.checkpoint_manager.add_checkpoint(position, passage, orientation=orientation)
+    if checkpoint_id is not None:
+        roll, pitch, yaw = orientation
+        print(f"\nNew checkpoint added with ID: {checkpoint_id}")
+        print(f"Position: X={position['x']:.2f}, Y={position['y']:.2f}, Z={position['z']:.2f}")
+        print(f"Orientation: Roll={roll:.2f}, Pitch={pitch:.2f}, Yaw={yaw:.2f}")
+        print(f"Velocity: Vx={passage['velocity']['v_x']:.2f}, Vy={passage['velocity']['v_y']:.2f}, Vz={passage['velocity']['v_z']:.2f}")
+        print(f"Passing from {passage['passage_info']['side']} side")
+    return passage
 
 def reset_checkpoints(drone):
-    if os.path.exists("checkpoints.json"):
-        try:
-            os.remove("checkpoints.json")
-            print("Checkpoint file has been deleted.")
-        except Exception as e:
-            print(f"Error deleting checkpoint file: {e}")
-            return False
+    # A queued save would recreate the file after it is deleted
+    persistence.flush()
+    for path in ("checkpoints.json", journal_path("checkpoints.json")):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+                print(f"{path} has been deleted.")
+            except Exception as e:
+                print(f"Error deleting checkpoint file: {e}")
+                return False
 
     if hasattr(drone, 'checkpoint_manager'):
         drone.checkpoint_manager = CheckpointManager()
         print("Checkpoint manager has been reset.")
     
-    if hasattr(drone, 'passage_filter'):
-        drone.passage_filter = PassagePointFilter()
-        print("Passage filter has been reset.")
-    
-    if hasattr(drone, 'last_checkpoint_position'):
-        delattr(drone, 'last_checkpoint_position')
+    if hasattr(drone, 'passage_detector'):
+        # Only open while recording: the ring being flown through goes into the new checkpoints
+        passage = drone.passage_detector.finish()
+        if passage is not None:
+            record_passage(drone, passage)
+        drone.passage_detector.reset()
+        print("Passage detector has been reset.")
         
     return True
 
 def start_course_with_checkpoints(drone):
-    checkpoints = []
-    for cp_id, cp in drone.checkpoint_manager.get_all_checkpoints().items():
-        checkpoint = CheckpointNode(
-            int(cp_id),
-            (cp['position']['x'], cp['position']['y'], cp['position']['z']),
-            (
-                cp['passage_history'][-1]['orientation']['roll'] if cp['passage_history'] else 0.0,
-                cp['passage_history'][-1]['orientation']['pitch'] if cp['passage_history'] else 0.0,
-                cp['passage_history'][-1]['orientation']['yaw'] if cp['passage_history'] else 0.0
-            )
-        )
-        if cp['passage_history']:
-            last_passage = cp['passage_history'][-1]
-            checkpoint.potential_field['lidar_left'] = last_passage['lidar_readings']['left']
-            checkpoint.potential_field['lidar_right'] = last_passage['lidar_readings']['right']
-        checkpoints.append(checkpoint)
+    return drone.run(course_task(drone))
 
-    if not checkpoints:
-        print("Checkpoint bulunamadı!")
-        return
+def course_task(drone):
+    table = drone.checkpoint_manager.table()
 
-    create_checkpoint_connections(checkpoints)
+    if not len(table):
+        print("Checkpoint bulunamadı!")
+        return False
 
-    first_checkpoint = min(checkpoints, key=lambda x: x.id)
-    last_checkpoint = max(checkpoints, key=lambda x: x.id)
+    avg_height = float(table.positions[:, 2].mean())
+    # Flight order from the gate positions and headings, not the recording order
+    frame = drone.sense()
+    order = course_order(table, start_position=(frame.x, frame.y, frame.z))
+    print(f"Kapı sırası: {' -> '.join(str(checkpoint_id) for checkpoint_id in order)}")
     
-    avg_height = sum(cp.position[2] for cp in checkpoints) / len(checkpoints)
-    
-    if not drone.hover(avg_height):
+    if not (yield from drone.hover_task(avg_height)):
         print("Yükseklik ayarlanamadı!")
-        return
+        return False
 
-    drone.total_checkpoints = len(checkpoints)
+    drone.total_checkpoints = len(table)
     drone.current_checkpoint = 0
     drone.current_lap = 1
     drone.total_laps = 0
@@ -247,66 +228,110 @@ def start_course_with_checkpoints(drone):
     print(f"Maksimum tur sayısı: {drone.max_laps}")
     print("Durdurmak için 'Q' tuşuna basın.")
     
-    while drone.current_lap <= drone.max_laps:
-        drone.route_recorder.start_recording(drone.current_lap)
-        lap_start_time = drone.robot.getTime()
+    # Follows checkpoint changes; a lap picks up whatever changed during the last one
+    planner = CoursePlanner(drone.checkpoint_manager, order)
+    try:
+        while drone.current_lap <= drone.max_laps:
+            drone.route_recorder.start_recording(drone.current_lap)
+            lap_start_time = drone.robot.getTime()
         
-        path = find_path_between_checkpoints(first_checkpoint.id, last_checkpoint.id, checkpoints)
-        if path is None:
-            print("Hata: Checkpoint'ler arasında yol bulunamadı!")
-            return
-        print("Normal rota kullanılıyor...")
+            path = planner.path()
+            drone.total_checkpoints = len(planner.order)
+            if path is None:
+                print("Hata: Checkpoint'ler arasında yol bulunamadı!")
+                return False
+            print("Sürekli rota takibi kullanılıyor..." if drone.course_mode == "trajectory"
+                  else "Optimize rota kullanılıyor..." if drone.course_mode == "optimized"
+                  else "Normal rota kullanılıyor...")
         
-        for i, checkpoint in enumerate(path):
-            current_pos = drone.gps.getValues()
+            if drone.course_mode == "optimized":
+                # Gates only: the optimizer finds its own line through them
+                gates = [cp for cp in path if planner.nodes.get(cp.id) is cp]
+                frame = drone.sense()
+                trajectory = load_or_optimize(
+                    (frame.x, frame.y, avg_height),
+                    [(cp.position[0], cp.position[1], avg_height) for cp in gates],
+                    max_velocity=drone.TRAJECTORY_MAX_VELOCITY,
+                    max_acceleration=drone.TRAJECTORY_MAX_ACCELERATION)
+                if drone.clearance_field is not None:
+                    blocked = drone.clearance_field.first_collision(trajectory.positions)
+                    if blocked is not None:
+                        print(f"Uyarı: Rota {trajectory.times[blocked]:.2f}s'de bir engele çok yaklaşıyor!")
+
+                def gate_passed(index, gates=gates):
+                    drone.current_checkpoint = gates[index].id
+
+                if not (yield from drone.follow_trajectory_task(trajectory, on_gate=gate_passed)):
+                    print("Rota takip edilemedi!")
+                    return False
+            elif drone.course_mode == "trajectory":
+                points = [(cp.position[0], cp.position[1], avg_height) for cp in path]
+
+                def checkpoint_passed(index, path=path):
+                    drone.current_checkpoint = path[index].id
+
+                if not (yield from drone.follow_path_task(points, on_vertex=checkpoint_passed)):
+                    print("Rota takip edilemedi!")
+                    return False
+            else:
+                for i, checkpoint in enumerate(path):
+                    current_pos = drone.sense().position
             
-            if is_in_potential_field(current_pos, checkpoint):
-                continue
+                    if is_in_potential_field(current_pos, checkpoint):
+                        continue
             
-            target_pos = (checkpoint.position[0], checkpoint.position[1], avg_height)
+                    target_pos = (checkpoint.position[0], checkpoint.position[1], avg_height)
             
 
-            if not drone.goto(target_pos):
-                print(f"Checkpoint {checkpoint.id}'e ulaşılamadı!")
-                return
+                    if not (yield from drone.goto_task(target_pos)):
+                        print(f"Checkpoint {checkpoint.id}'e ulaşılamadı!")
+                        return False
             
-            drone.current_checkpoint = checkpoint.id
-            print(f"\nTur: {drone.current_lap}/{drone.max_laps}")
-            print(f"Checkpoint: {drone.current_checkpoint}/{drone.total_checkpoints}")
+                    drone.current_checkpoint = checkpoint.id
+                    print(f"\nTur: {drone.current_lap}/{drone.max_laps}")
+                    print(f"Checkpoint: {drone.current_checkpoint}/{drone.total_checkpoints}")
             
-            checkpoint_start_time = drone.robot.getTime()
-            stabilization_time = float(checkpoint.stabilization_time)
+                    checkpoint_start_time = drone.robot.getTime()
+                    stabilization_time = float(checkpoint.stabilization_time)
             
-            while drone.robot.getTime() - checkpoint_start_time < stabilization_time:
-                drone.robot.step(drone.timestep)
-                drone.route_recorder.record_point(drone)
+                    while drone.robot.getTime() - checkpoint_start_time < stabilization_time:
+                        yield
+                        drone.route_recorder.record_point(drone)
         
-        current_time = drone.robot.getTime()
-        lap_time = current_time - lap_start_time
-        drone.lap_times.append(lap_time)
+            current_time = drone.robot.getTime()
+            lap_time = current_time - lap_start_time
+            drone.lap_times.append(lap_time)
         
 
-        drone.route_recorder.stop_recording()
-        stats = drone.route_recorder.get_lap_statistics()
+            drone.route_recorder.stop_recording()
+            stats = drone.route_recorder.get_lap_statistics()
         
-        print(f"\nTur {drone.current_lap} tamamlandı!")
-        print(f"Tur süresi: {lap_time:.2f} saniye")
-        print(f"Ortalama hız: {stats['average_speed']:.2f} m/s")
-        print(f"Checkpoint süreleri: {stats['checkpoint_times']}")
-        print(f"Toplam kayıt noktası: {stats['number_of_points']}")
+            print(f"\nTur {drone.current_lap} tamamlandı!")
+            print(f"Tur süresi: {lap_time:.2f} saniye")
+            print(f"Ortalama hız: {stats['average_speed']:.2f} m/s")
+            print(f"Checkpoint süreleri: {stats['checkpoint_times']}")
+            print(f"Toplam kayıt noktası: {stats['number_of_points']}")
         
 
-        if drone.current_lap < drone.max_laps:
-            print("Yeni tur başlatılıyor...")
-            drone.current_lap += 1
-            drone.total_laps += 1
-            wait_start_time = drone.robot.getTime()
-            wait_time = 1.0 
+            if drone.current_lap < drone.max_laps:
+                print("Yeni tur başlatılıyor...")
+                drone.current_lap += 1
+                drone.total_laps += 1
+                wait_start_time = drone.robot.getTime()
+                wait_time = 1.0 
             
-            while drone.robot.getTime() - wait_start_time < wait_time:
-                drone.robot.step(drone.timestep)
-                drone.route_recorder.record_point(drone)
-        else:
-            print("\nTüm turlar tamamlandı!")
-            drone.is_course_active = False
-            return
+                while drone.robot.getTime() - wait_start_time < wait_time:
+                    yield
+                    # Hold the altitude: the last flight command is stale by now
+                    drone.stay_hover()
+                    drone.route_recorder.record_point(drone)
+            else:
+                print("\nTüm turlar tamamlandı!")
+                return True
+    finally:
+        # Also runs when the task is cancelled (Q)
+        planner.close()
+        drone.is_course_active = False
+        if drone.route_recorder.is_recording:
+            drone.route_recorder.stop_recording()
+
@@ -3,7 +3,9 @@
 from controller import Robot, Keyboard
 from octopus import Octopus
 from pid_controller import pid_velocity_fixed_height_controller
-from key_controller import controller
+from key_controller import controller, FLIGHT_TASK
+from clearance_field import load_clearance_field
+import persistence
 
 
 def main():
@@ -15,12 +17,14 @@ def main():
 
     pid_controller = pid_velocity_fixed_height_controller()
     drone = Octopus(robot, timestep, pid_controller)
+    try:
+        drone.clearance_field = load_clearance_field()
+    except OSError as e:
+        print(f"Engel mesafe alanı yüklenemedi, çarpışma kontrolü kapalı: {e}")
 
-    if not drone.hover():
-        print("Hover failed!")
-        return
+    # Take-off runs as the first flight task; keys are polled meanwhile
+    drone.tasks.spawn(drone.hover_task(), name=FLIGHT_TASK)
 
-    print("Hover successful!")
     print("\n=== Drone Control System ===")
     print("Controls:")
     print("W/S: Increase/Decrease altitude")
@@ -29,13 +33,23 @@ def main():
     print("Arrow Left/Right: Turn left/right")
     print("R: Start/Stop recording checkpoints")
     print("C: Start course with checkpoints")
+    print("T: Cycle waypoint/trajectory/optimized course mode")
     print("X: Reset checkpoints")
     print("V: Visualize checkpoint data")
-    print("Q: Quit")
+    print("Q: Quit (aborts the running course first)")
     
+    # Single top-level loop: keyboard first, then one step of every task
     while robot.step(timestep) != -1:
         if not controller(drone, keyboard, timestep):
             break
+        drone.tasks.tick()
+
+    # Stop the course now (its cleanup saves the lap) rather than at garbage
+    # collection, then close the checkpoint storage and finish queued writes
+    drone.tasks.cancel_all()
+    if hasattr(drone, 'checkpoint_manager'):
+        drone.checkpoint_manager.close()
+    persistence.flush()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,10 +1,30 @@
 from controller import Robot
-import numpy as np
-from math import cos, sin, sqrt
+from math import cos, sin, sqrt, atan2, nan, pi
+from control_kernels import wrap_angle, clip
 from route_recorder import RouteRecorder
+from tasks import TaskRunner, run_blocking
+from sensor_frame import SensorFrame
+from trajectory_tracking import PurePursuit
+from clearance_field import DRONE_RADIUS
 
 class Octopus:
-    def __init__(self, robot, timestep, pid_controller):
+    SENSOR_NAMES = ("inertial_unit", "gps", "gyro",
+                    "range_front", "range_back", "range_left", "range_right", "camera")
+
+    # Sampling period of every sensor in control steps, 0 = disabled
+    DEVICE_PROFILES = {
+        # Course flight: the side ranges are only logged by the route recorder
+        "race": {"inertial_unit": 1, "gps": 1, "gyro": 1,
+                 "range_front": 0, "range_back": 0, "range_left": 4, "range_right": 4, "camera": 0},
+        # Checkpoint recording: side ranges drive the gate detection
+        "record": {"inertial_unit": 1, "gps": 1, "gyro": 1,
+                   "range_front": 4, "range_back": 4, "range_left": 1, "range_right": 1, "camera": 0},
+        # Everything at the control rate
+        "debug": {"inertial_unit": 1, "gps": 1, "gyro": 1,
+                  "range_front": 1, "range_back": 1, "range_left": 1, "range_right": 1, "camera": 1},
+    }
+
+    def __init__(self, robot, timestep, pid_controller, device_profile="race"):
         self.robot = robot
         self.timestep = timestep
 
@@ -23,29 +43,20 @@ class Octopus:
         self.m4_motor.setVelocity(1)
         self.motors = [self.m1_motor, self.m2_motor, self.m3_motor, self.m4_motor]
 
-        # Initialize sensors
-        self.imu = robot.getDevice("inertial_unit")
-        self.imu.enable(timestep)
-        self.gps = robot.getDevice("gps")
-        self.gps.enable(timestep)
-        self.gyro = robot.getDevice("gyro")
-        self.gyro.enable(timestep)
-
-        # Initialize lidar sensors
-        self.front_lidar = robot.getDevice("range_front")
-        self.front_lidar.enable(timestep)
-        self.back_lidar = robot.getDevice("range_back")
-        self.back_lidar.enable(timestep)
-        self.left_lidar = robot.getDevice("range_left")
-        self.left_lidar.enable(timestep)
-        self.right_lidar = robot.getDevice("range_right")
-        self.right_lidar.enable(timestep)
-
-        # Initialize camera
-        self.camera = robot.getDevice("camera")
-        self.camera.enable(timestep)
-        self.camera_width = self.camera.getWidth()
-        self.camera_height = self.camera.getHeight()
+        # Initialize sensors. They are enabled by the device profile, or
+        # lazily at the control rate on first access through the properties
+        # below.
+        self.sensors = {name: robot.getDevice(name) for name in self.SENSOR_NAMES}
+        self.sensor_periods = {}
+        self.device_profile = None
+        self.set_device_profile(device_profile)
+
+        camera = self.sensors["camera"]
+        self.camera_width = camera.getWidth()
+        self.camera_height = camera.getHeight()
+
+        # Sensor snapshot shared by every consumer of the current step
+        self.frame = SensorFrame()
 
         # Initialize PID controller
         self.pid_controller = pid_controller
@@ -56,6 +67,11 @@ class Octopus:
         self.POSITION_KP = 1.0
         self.MAX_VELOCITY = 1 # Reduced from 1.0 to 0.3
         self.LIDAR_THRESHOLD = 0.5  # Threshold for detecting circle passage (circle radius is 0.5m)
+        self.LOOKAHEAD_DISTANCE = 0.6  # Pure pursuit carrot distance for trajectory mode
+        self.CORNER_SPEED_RATIO = 0.5  # Speed factor for a 90 degree corner ahead
+        self.TRAJECTORY_KP = 1.5  # Position feedback on top of the optimized trajectory velocity
+        self.TRAJECTORY_MAX_VELOCITY = 2.0  # Limits handed to the trajectory optimizer
+        self.TRAJECTORY_MAX_ACCELERATION = 1.0
 
         # Hover state
         self.is_hovering = False
@@ -68,42 +84,132 @@ class Octopus:
         self.total_laps = 0
         self.max_laps = 3  # Varsayılan maksimum tur sayısı
         self.is_course_active = False
+        self.course_mode = "waypoint"  # "waypoint": stop at every checkpoint, "trajectory": fly through, "optimized": minimum-time trajectory
         self.course_start_time = 0
         self.lap_times = []
 
         # Route recording
         self.route_recorder = RouteRecorder()
 
+        # Distance to the rings and the floor (ClearanceField), when the world geometry is available
+        self.clearance_field = None
+        self.near_obstacle = False
+
+        # Cooperative tasks advanced once per step by the main loop
+        self.tasks = TaskRunner()
+
+    def set_device_profile(self, name):
+        """
+        Applies the sampling periods of a profile from DEVICE_PROFILES and
+        disables the sensors it does not use.
+        """
+        for device_name, steps in self.DEVICE_PROFILES[name].items():
+            if steps:
+                self._enable_sensor(device_name, steps * self.timestep)
+            elif device_name in self.sensor_periods:
+                self.sensors[device_name].disable()
+                del self.sensor_periods[device_name]
+        self.device_profile = name
+
+    def _enable_sensor(self, name, period):
+        if self.sensor_periods.get(name) != period:
+            self.sensors[name].enable(period)
+            self.sensor_periods[name] = period
+
+    def _sensor(self, name):
+        if name not in self.sensor_periods:
+            self._enable_sensor(name, self.timestep)
+        return self.sensors[name]
+
+    def range_reading(self, name):
+        """
+        Range in meters, NaN while the sensor is disabled.
+        Unlike the lidar properties this never enables the sensor.
+        """
+        if name not in self.sensor_periods:
+            return nan
+        return self.sensors[name].getValue() / 1000
+
+    @property
+    def imu(self):
+        return self._sensor("inertial_unit")
+
+    @property
+    def gps(self):
+        return self._sensor("gps")
+
+    @property
+    def gyro(self):
+        return self._sensor("gyro")
+
+    @property
+    def front_lidar(self):
+        return self._sensor("range_front")
+
+    @property
+    def back_lidar(self):
+        return self._sensor("range_back")
+
+    @property
+    def left_lidar(self):
+        return self._sensor("range_left")
+
+    @property
+    def right_lidar(self):
+        return self._sensor("range_right")
+
+    @property
+    def camera(self):
+        return self._sensor("camera")
+
+    def sense(self):
+        """
+        Returns the SensorFrame of the current step, reading the devices
+        only on the first call after each robot.step.
+        """
+        frame = self.frame
+        current_time = self.robot.getTime()
+        if frame.time != current_time:
+            frame.capture(self, current_time)
+        return frame
+
+    def run(self, task):
+        """
+        Runs a task to completion with its own step loop.
+        """
+        return run_blocking(self.robot, self.timestep, task)
+
     def hover(self, target_altitude=None):
         """
-        Makes the drone hover at a specific altitude.
+        Makes the drone hover at a specific altitude (blocking).
         If target_altitude is not provided, uses FLYING_ATTITUDE.
         """
+        return self.run(self.hover_task(target_altitude))
+
+    def hover_task(self, target_altitude=None):
+        """
+        Task version of hover(): performs one control step per tick and
+        returns True once the target altitude is reached and stabilized.
+        """
         if target_altitude is None:
             target_altitude = self.FLYING_ATTITUDE
 
         print(f"Hovering at altitude: {target_altitude}m")
         past_time = self.robot.getTime()
 
-        while self.robot.step(self.timestep) != -1:
+        while True:
+            yield
             dt = self.robot.getTime() - past_time
             if dt <= 0:
                 past_time = self.robot.getTime()
                 continue
 
             # Get sensor readings
-            roll, pitch, yaw = self.imu.getRollPitchYaw()
-            yaw_rate = self.gyro.getValues()[2]
-            altitude = self.gps.getValues()[2]
-
-            # During hover, we want zero velocity
-            v_x = 0
-            v_y = 0
+            frame = self.sense()
+            altitude = frame.z
 
-            # Only altitude control is active during hover
-            motor_power = self.pid_controller.pid(dt, 0, 0, 0, target_altitude,
-                                                  roll, pitch, yaw_rate,
-                                                  altitude, v_x, v_y)
+            # Only altitude control is active during hover, zero velocity
+            motor_power = self.pid_controller.pid_frame(dt, 0, 0, 0, target_altitude, frame, 0, 0)
 
             # Apply motor commands
             self.m1_motor.setVelocity(-motor_power[0])
@@ -118,14 +224,12 @@ class Octopus:
                 print(f"Reached target altitude: {target_altitude}m")
                 # Wait a few steps to stabilize
                 for _ in range(20):
-                    self.robot.step(self.timestep)
+                    yield
                 # Set hover state
                 self.is_hovering = True
                 self.current_hover_altitude = target_altitude
                 return True
 
-        return False 
-
     def stay_hover(self):
         """
         Performs a single step of hover control.
@@ -135,19 +239,9 @@ class Octopus:
             print("Cannot stay hover: Drone is not in hover state!")
             return False
 
-        # Get sensor readings
-        roll, pitch, yaw = self.imu.getRollPitchYaw()
-        yaw_rate = self.gyro.getValues()[2]
-        altitude = self.gps.getValues()[2]
-
-        # During hover, we want zero velocity
-        v_x = 0
-        v_y = 0
-
-        # Only altitude control is active during hover
-        motor_power = self.pid_controller.pid(0.01, 0, 0, 0, self.current_hover_altitude,
-                                              roll, pitch, yaw_rate,
-                                              altitude, v_x, v_y)
+        # Only altitude control is active during hover, zero velocity
+        motor_power = self.pid_controller.pid_frame(0.01, 0, 0, 0, self.current_hover_altitude,
+                                                    self.sense(), 0, 0)
 
         # Apply motor commands
         self.m1_motor.setVelocity(-motor_power[0])
@@ -157,11 +251,33 @@ class Octopus:
 
         return True
 
+    def check_clearance(self, frame):
+        """
+        Clearance at the current position, None without a clearance field.
+        Warns once each time the drone comes closer than DRONE_RADIUS to a
+        ring or the floor.
+        """
+        if self.clearance_field is None:
+            return None
+        clearance = self.clearance_field.clearance(frame.x, frame.y, frame.z)
+        near_obstacle = clearance < DRONE_RADIUS
+        if near_obstacle and not self.near_obstacle:
+            print(f"Çarpışma riski! Engele mesafe: {clearance:.2f}m")
+        self.near_obstacle = near_obstacle
+        return clearance
+
     def goto(self, target_pos, kp_pos=None, threshold=None, max_vel=None):
         """
-        Makes the drone go to a specific position.
+        Makes the drone go to a specific position (blocking).
         target_pos should be a list/tuple of [x, y, z]
         """
+        return self.run(self.goto_task(target_pos, kp_pos, threshold, max_vel))
+
+    def goto_task(self, target_pos, kp_pos=None, threshold=None, max_vel=None):
+        """
+        Task version of goto(): performs one control step per tick and
+        returns True when the target is reached.
+        """
         # Reset hover state when starting to move
         self.is_hovering = False
         self.current_hover_altitude = None
@@ -177,30 +293,34 @@ class Octopus:
         print(f"Moving to target: X={target_x:.2f}, Y={target_y:.2f}, Z={target_z:.2f}")
 
         loop_start_time = self.robot.getTime()
-        past_time = self.robot.getTime()
-        past_x_global = self.gps.getValues()[0]
-        past_y_global = self.gps.getValues()[1]
+        frame = self.sense()
+        past_time = frame.time
+        past_x_global = frame.x
+        past_y_global = frame.y
 
         # Denge kontrolü için değişkenler
         max_pitch_roll = 0.3  # Maksimum pitch ve roll açısı (radyan)
         pitch_roll_stable_count = 0  # Dengeli durum sayacı
         required_stable_steps = 5  # Gerekli dengeli adım sayısı
 
-        while self.robot.step(self.timestep) != -1:
+        while True:
+            yield
+            frame = self.sense()
+
             # Rota noktasını kaydet
             if hasattr(self, 'route_recorder'):
                 self.route_recorder.record_point(self)
+            self.check_clearance(frame)
 
-            current_time = self.robot.getTime()
+            current_time = frame.time
             dt = current_time - past_time
             if dt <= 0:
                 past_time = current_time
                 continue
 
             # Get sensor readings
-            roll, pitch, yaw = self.imu.getRollPitchYaw()
-            yaw_rate = self.gyro.getValues()[2]
-            x_global, y_global, altitude = self.gps.getValues()
+            roll, pitch, yaw = frame.roll, frame.pitch, frame.yaw
+            x_global, y_global, altitude = frame.x, frame.y, frame.z
 
             # Denge kontrolü
             if abs(roll) < max_pitch_roll and abs(pitch) < max_pitch_roll:
@@ -240,17 +360,13 @@ class Octopus:
             error_y_global = target_y - y_global
 
             # Calculate desired yaw angle
-            desired_yaw = np.arctan2(error_y_global, error_x_global)
+            desired_yaw = atan2(error_y_global, error_x_global)
             
             # Normalize yaw difference to [-pi, pi]
-            yaw_diff = desired_yaw - yaw
-            while yaw_diff > np.pi:
-                yaw_diff -= 2 * np.pi
-            while yaw_diff < -np.pi:
-                yaw_diff += 2 * np.pi
+            yaw_diff = wrap_angle(desired_yaw - yaw)
 
             # Yaw control
-            yaw_desired = np.clip(yaw_diff * 0.5, -0.5, 0.5)
+            yaw_desired = clip(yaw_diff * 0.5, -0.5, 0.5)
 
             # Hareket kontrolü
             if abs(yaw_diff) < 0.1:  # ~5.7 derece
@@ -279,10 +395,9 @@ class Octopus:
                 sideways_desired *= scale
 
             # Get motor commands from PID controller
-            motor_power = self.pid_controller.pid(dt, forward_desired, sideways_desired,
-                                                  yaw_desired, target_z,
-                                                  roll, pitch, yaw_rate,
-                                                  altitude, v_x, v_y)
+            motor_power = self.pid_controller.pid_frame(dt, forward_desired, sideways_desired,
+                                                        yaw_desired, target_z,
+                                                        frame, v_x, v_y)
 
             # Apply motor commands
             self.m1_motor.setVelocity(-motor_power[0])
@@ -295,4 +410,204 @@ class Octopus:
             past_x_global = x_global
             past_y_global = y_global
 
-        return False
+    def follow_path_task(self, points, max_vel=None, lookahead=None, threshold=None, on_vertex=None):
+        """
+        Flies continuously along the polyline `points` ([x, y, z] each) with
+        pure pursuit, without stopping or turning in place at the vertices.
+        on_vertex(index) is called whenever the vertex points[index] has been
+        passed. Returns True when the end of the path is reached.
+        """
+        self.is_hovering = False
+        self.current_hover_altitude = None
+
+        if max_vel is None:
+            max_vel = self.MAX_VELOCITY
+        if lookahead is None:
+            lookahead = self.LOOKAHEAD_DISTANCE
+        if threshold is None:
+            threshold = self.TARGET_THRESHOLD
+
+        tracker = PurePursuit(points, lookahead)
+        end_x, end_y, end_z = tracker.points[-1]
+        print(f"Following path: {len(tracker.points)} points, {tracker.length:.2f}m")
+
+        frame = self.sense()
+        past_time = frame.time
+        past_x_global = frame.x
+        past_y_global = frame.y
+        last_vertex = -1
+
+        while True:
+            yield
+            frame = self.sense()
+
+            if hasattr(self, 'route_recorder'):
+                self.route_recorder.record_point(self)
+            self.check_clearance(frame)
+
+            current_time = frame.time
+            dt = current_time - past_time
+            if dt <= 0:
+                past_time = current_time
+                continue
+
+            x_global, y_global, altitude = frame.x, frame.y, frame.z
+            yaw = frame.yaw
+
+            if dt > 1e-5:
+                v_x_global = (x_global - past_x_global) / dt
+                v_y_global = (y_global - past_y_global) / dt
+            else:
+                v_x_global = 0
+                v_y_global = 0
+            cos_yaw = cos(yaw)
+            sin_yaw = sin(yaw)
+            v_x = v_x_global * cos_yaw + v_y_global * sin_yaw
+            v_y = -v_x_global * sin_yaw + v_y_global * cos_yaw
+
+            progress = tracker.update(x_global, y_global, altitude)
+            vertex = tracker.last_passed_index()
+            if vertex != last_vertex:
+                last_vertex = vertex
+                if on_vertex is not None:
+                    on_vertex(vertex)
+
+            remaining = tracker.length - progress
+            distance_to_end = sqrt((end_x - x_global) ** 2 + (end_y - y_global) ** 2 + (end_z - altitude) ** 2)
+            if remaining < lookahead and distance_to_end < threshold:
+                print(f"Path end reached! Distance: {distance_to_end:.3f}m")
+                if on_vertex is not None and last_vertex != tracker.source_index[-1]:
+                    on_vertex(tracker.source_index[-1])
+                self.is_hovering = True
+                self.current_hover_altitude = end_z
+                return True
+
+            target_x, target_y, target_z = tracker.target()
+            error_x_global = target_x - x_global
+            error_y_global = target_y - y_global
+            error_distance = sqrt(error_x_global ** 2 + error_y_global ** 2)
+
+            # Slow down for sharp corners ahead and for the end of the path
+            turn = tracker.turn_ahead(2 * lookahead)
+            speed = max_vel * (1.0 - (1.0 - self.CORNER_SPEED_RATIO) * min(1.0, turn / (pi / 2)))
+            speed = min(speed, self.POSITION_KP * distance_to_end)
+            if error_distance > 1e-6:
+                desired_vx_global = speed * error_x_global / error_distance
+                desired_vy_global = speed * error_y_global / error_distance
+            else:
+                desired_vx_global = desired_vy_global = 0.0
+
+            forward_desired = desired_vx_global * cos_yaw + desired_vy_global * sin_yaw
+            sideways_desired = -desired_vx_global * sin_yaw + desired_vy_global * cos_yaw
+
+            # Face the direction of travel while moving
+            if error_distance > 1e-6:
+                yaw_desired = clip(wrap_angle(atan2(error_y_global, error_x_global) - yaw) * 0.5, -0.5, 0.5)
+            else:
+                yaw_desired = 0.0
+
+            motor_power = self.pid_controller.pid_frame(dt, forward_desired, sideways_desired,
+                                                        yaw_desired, target_z,
+                                                        frame, v_x, v_y)
+
+            self.m1_motor.setVelocity(-motor_power[0])
+            self.m2_motor.setVelocity(motor_power[1])
+            self.m3_motor.setVelocity(-motor_power[2])
+            self.m4_motor.setVelocity(motor_power[3])
+
+            past_time = current_time
+            past_x_global = x_global
+            past_y_global = y_global
+
+    def follow_trajectory_task(self, trajectory, kp=None, threshold=None, on_gate=None):
+        """
+        Flies a time-parameterized Trajectory: the commanded velocity is the
+        trajectory velocity at the current time plus position feedback
+        towards the trajectory position. on_gate(index) is called when the
+        trajectory passes gate `index`. Returns True at the end point.
+        """
+        self.is_hovering = False
+        self.current_hover_altitude = None
+
+        if kp is None:
+            kp = self.TRAJECTORY_KP
+        if threshold is None:
+            threshold = self.TARGET_THRESHOLD
+
+        end_x, end_y, end_z = trajectory.positions[-1].tolist()
+        gate_times = trajectory.gate_times.tolist()
+        print(f"Following trajectory: {len(gate_times)} gates, {trajectory.duration:.2f}s")
+
+        frame = self.sense()
+        start_time = frame.time
+        past_time = frame.time
+        past_x_global = frame.x
+        past_y_global = frame.y
+        next_gate = 0
+
+        while True:
+            yield
+            frame = self.sense()
+
+            if hasattr(self, 'route_recorder'):
+                self.route_recorder.record_point(self)
+            self.check_clearance(frame)
+
+            current_time = frame.time
+            dt = current_time - past_time
+            if dt <= 0:
+                past_time = current_time
+                continue
+
+            x_global, y_global, altitude = frame.x, frame.y, frame.z
+            yaw = frame.yaw
+
+            if dt > 1e-5:
+                v_x_global = (x_global - past_x_global) / dt
+                v_y_global = (y_global - past_y_global) / dt
+            else:
+                v_x_global = 0
+                v_y_global = 0
+            cos_yaw = cos(yaw)
+            sin_yaw = sin(yaw)
+            v_x = v_x_global * cos_yaw + v_y_global * sin_yaw
+            v_y = -v_x_global * sin_yaw + v_y_global * cos_yaw
+
+            t = current_time - start_time
+            while next_gate < len(gate_times) and gate_times[next_gate] <= t:
+                if on_gate is not None:
+                    on_gate(next_gate)
+                next_gate += 1
+
+            distance_to_end = sqrt((end_x - x_global) ** 2 + (end_y - y_global) ** 2 + (end_z - altitude) ** 2)
+            if t >= trajectory.duration and distance_to_end < threshold:
+                print(f"Trajectory end reached! Distance: {distance_to_end:.3f}m")
+                self.is_hovering = True
+                self.current_hover_altitude = end_z
+                return True
+
+            (target_x, target_y, target_z), (ref_vx, ref_vy, _) = trajectory.sample(t)
+            desired_vx_global = ref_vx + kp * (target_x - x_global)
+            desired_vy_global = ref_vy + kp * (target_y - y_global)
+
+            forward_desired = desired_vx_global * cos_yaw + desired_vy_global * sin_yaw
+            sideways_desired = -desired_vx_global * sin_yaw + desired_vy_global * cos_yaw
+
+            # Face the direction of travel while moving
+            if ref_vx * ref_vx + ref_vy * ref_vy > 1e-4:
+                yaw_desired = clip(wrap_angle(atan2(ref_vy, ref_vx) - yaw) * 0.5, -0.5, 0.5)
+            else:
+                yaw_desired = 0.0
+
+            motor_power = self.pid_controller.pid_frame(dt, forward_desired, sideways_desired,
+                                                        yaw_desired, target_z,
+                                                        frame, v_x, v_y)
+
+            self.m1_motor.setVelocity(-motor_power[0])
+            self.m2_motor.setVelocity(motor_power[1])
+            self.m3_motor.setVelocity(-motor_power[2])
+            self.m4_motor.setVelocity(motor_power[3])
+
+            past_time = current_time
+            past_x_global = x_global
+            past_y_global = y_global
@@ -0,0 +1,181 @@
+"""
+Streaming gate-passage detection from the side ranges.
+
+A passage opens on the first sample where either side range drops below
+the threshold. It closes only after both ranges have read above
+threshold + EXIT_MARGIN for RELEASE_SAMPLES samples in a row and the
+drone has flown RELEASE_DISTANCE past the last reading inside. So a noisy
+reading at the ring edge neither opens a second passage nor ends the
+current one early, and an oblique pass, where the left and the right
+range cross the ring plane at different times, stays one passage. While
+it is open the detector keeps running sums, and it reports the passage
+once, when it closes. Every sample is O(1): it is written
+into a fixed-size ring buffer (used for the velocity over the last few
+samples) and added to the sums.
+
+The same detector runs live on SensorFrames and offline on recorded
+route arrays (detect_route_passages).
+"""
+from math import atan2, cos, nan, sin, sqrt
+import numpy as np
+
+# Both ranges must read above threshold + EXIT_MARGIN to close a passage
+EXIT_MARGIN = 0.1
+RELEASE_SAMPLES = 3
+# Ring radius: the other side range reaches the ring plane within this on an oblique pass
+RELEASE_DISTANCE = 0.5
+BUFFER_SIZE = 32
+# Samples back for the passage velocity
+VELOCITY_WINDOW = 8
+# A side range below this hits the ring being passed (inner diameter 0.9 m)
+WALL_RANGE = 1.0
+
+# Ring buffer columns
+_T, _X, _Y, _Z, _ROLL, _PITCH, _YAW, _LEFT, _RIGHT = range(9)
+
+
+class PassageDetector:
+    def __init__(self, threshold=0.5, exit_margin=EXIT_MARGIN, release_samples=RELEASE_SAMPLES,
+                 release_distance=RELEASE_DISTANCE, buffer_size=BUFFER_SIZE, velocity_window=VELOCITY_WINDOW):
+        self.threshold = threshold
+        self.exit_threshold = threshold + exit_margin
+        self.release_samples = release_samples
+        self.release_distance = release_distance
+        self.velocity_window = min(velocity_window, buffer_size - 1)
+        self.buffer = np.zeros((buffer_size, 9))
+        self.reset()
+
+    def reset(self):
+        """Forgets the buffered samples and any open passage."""
+        self.count = 0
+        self.head = 0
+        self.active = False
+        self.clear_samples = 0
+        self._open_passage()
+
+    def _open_passage(self):
+        self.samples = 0
+        self.last_inside_time = 0.0
+        self.last_inside_position = (0.0, 0.0, 0.0)
+        # (t, x, y, z) VELOCITY_WINDOW samples before the last one inside
+        self.window_start = None
+        # Ring wall points seen by each side range, and the most balanced sample
+        self.left_wall = [0.0, 0.0, 0]
+        self.right_wall = [0.0, 0.0, 0]
+        self.z_sum = 0.0
+        self.best_balance = float('inf')
+        self.best = None
+        self.side_votes = 0
+
+    def update_frame(self, frame):
+        return self.update(frame.time, frame.x, frame.y, frame.z, frame.roll, frame.pitch, frame.yaw,
+                           frame.range_left, frame.range_right)
+
+    def update(self, t, x, y, z, roll, pitch, yaw, left, right):
+        """Adds one sample; returns the passage (passage_data dict) when one has just closed, else None."""
+        sample = (t, x, y, z, roll, pitch, yaw, left, right)
+        self.buffer[self.head] = sample
+        self.head = (self.head + 1) % len(self.buffer)
+        self.count += 1
+
+        # NaN (disabled sensor) never opens a passage and counts as clear
+        inside = left < self.threshold or right < self.threshold
+        if not self.active:
+            if not inside:
+                return None
+            self.active = True
+            self.clear_samples = 0
+            self._open_passage()
+        elif not (left < self.exit_threshold or right < self.exit_threshold):
+            self.clear_samples += 1
+            if self.clear_samples >= self.release_samples:
+                last_x, last_y, last_z = self.last_inside_position
+                dx, dy, dz = x - last_x, y - last_y, z - last_z
+                if dx * dx + dy * dy + dz * dz >= self.release_distance * self.release_distance:
+                    self.active = False
+                    return self._close()
+            return None
+        else:
+            self.clear_samples = 0
+
+        self.samples += 1
+        self.last_inside_time = t
+        self.last_inside_position = (x, y, z)
+        window = min(self.velocity_window, self.count - 1)
+        self.window_start = self.buffer[(self.head - 1 - window) % len(self.buffer), _T:_Z + 1].tolist()
+        self.z_sum += z
+        self.side_votes += 1 if left < right else -1
+        # The left range looks along (-sin(yaw), cos(yaw))
+        if left < WALL_RANGE:
+            self.left_wall[0] += x - left * sin(yaw)
+            self.left_wall[1] += y + left * cos(yaw)
+            self.left_wall[2] += 1
+        if right < WALL_RANGE:
+            self.right_wall[0] += x + right * sin(yaw)
+            self.right_wall[1] += y - right * cos(yaw)
+            self.right_wall[2] += 1
+        balance = abs(left - right) if left == left and right == right else float('inf')
+        if self.best is None or balance < self.best_balance:
+            self.best_balance = balance
+            self.best = sample
+        return None
+
+    def finish(self):
+        """Closes a passage still open at the end of a log; returns it, or None."""
+        if not self.active:
+            return None
+        self.active = False
+        return self._close()
+
+    def _close(self):
+        best = self.best
+        left_x, left_y, left_samples = self.left_wall
+        right_x, right_y, right_samples = self.right_wall
+        if left_samples and right_samples:
+            # Midway between the walls seen on either side
+            x = 0.5 * (left_x / left_samples + right_x / right_samples)
+            y = 0.5 * (left_y / left_samples + right_y / right_samples)
+        else:
+            x, y = best[_X], best[_Y]
+        z = self.z_sum / self.samples
+
+        # Over the last VELOCITY_WINDOW samples up to the last one inside the ring
+        start_t, start_x, start_y, start_z = self.window_start
+        end_x, end_y, end_z = self.last_inside_position
+        elapsed = self.last_inside_time - start_t
+        if elapsed > 0:
+            scale = 1.0 / elapsed
+            v_x, v_y, v_z = (end_x - start_x) * scale, (end_y - start_y) * scale, (end_z - start_z) * scale
+        else:
+            v_x = v_y = v_z = 0.0
+
+        return {
+            'position': {'x': x, 'y': y, 'z': z},
+            'orientation': {'roll': best[_ROLL], 'pitch': best[_PITCH], 'yaw': best[_YAW]},
+            'velocity': {'v_x': v_x, 'v_y': v_y, 'v_z': v_z},
+            'passage_info': {
+                'side': "left" if self.side_votes > 0 else "right",
+                'left_lidar': best[_LEFT],
+                'right_lidar': best[_RIGHT],
+                'timestamp': best[_T],
+                'heading': atan2(v_y, v_x) if v_x or v_y else nan,
+                'speed': sqrt(v_x * v_x + v_y * v_y + v_z * v_z),
+                'samples': self.samples
+            }
+        }
+
+
+def detect_route_passages(route, threshold=0.5, **params):
+    """Passages in a recorded route (RouteRecorder.route / ROUTE_DTYPE rows), in time order."""
+    detector = PassageDetector(threshold, **params)
+    passages = []
+    rows = zip(route['timestamp'].tolist(), route['position'].tolist(), route['orientation'].tolist(),
+               route['lidar'][:, 2].tolist(), route['lidar'][:, 3].tolist())
+    for t, (x, y, z), (roll, pitch, yaw), left, right in rows:
+        passage = detector.update(t, x, y, z, roll, pitch, yaw, left, right)
+        if passage is not None:
+            passages.append(passage)
+    passage = detector.finish()
+    if passage is not None:
+        passages.append(passage)
+    return passages
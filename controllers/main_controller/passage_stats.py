@@ -0,0 +1,111 @@
+"""
+Running per-checkpoint passage statistics. A checkpoint keeps only its
+last few passages, but 'passage_stats' aggregates every passage ever
+recorded with Welford updates, as JSON-friendly lists:
+
+    {'count': n, 'metrics': {name: [samples, mean, m2]},
+     'angles': {name: [samples, sum of sines, sum of cosines]}}
+
+Angles wrap at +-pi, where a linear mean of headings either side of the
+seam points the opposite way; they are averaged as unit vectors instead.
+"""
+from math import atan2, cos, hypot, isnan, log, sin, sqrt
+
+
+def passage_metrics(passage):
+    """Scalar values aggregated for one passage_history entry."""
+    lidar = passage['lidar_readings']
+    velocity = passage['velocity']
+    orientation = passage['orientation']
+    left, right = lidar['left'], lidar['right']
+    return {
+        'lidar_left': left,
+        'lidar_right': right,
+        'lidar_balance': (right - left) / max(right + left, 0.1),
+        'vx': velocity['vx'],
+        'vy': velocity['vy'],
+        'vz': velocity['vz'],
+        'speed': sqrt(velocity['vx']**2 + velocity['vy']**2 + velocity['vz']**2),
+        'roll': orientation['roll'],
+        'pitch': orientation['pitch'],
+        'instability': abs(orientation['roll']) + abs(orientation['pitch'])
+    }
+
+
+def passage_angles(passage):
+    """Angles (radians) aggregated on the circle for one passage_history entry."""
+    return {'yaw': passage['orientation']['yaw']}
+
+
+def new_stats():
+    return {'count': 0, 'metrics': {}, 'angles': {}}
+
+
+def update_stats(stats, passage):
+    stats['count'] += 1
+    metrics = stats['metrics']
+    for name, value in passage_metrics(passage).items():
+        # Disabled sensors read NaN; leave them out of that metric only
+        if value is None or isnan(value):
+            continue
+        aggregate = metrics.setdefault(name, [0, 0.0, 0.0])
+        aggregate[0] += 1
+        delta = value - aggregate[1]
+        aggregate[1] += delta / aggregate[0]
+        aggregate[2] += delta * (value - aggregate[1])
+    angles = stats['angles']
+    for name, value in passage_angles(passage).items():
+        if value is None or isnan(value):
+            continue
+        aggregate = angles.setdefault(name, [0, 0.0, 0.0])
+        aggregate[0] += 1
+        aggregate[1] += sin(value)
+        aggregate[2] += cos(value)
+    return stats
+
+
+def stats_from_history(history):
+    stats = new_stats()
+    for passage in history:
+        update_stats(stats, passage)
+    return stats
+
+
+def upgrade_stats(stats, history):
+    """
+    Stats written before angles were aggregated on the circle: their linear
+    yaw mean is dropped and the angles restart from the passages still kept.
+    """
+    stats['metrics'].pop('yaw', None)
+    stats['angles'] = stats_from_history(history)['angles']
+    return stats
+
+
+def mean(stats, name):
+    aggregate = stats['metrics'].get(name)
+    return aggregate[1] if aggregate else None
+
+
+def variance(stats, name):
+    """Sample variance, None with fewer than two samples."""
+    aggregate = stats['metrics'].get(name)
+    if not aggregate or aggregate[0] < 2:
+        return None
+    return aggregate[2] / (aggregate[0] - 1)
+
+
+def circular_mean(stats, name):
+    """Mean direction in (-pi, pi], None without samples or when they cancel out."""
+    aggregate = stats['angles'].get(name)
+    if not aggregate or (aggregate[1] == 0.0 and aggregate[2] == 0.0):
+        return None
+    return atan2(aggregate[1], aggregate[2])
+
+
+def circular_spread(stats, name):
+    """Circular standard deviation sqrt(-2 ln R) in radians, None without samples."""
+    aggregate = stats['angles'].get(name)
+    if not aggregate:
+        return None
+    resultant = min(hypot(aggregate[1], aggregate[2]) / aggregate[0], 1.0)
+    return sqrt(2 * abs(log(resultant))) if resultant > 0 else float('inf')
@@ -1,6 +1,14 @@
+import heapq
 from math import sqrt
 from typing import List, Dict, Optional, Tuple
 import numpy as np
+from spatial_index import radius_pairs
+
+# Average speed (m/s) at which an edge costs exactly its length; slower
+# recorded edges cost proportionally more
+REFERENCE_SPEED = 1.0
+
+TRANSITION_TYPES = ("straight", "turn_left", "turn_right")
 
 class CheckpointNode:
     def __init__(self, checkpoint_id: int, position: Tuple[float, float, float], 
@@ -11,6 +19,8 @@ class CheckpointNode:
         self.orientation = orientation 
         self.passage_info = passage_info or {} 
         self.connections: List[CheckpointNode] = []
+        # Weighted graph from CheckpointManager: (node, distance, difficulty, average_speed)
+        self.edges: List[Tuple['CheckpointNode', float, float, float]] = []
         self.transition_type = "straight" 
         self.approach_angle = 0.0  
         self.exit_angle = 0.0  
@@ -59,22 +69,38 @@ def create_checkpoint_connections(checkpoints: List[CheckpointNode], max_distanc
     for checkpoint in checkpoints:
         checkpoint.connections = []
     
+    if len(checkpoints) < 2:
+        return
+    geometry = route_geometry(checkpoints)
+    
     for i in range(len(checkpoints) - 1):
         current = checkpoints[i]
         next_cp = checkpoints[i + 1]
         
-        transition_type = current.calculate_transition_type(next_cp)
-        approach_angle = current.calculate_approach_angle(next_cp)
-        exit_angle = current.calculate_exit_angle(next_cp)
-        
-        current.transition_type = transition_type
-        current.approach_angle = approach_angle
-        current.exit_angle = exit_angle
+        current.transition_type = TRANSITION_TYPES[geometry['transitions'][i]]
+        current.approach_angle = geometry['approach_angles'][i]
+        current.exit_angle = geometry['exit_angles'][i]
         
         current.connections = [next_cp]  
         print(f"Checkpoint {current.id} -> {next_cp.id} bağlantısı oluşturuldu")
 
 
+def connect_within(checkpoints: List[CheckpointNode], radius: float = 3.0) -> None:
+    """
+    Weighted edges between every two checkpoints within `radius`, the way
+    CheckpointManager connects them before any difficulty or speed is recorded.
+    """
+    for checkpoint in checkpoints:
+        checkpoint.edges = []
+    if len(checkpoints) < 2:
+        return
+    positions = [checkpoint.position for checkpoint in checkpoints]
+    i, j, distance = radius_pairs(positions, positions, radius)
+    for a, b, length in sorted(zip(i.tolist(), j.tolist(), distance.tolist())):
+        if a != b:
+            checkpoints[a].edges.append((checkpoints[b], length, 1.0, 0.0))
+
+
 def calculate_median_height(checkpoints: List[CheckpointNode]) -> float:
     heights = [cp.position[2] for cp in checkpoints]
     heights.sort()
@@ -124,46 +150,157 @@ def calculate_optimal_intermediate_point(current: CheckpointNode, next_cp: Check
     
     return (base_x, base_y, base_z)
 
-def a_star_pathfinding(start_checkpoint: CheckpointNode, 
-                      goal_checkpoint: CheckpointNode,
-                      all_checkpoints: List[CheckpointNode]) -> Optional[List[CheckpointNode]]:
-    sorted_checkpoints = sorted(all_checkpoints, key=lambda x: x.id)
-    
-    start_idx = next(i for i, cp in enumerate(sorted_checkpoints) if cp.id == start_checkpoint.id)
-    goal_idx = next(i for i, cp in enumerate(sorted_checkpoints) if cp.id == goal_checkpoint.id)
+def _wrap_angles(angles: np.ndarray) -> np.ndarray:
+    # Same repeated +-2pi steps as the scalar loops, so results match bit for bit
+    angles = angles.copy()
+    while True:
+        over = angles > np.pi
+        if not over.any():
+            break
+        angles[over] -= 2 * np.pi
+    while True:
+        under = angles < -np.pi
+        if not under.any():
+            break
+        angles[under] += 2 * np.pi
+    return angles
+
+
+def route_geometry(route: List[CheckpointNode]) -> Dict[str, np.ndarray]:
+    """
+    Array form of the per-pair geometry for consecutive route nodes, for
+    pair i = (route[i], route[i + 1]):
+
+        approach_angles, exit_angles  headings of the pair (n - 1,)
+        transitions                   index into TRANSITION_TYPES (n - 1,)
+        turns                         route[i + 1] starts a turn (n - 1,)
+        intermediate_points           cornering point for route[i + 1] (n - 1, 3)
+
+    Matches the CheckpointNode methods and calculate_optimal_intermediate_point.
+    """
+    positions = np.array([cp.position for cp in route], dtype=float).reshape(-1, 3)
+    yaws = np.array([cp.orientation[2] for cp in route], dtype=float)
+    delta = positions[1:] - positions[:-1]
+    approach_angles = np.arctan2(delta[:, 1], delta[:, 0])
+    exit_angles = np.arctan2(-delta[:, 1], -delta[:, 0])
+
+    yaw_diff = _wrap_angles(np.abs(yaws[:-1] - yaws[1:]))
+    transitions = np.where(np.abs(yaw_diff) < 0.1, 0, np.where(yaw_diff > 0, 1, 2))
+
+    # Turn at route[i + 1]: heading change between pair i and pair i + 1
+    turn_diff = _wrap_angles(approach_angles[1:] - approach_angles[:-1])
+    turns = np.zeros(len(delta), dtype=bool)
+    turns[:-1] = np.abs(turn_diff) > 0.1
+    side = np.where(turn_diff > 0, np.pi / 2, -np.pi / 2)
+    intermediate_points = positions[1:].copy()
+    outgoing = approach_angles[1:][turns[:-1]]
+    side = side[turns[:-1]]
+    intermediate_points[:-1][turns[:-1], 0] += 0.2 * np.cos(outgoing + side)
+    intermediate_points[:-1][turns[:-1], 1] += 0.2 * np.sin(outgoing + side)
+
+    return {
+        'approach_angles': approach_angles,
+        'exit_angles': exit_angles,
+        'transitions': transitions,
+        'turns': turns,
+        'intermediate_points': intermediate_points,
+    }
+
+
+def edge_cost(distance: float, difficulty: float, average_speed: float) -> float:
+    """
+    Traversal cost of a connection. Never below its length, so the straight
+    line distance stays an admissible A* heuristic.
+    """
+    cost = distance * max(difficulty, 1.0)
+    if average_speed > 0:
+        cost *= max(REFERENCE_SPEED / average_speed, 1.0)
+    return cost
+
+
+def shortest_path(start_checkpoint: CheckpointNode,
+                  goal_checkpoint: CheckpointNode) -> Optional[List[CheckpointNode]]:
+    """Heap-based A* over CheckpointNode.edges, Euclidean heuristic."""
+    goal_position = goal_checkpoint.position
+
+    def heuristic(node):
+        return sqrt(sum((a - b) ** 2 for a, b in zip(node.position, goal_position)))
+
+    best_cost = {start_checkpoint.id: 0.0}
+    came_from = {start_checkpoint.id: None}
+    nodes = {start_checkpoint.id: start_checkpoint}
+    # (estimate, cost, tie-breaker, node id)
+    open_heap = [(heuristic(start_checkpoint), 0.0, 0, start_checkpoint.id)]
+    counter = 1
+    closed = set()
+    while open_heap:
+        _, cost, _, node_id = heapq.heappop(open_heap)
+        if node_id in closed:
+            continue
+        if node_id == goal_checkpoint.id:
+            path = []
+            while node_id is not None:
+                path.append(nodes[node_id])
+                node_id = came_from[node_id]
+            return path[::-1]
+        closed.add(node_id)
+        for neighbour, distance, difficulty, average_speed in nodes[node_id].edges:
+            new_cost = cost + edge_cost(distance, difficulty, average_speed)
+            if neighbour.id in closed or new_cost >= best_cost.get(neighbour.id, float('inf')):
+                continue
+            best_cost[neighbour.id] = new_cost
+            came_from[neighbour.id] = node_id
+            nodes[neighbour.id] = neighbour
+            heapq.heappush(open_heap, (new_cost + heuristic(neighbour), new_cost, counter, neighbour.id))
+            counter += 1
+    return None
+
+
+def add_intermediate_points(route: List[CheckpointNode]) -> List[CheckpointNode]:
+    """Inserts the cornering point before every checkpoint that starts a turn."""
+    if len(route) < 3:
+        return list(route)
+    geometry = route_geometry(route)
+    turns = geometry['turns']
+    points = geometry['intermediate_points']
     
     path = []
-    current_idx = start_idx
-    
-    while current_idx <= goal_idx:
-        current = sorted_checkpoints[current_idx]
+    for i, current in enumerate(route):
         path.append(current)
         
-        if current_idx + 1 <= goal_idx:
-            next_cp = sorted_checkpoints[current_idx + 1]
-            next_next_cp = sorted_checkpoints[current_idx + 2] if current_idx + 2 <= goal_idx else None
-            
-            optimal_pos = calculate_optimal_intermediate_point(current, next_cp, next_next_cp)
-            
-            if optimal_pos != next_cp.position:
-                intermediate = CheckpointNode(
-                    next_cp.id,
-                    optimal_pos,
-                    next_cp.orientation,
-                    next_cp.passage_info
-                )
-                intermediate.potential_field = next_cp.potential_field.copy()
-                path.append(intermediate)
-                print(f"Checkpoint {current.id} -> {next_cp.id} arası optimal ara nokta: "
-                      f"X={optimal_pos[0]:.2f}, Y={optimal_pos[1]:.2f}, Z={optimal_pos[2]:.2f}")
-        
-        current_idx += 1
+        if i + 1 < len(route) and turns[i]:
+            next_cp = route[i + 1]
+            optimal_pos = (float(points[i, 0]), float(points[i, 1]), next_cp.position[2])
+            intermediate = CheckpointNode(
+                next_cp.id,
+                optimal_pos,
+                next_cp.orientation,
+                next_cp.passage_info
+            )
+            intermediate.potential_field = next_cp.potential_field.copy()
+            path.append(intermediate)
+            print(f"Checkpoint {current.id} -> {next_cp.id} arası optimal ara nokta: "
+                  f"X={optimal_pos[0]:.2f}, Y={optimal_pos[1]:.2f}, Z={optimal_pos[2]:.2f}")
     
     return path
 
 
+def a_star_pathfinding(start_checkpoint: CheckpointNode,
+                      goal_checkpoint: CheckpointNode) -> Optional[List[CheckpointNode]]:
+    """A* route over CheckpointNode.edges, with the cornering points inserted."""
+    route = shortest_path(start_checkpoint, goal_checkpoint)
+    if route is None:
+        return None
+    return add_intermediate_points(route)
+
+
 def find_path_between_checkpoints(start_id: int, goal_id: int, 
                                 checkpoints: List[CheckpointNode]) -> Optional[List[CheckpointNode]]:
+    """
+    Route between two checkpoints. The search follows the weighted edges of
+    the CheckpointManager connection graph (CheckpointTable.nodes()); nodes
+    built without any edges are first connected by distance.
+    """
     start_checkpoint = next((cp for cp in checkpoints if cp.id == start_id), None)
     goal_checkpoint = next((cp for cp in checkpoints if cp.id == goal_id), None)
     
@@ -171,13 +308,14 @@ def find_path_between_checkpoints(start_id: int, goal_id: int,
         print(f"Checkpoint'ler bulunamadı: {start_id} -> {goal_id}")
         return None
     
-    create_checkpoint_connections(checkpoints)
+    if not any(cp.edges for cp in checkpoints):
+        connect_within(checkpoints)
     
-    path = a_star_pathfinding(start_checkpoint, goal_checkpoint, checkpoints)
+    path = a_star_pathfinding(start_checkpoint, goal_checkpoint)
     
     if not path:
         print("Yol bulunamadı!")
         return None
     
     print(f"\nBulunan yol: {' -> '.join(str(cp.id) for cp in path)}")
-    return path 
\ No newline at end of file
+    return path
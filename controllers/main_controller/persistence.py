@@ -0,0 +1,116 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+
+def write_json(path, data):
+    """Writes JSON atomically so readers never see a half-written file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class PersistenceWorker:
+    """
+    Writes files on a background thread so the control loop never blocks
+    on disk I/O. Jobs are keyed by file path: a snapshot submitted while an
+    older one for the same path is still waiting replaces it (bursts are
+    coalesced into a single write). The queue is bounded, so a stalled
+    disk eventually applies backpressure instead of growing memory.
+    """
+    def __init__(self, max_pending=64):
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'written': 0,
+            'failed': 0,
+            'submit_seconds': 0.0,
+            'max_submit_seconds': 0.0,
+            'write_seconds': 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, payload, writer=write_json, merge=None):
+        """
+        Queues writer(path, payload). The payload must not be modified by
+        the caller afterwards (pass a snapshot/copy). If a job for the same
+        path is still waiting, the new payload replaces it, or is combined
+        with it as merge(old_payload, payload) when merge is given.
+        """
+        if not self.thread.is_alive():
+            # Closed (interpreter exit): write on the caller's thread
+            writer(path, payload)
+            return
+        start = time.perf_counter()
+        # Resolved now: the working directory may change before the write
+        path = os.path.abspath(path)
+        with self.lock:
+            self.stats['submitted'] += 1
+            if path in self.pending:
+                if merge is not None:
+                    payload = merge(self.pending[path][1], payload)
+                self.pending[path] = (writer, payload)
+                self.stats['coalesced'] += 1
+                enqueue = False
+            else:
+                self.pending[path] = (writer, payload)
+                enqueue = True
+        if enqueue:
+            self.jobs.put(path)
+        elapsed = time.perf_counter() - start
+        self.stats['submit_seconds'] += elapsed
+        self.stats['max_submit_seconds'] = max(self.stats['max_submit_seconds'], elapsed)
+
+    def flush(self):
+        """Blocks until every queued write has finished."""
+        self.jobs.join()
+
+    def _run(self):
+        while True:
+            path = self.jobs.get()
+            try:
+                if path is None:
+                    return
+                with self.lock:
+                    writer, payload = self.pending.pop(path)
+                start = time.perf_counter()
+                try:
+                    writer(path, payload)
+                    self.stats['written'] += 1
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    print(f"Error writing {path}: {e}")
+                self.stats['write_seconds'] += time.perf_counter() - start
+            finally:
+                self.jobs.task_done()
+
+    def close(self):
+        """Flushes pending writes and stops the thread."""
+        if self.thread.is_alive():
+            self.jobs.put(None)
+            self.thread.join()
+
+
+_worker = None
+
+
+def get_worker():
+    """Shared worker, started on first use and flushed at interpreter exit."""
+    global _worker
+    if _worker is None:
+        _worker = PersistenceWorker()
+        atexit.register(_worker.close)
+    return _worker
+
+
+def flush():
+    if _worker is not None:
+        _worker.flush()
@@ -1,62 +1,89 @@
 import numpy as np
+from control_kernels import VelocityHeightKernel
 
 
-class pid_velocity_fixed_height_controller():
+class pid_velocity_fixed_height_controller(VelocityHeightKernel):
+    """
+    Single-drone controller. pid() runs the allocation-free scalar kernel
+    and returns its motor list, which is overwritten by the next call.
+    """
     def __init__(self):
-        self.past_vx_error = 0.0
-        self.past_vy_error = 0.0
-        self.past_alt_error = 0.0
-        self.past_pitch_error = 0.0
-        self.past_roll_error = 0.0
-        self.altitude_integrator = 0.0
+        super().__init__()
         self.last_time = 0.0
 
+    pid = VelocityHeightKernel.step
+    pid_frame = VelocityHeightKernel.step_frame
+
+
+class batch_pid_velocity_fixed_height_controller():
+    """
+    Same controller as pid_velocity_fixed_height_controller for N drones at
+    once: the error/integrator state lives in arrays of shape (N,) and one
+    pid() call returns the (N, 4) motor commands of the whole fleet.
+    Scalar inputs are broadcast to every drone. The returned array is
+    reused by the next call.
+    """
+    def __init__(self, n_drones):
+        self.n_drones = n_drones
+        self.gains = {"kp_att_y": 1, "kd_att_y": 0.5, "kp_att_rp": 0.5, "kd_att_rp": 0.1,
+                      "kp_vel_xy": 2, "kd_vel_xy": 0.5, "kp_z": 10, "ki_z": 5, "kd_z": 5}
+        self.past_vx_error = np.zeros(n_drones)
+        self.past_vy_error = np.zeros(n_drones)
+        self.past_alt_error = np.zeros(n_drones)
+        self.past_pitch_error = np.zeros(n_drones)
+        self.past_roll_error = np.zeros(n_drones)
+        self.altitude_integrator = np.zeros(n_drones)
+        self.motor_power = np.zeros((n_drones, 4))
+
+    def reset(self, indices=None):
+        if indices is None:
+            indices = slice(None)
+        for state in (self.past_vx_error, self.past_vy_error, self.past_alt_error,
+                      self.past_pitch_error, self.past_roll_error, self.altitude_integrator):
+            state[indices] = 0.0
+
     def pid(self, dt, desired_vx, desired_vy, desired_yaw_rate, desired_altitude, actual_roll, actual_pitch, actual_yaw_rate,
             actual_altitude, actual_vx, actual_vy):
-      
-        gains = {"kp_att_y": 1, "kd_att_y": 0.5, "kp_att_rp": 0.5, "kd_att_rp": 0.1,
-                 "kp_vel_xy": 2, "kd_vel_xy": 0.5, "kp_z": 10, "ki_z": 5, "kd_z": 5}
+        gains = self.gains
 
         # Velocity PID control
-        vx_error = desired_vx - actual_vx
+        vx_error = np.subtract(desired_vx, actual_vx)
         vx_deriv = (vx_error - self.past_vx_error) / dt
-        vy_error = desired_vy - actual_vy
+        vy_error = np.subtract(desired_vy, actual_vy)
         vy_deriv = (vy_error - self.past_vy_error) / dt
         desired_pitch = gains["kp_vel_xy"] * np.clip(vx_error, -1, 1) + gains["kd_vel_xy"] * vx_deriv
         desired_roll = -gains["kp_vel_xy"] * np.clip(vy_error, -1, 1) - gains["kd_vel_xy"] * vy_deriv
-        self.past_vx_error = vx_error
-        self.past_vy_error = vy_error
+        self.past_vx_error[:] = vx_error
+        self.past_vy_error[:] = vy_error
 
         # Altitude PID control
-        alt_error = desired_altitude - actual_altitude
+        alt_error = np.subtract(desired_altitude, actual_altitude)
         alt_deriv = (alt_error - self.past_alt_error) / dt
         self.altitude_integrator += alt_error * dt
         alt_command = gains["kp_z"] * alt_error + gains["kd_z"] * alt_deriv + \
             gains["ki_z"] * np.clip(self.altitude_integrator, -2, 2) + 48
-        self.past_alt_error = alt_error
+        self.past_alt_error[:] = alt_error
 
         # Attitude PID control
         pitch_error = desired_pitch - actual_pitch
         pitch_deriv = (pitch_error - self.past_pitch_error) / dt
         roll_error = desired_roll - actual_roll
         roll_deriv = (roll_error - self.past_roll_error) / dt
-        yaw_rate_error = desired_yaw_rate - actual_yaw_rate
+        yaw_rate_error = np.subtract(desired_yaw_rate, actual_yaw_rate)
         roll_command = gains["kp_att_rp"] * np.clip(roll_error, -1, 1) + gains["kd_att_rp"] * roll_deriv
         pitch_command = -gains["kp_att_rp"] * np.clip(pitch_error, -1, 1) - gains["kd_att_rp"] * pitch_deriv
         yaw_command = gains["kp_att_y"] * np.clip(yaw_rate_error, -1, 1)
-        self.past_pitch_error = pitch_error
-        self.past_roll_error = roll_error
+        self.past_pitch_error[:] = pitch_error
+        self.past_roll_error[:] = roll_error
 
         # Motor mixing
-        m1 = alt_command - roll_command + pitch_command + yaw_command
-        m2 = alt_command - roll_command - pitch_command - yaw_command
-        m3 = alt_command + roll_command - pitch_command + yaw_command
-        m4 = alt_command + roll_command + pitch_command - yaw_command
+        motor_power = self.motor_power
+        motor_power[:, 0] = alt_command - roll_command + pitch_command + yaw_command
+        motor_power[:, 1] = alt_command - roll_command - pitch_command - yaw_command
+        motor_power[:, 2] = alt_command + roll_command - pitch_command + yaw_command
+        motor_power[:, 3] = alt_command + roll_command + pitch_command - yaw_command
 
         # Limit the motor command
-        m1 = np.clip(m1, 0, 600)
-        m2 = np.clip(m2, 0, 600)
-        m3 = np.clip(m3, 0, 600)
-        m4 = np.clip(m4, 0, 600)
+        np.clip(motor_power, 0, 600, out=motor_power)
 
-        return [m1, m2, m3, m4]
+        return motor_power
@@ -1,8 +1,10 @@
 from dataclasses import dataclass
 from typing import List, Dict, Tuple
-import json
+import os
 import time
 from datetime import datetime
+import numpy as np
+import persistence
 
 @dataclass
 class RoutePoint:
@@ -25,6 +27,19 @@ class RoutePoint:
             'is_checkpoint': self.is_checkpoint
         }
 
+    @classmethod
+    def from_row(cls, row) -> 'RoutePoint':
+        checkpoint_id = int(row['checkpoint_id'])
+        return cls(
+            timestamp=float(row['timestamp']),
+            position=tuple(row['position'].tolist()),
+            orientation=tuple(row['orientation'].tolist()),
+            velocity=tuple(row['velocity'].tolist()),
+            lidar_readings=dict(zip(LIDAR_NAMES, row['lidar'].tolist())),
+            checkpoint_id=None if checkpoint_id < 0 else checkpoint_id,
+            is_checkpoint=bool(row['is_checkpoint'])
+        )
+
     @classmethod
     def from_dict(cls, data: Dict) -> 'RoutePoint':
         return cls(
@@ -45,10 +60,92 @@ class RouteSegment:
     distance: float  
     avg_speed: float  
 
+# One row per recorded sample; checkpoint_id is -1 when unknown
+ROUTE_DTYPE = np.dtype([
+    ('timestamp', 'f8'),
+    ('position', 'f8', (3,)),
+    ('orientation', 'f8', (3,)),
+    ('velocity', 'f8', (3,)),
+    ('lidar', 'f8', (4,)),
+    ('checkpoint_id', 'i4'),
+    ('is_checkpoint', '?'),
+])
+LIDAR_NAMES = ("front", "back", "left", "right")
+
+
+def compute_segments(route: np.ndarray) -> Dict[str, np.ndarray]:
+    start_time = route['timestamp'][:-1]
+    end_time = route['timestamp'][1:]
+    duration = end_time - start_time
+    distance = np.linalg.norm(np.diff(route['position'], axis=0), axis=1)
+    avg_speed = np.divide(distance, duration, out=np.zeros_like(distance), where=duration > 0)
+    return {
+        "start_time": start_time,
+        "end_time": end_time,
+        "duration": duration,
+        "distance": distance,
+        "avg_speed": avg_speed
+    }
+
+
+def write_route_data(filename, snapshot):
+    """Builds the route JSON from a save_route_data snapshot and writes it."""
+    route = snapshot["route"]
+    segments = compute_segments(route)
+    # Ranges disabled by the device profile are NaN in the rows and null in the file (NaN is not JSON)
+    lidar = route['lidar'].astype(object)
+    lidar[np.isnan(route['lidar'])] = None
+    points = [
+        {
+            'timestamp': timestamp,
+            'position': position,
+            'orientation': orientation,
+            'velocity': velocity,
+            'lidar_readings': dict(zip(LIDAR_NAMES, readings)),
+            'checkpoint_id': None if checkpoint_id < 0 else checkpoint_id,
+            'is_checkpoint': is_checkpoint
+        }
+        for timestamp, position, orientation, velocity, readings, checkpoint_id, is_checkpoint in zip(
+            route['timestamp'].tolist(), route['position'].tolist(), route['orientation'].tolist(),
+            route['velocity'].tolist(), lidar.tolist(), route['checkpoint_id'].tolist(),
+            route['is_checkpoint'].tolist())
+    ]
+
+    route_data = {
+        "lap_number": snapshot["lap_number"],
+        "start_time": snapshot["start_time"],
+        "checkpoint_times": snapshot["checkpoint_times"],
+        "points": points,
+        "segments": [
+            {
+                "start_time": start_time,
+                "end_time": end_time,
+                "duration": duration,
+                "distance": distance,
+                "avg_speed": avg_speed
+            }
+            for start_time, end_time, duration, distance, avg_speed in zip(
+                segments['start_time'].tolist(), segments['end_time'].tolist(),
+                segments['duration'].tolist(), segments['distance'].tolist(),
+                segments['avg_speed'].tolist())
+        ]
+    }
+
+    persistence.write_json(filename, route_data)
+    print(f"Rota verileri {os.path.basename(filename)} dosyasına kaydedildi")
+
+
 class RouteRecorder:
+    """
+    Records the lap into a growable NumPy structured array (capacity doubles
+    when full, so appends are amortized O(1)). Segments and statistics are
+    computed from the columns on demand.
+    """
+    INITIAL_CAPACITY = 1024
+
     def __init__(self):
-        self.current_route: List[RoutePoint] = []
-        self.route_segments: List[RouteSegment] = []
+        self.points = np.zeros(self.INITIAL_CAPACITY, dtype=ROUTE_DTYPE)
+        self.size: int = 0
         self.current_lap: int = 0
         self.lap_start_time: float = 0
         self.checkpoint_times: Dict[int, float] = {} 
@@ -59,8 +156,7 @@ class RouteRecorder:
         self.last_position: Tuple[float, float, float] = None
         
     def start_recording(self, lap_number: int):
-        self.current_route = []
-        self.route_segments = []
+        self.size = 0
         self.current_lap = lap_number
         self.lap_start_time = 0  
         self.checkpoint_times = {}
@@ -77,26 +173,36 @@ class RouteRecorder:
         self.save_route_data()
         
         print(f"Tur {self.current_lap} kaydı tamamlandı.")
+
+    @property
+    def route(self) -> np.ndarray:
+        """View of the recorded rows."""
+        return self.points[:self.size]
+
+    @property
+    def current_route(self) -> List[RoutePoint]:
+        return [RoutePoint.from_row(row) for row in self.route]
+
+    @property
+    def route_segments(self) -> List[RouteSegment]:
+        points = self.current_route
+        segments = self.segments()
+        return [
+            RouteSegment(points[i], points[i + 1], float(segments['duration'][i]),
+                         float(segments['distance'][i]), float(segments['avg_speed'][i]))
+            for i in range(len(points) - 1)
+        ]
         
-    def record_point(self, drone) -> RoutePoint:
+    def record_point(self, drone) -> int:
+        """Returns the row index of the recorded sample, or None if skipped."""
         if not self.is_recording:
             return None
             
-        current_time = drone.robot.getTime()
+        frame = drone.sense()
+        current_time = frame.time
         
         if self.lap_start_time == 0:
             self.lap_start_time = current_time
-            
-        position = drone.gps.getValues()
-        orientation = drone.imu.getRollPitchYaw()
-        velocity = drone.gyro.getValues()
-        
-        lidar_readings = {
-            "front": drone.front_lidar.getValue() / 1000,
-            "back": drone.back_lidar.getValue() / 1000,
-            "left": drone.left_lidar.getValue() / 1000,
-            "right": drone.right_lidar.getValue() / 1000
-        }
         
         checkpoint_id = None
         is_checkpoint = False
@@ -111,6 +217,7 @@ class RouteRecorder:
         if current_time - self.last_record_time >= self.min_record_interval:
             should_record = True
             
+        position = frame.position
         if self.last_position is not None:
             distance = self._calculate_distance(position, self.last_position)
             if distance >= self.significant_change_threshold:
@@ -121,40 +228,33 @@ class RouteRecorder:
             
         if not should_record:
             return None
-            
-        point = RoutePoint(
-            timestamp=current_time - self.lap_start_time,
-            position=tuple(position),
-            orientation=tuple(orientation),
-            velocity=tuple(velocity),
-            lidar_readings=lidar_readings,
-            checkpoint_id=checkpoint_id,
-            is_checkpoint=is_checkpoint
-        )
-        
-        self.current_route.append(point)
+
+        if self.size == len(self.points):
+            self._grow()
+        index = self.size
+        row = self.points[index]
+        row['timestamp'] = current_time - self.lap_start_time
+        row['position'] = position
+        row['orientation'] = frame.orientation
+        row['velocity'] = frame.rates
+        row['lidar'] = (frame.range_front, frame.range_back, frame.range_left, frame.range_right)
+        row['checkpoint_id'] = -1 if checkpoint_id is None else checkpoint_id
+        row['is_checkpoint'] = is_checkpoint
+        self.size += 1
+
         self.last_record_time = current_time
         self.last_position = position
         
-        if len(self.current_route) > 1:
-            prev_point = self.current_route[-2]
-            segment = self._create_segment(prev_point, point)
-            self.route_segments.append(segment)
-        
-        return point
-    
-    def _create_segment(self, start: RoutePoint, end: RoutePoint) -> RouteSegment:
-        duration = end.timestamp - start.timestamp
-        distance = self._calculate_distance(start.position, end.position)
-        avg_speed = distance / duration if duration > 0 else 0
-        
-        return RouteSegment(
-            start_point=start,
-            end_point=end,
-            duration=duration,
-            distance=distance,
-            avg_speed=avg_speed
-        )
+        return index
+
+    def _grow(self):
+        grown = np.zeros(2 * len(self.points), dtype=ROUTE_DTYPE)
+        grown[:self.size] = self.points[:self.size]
+        self.points = grown
+
+    def segments(self) -> Dict[str, np.ndarray]:
+        """Consecutive-sample segments as arrays of length size - 1."""
+        return compute_segments(self.route)
     
     def _calculate_distance(self, pos1: Tuple[float, float, float], 
                           pos2: Tuple[float, float, float]) -> float:
@@ -162,39 +262,33 @@ class RouteRecorder:
                 (pos1[1] - pos2[1])**2 + 
                 (pos1[2] - pos2[2])**2)**0.5
     
-    def save_route_data(self):
-        if not self.current_route:
+    def save_route_data(self, background=True):
+        """
+        Snapshots the lap (a copy of the rows, so recording can restart
+        immediately) and hands JSON building and the file write to the
+        persistence worker. background=False writes on the calling thread.
+        """
+        if not self.size:
             return
-            
-        route_data = {
+
+        snapshot = {
             "lap_number": self.current_lap,
             "start_time": datetime.fromtimestamp(self.lap_start_time).isoformat(),
-            "checkpoint_times": self.checkpoint_times,
-            "points": [p.to_dict() for p in self.current_route],
-            "segments": [
-                {
-                    "start_time": s.start_point.timestamp,
-                    "end_time": s.end_point.timestamp,
-                    "duration": s.duration,
-                    "distance": s.distance,
-                    "avg_speed": s.avg_speed
-                }
-                for s in self.route_segments
-            ]
+            "checkpoint_times": dict(self.checkpoint_times),
+            "route": self.route.copy()
         }
-        
         filename = f"route_data_lap_{self.current_lap}.json"
-        with open(filename, 'w') as f:
-            json.dump(route_data, f, indent=2)
-            
-        print(f"Rota verileri {filename} dosyasına kaydedildi")
+        if background:
+            persistence.get_worker().submit(filename, snapshot, write_route_data)
+        else:
+            write_route_data(filename, snapshot)
     
     def get_lap_statistics(self) -> Dict:
-        if not self.current_route:
+        if not self.size:
             return {}
             
-        total_distance = sum(s.distance for s in self.route_segments)
-        total_duration = self.current_route[-1].timestamp
+        total_distance = float(self.segments()['distance'].sum())
+        total_duration = float(self.points['timestamp'][self.size - 1])
         avg_speed = total_distance / total_duration if total_duration > 0 else 0
         
         return {
@@ -203,6 +297,6 @@ class RouteRecorder:
             "total_duration": total_duration,
             "average_speed": avg_speed,
             "checkpoint_times": self.checkpoint_times,
-            "number_of_points": len(self.current_route),
-            "number_of_segments": len(self.route_segments)
-        } 
\ No newline at end of file
+            "number_of_points": self.size,
+            "number_of_segments": max(self.size - 1, 0)
+        }
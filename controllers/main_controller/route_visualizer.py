@@ -5,6 +5,9 @@ import numpy as np
 from typing import Dict, List
 import glob
 import os
+from checkpoint_manager import CheckpointManager
+from checkpoint_storage import journal_path
+from passage_stats import circular_mean, circular_spread, mean
 
 def load_route_data(lap_number: int = None) -> Dict:
     if lap_number is not None:
@@ -34,11 +37,12 @@ def load_route_data(lap_number: int = None) -> Dict:
 
 def load_checkpoint_data() -> Dict:
     try:
-        with open("checkpoints.json", 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("checkpoints.json dosyası bulunamadı!")
-        return None
+        if not os.path.exists("checkpoints.json") and not os.path.exists(journal_path("checkpoints.json")):
+            print("checkpoints.json dosyası bulunamadı!")
+            return None
+        # Snapshot with the journal replayed on top
+        manager = CheckpointManager(background=False, read_only=True)
+        return {'checkpoints': manager.checkpoints, 'metadata': manager.metadata}
     except Exception as e:
         print(f"Checkpoint verileri okunurken hata: {e}")
         return None
@@ -100,8 +104,9 @@ def visualize_single_lap(data: Dict):
     ax3.legend()
     
     ax4 = fig.add_subplot(224)
-    left = [p['lidar_readings']['left'] for p in points]
-    right = [p['lidar_readings']['right'] for p in points]
+    # null while the range was disabled
+    left = np.array([p['lidar_readings']['left'] for p in points], dtype=float)
+    right = np.array([p['lidar_readings']['right'] for p in points], dtype=float)
     ax4.plot(times, left, 'b-', label='Left')
     ax4.plot(times, right, 'y-', label='Right')
     ax4.set_xlabel('Time (s)')
@@ -388,6 +393,18 @@ def visualize_checkpoints():
     
     ax4 = fig.add_subplot(224)
     
+    # Averaged on the circle, so headings either side of +-180 degrees don't cancel out
+    headings = {}
+    for cp_id, cp in checkpoints.items():
+        heading = circular_mean(cp['passage_stats'], 'yaw')
+        if heading is not None:
+            headings[int(cp_id)] = (heading, circular_spread(cp['passage_stats'], 'yaw'))
+    
+    if headings:
+        print(f"\nMean Passage Heading (Yaw):")
+        for cp_id, (heading, spread) in sorted(headings.items()):
+            print(f"CP{cp_id}: {np.degrees(heading):7.1f}° ± {np.degrees(spread):.1f}°")
+    
     approach_sides = {'left': 0, 'right': 0}
     side_checkpoints = {'left': [], 'right': []}
     
@@ -462,14 +479,10 @@ def visualize_checkpoint_performance():
     checkpoints = checkpoint_data['checkpoints']
     
     for cp_id, cp_data in checkpoints.items():
-        if cp_data['passage_history']:
-            velocities = []
-            for passage in cp_data['passage_history']:
-                velocity = passage['velocity']
-                # Calculate speed magnitude
-                speed = np.sqrt(velocity['vx']**2 + velocity['vy']**2 + velocity['vz']**2)
-                velocities.append(speed)
-            checkpoint_velocities[int(cp_id)] = np.mean(velocities)
+        # Running means over every recorded passage
+        speed = mean(cp_data['passage_stats'], 'speed')
+        if speed is not None:
+            checkpoint_velocities[int(cp_id)] = speed
     
     if checkpoint_velocities:
         cp_ids = list(checkpoint_velocities.keys())
@@ -489,13 +502,9 @@ def visualize_checkpoint_performance():
     
     checkpoint_stability = {}
     for cp_id, cp_data in checkpoints.items():
-        if cp_data['passage_history']:
-            stabilities = []
-            for passage in cp_data['passage_history']:
-                orientation = passage['orientation']
-                stability = abs(orientation['roll']) + abs(orientation['pitch'])
-                stabilities.append(stability)
-            checkpoint_stability[int(cp_id)] = np.mean(stabilities)
+        instability = mean(cp_data['passage_stats'], 'instability')
+        if instability is not None:
+            checkpoint_stability[int(cp_id)] = instability
     
     if checkpoint_stability:
         cp_ids = list(checkpoint_stability.keys())
@@ -515,15 +524,9 @@ def visualize_checkpoint_performance():
     
     checkpoint_balance = {}
     for cp_id, cp_data in checkpoints.items():
-        if cp_data['passage_history']:
-            balances = []
-            for passage in cp_data['passage_history']:
-                lidar = passage['lidar_readings']
-                left = lidar['left']
-                right = lidar['right']
-                balance = (right - left) / max(right + left, 0.1)
-                balances.append(balance)
-            checkpoint_balance[int(cp_id)] = np.mean(balances)
+        balance = mean(cp_data['passage_stats'], 'lidar_balance')
+        if balance is not None:
+            checkpoint_balance[int(cp_id)] = balance
     
     if checkpoint_balance:
         cp_ids = list(checkpoint_balance.keys())
@@ -643,6 +646,7 @@ def show_checkpoint_statistics():
     print(f"Total Checkpoints: {total_checkpoints}")
     print(f"Total Connections: {total_connections}")
     print(f"Average Connections per Checkpoint: {avg_connections:.2f}")
+    print(f"Total Recorded Passages: {sum(cp['passage_stats']['count'] for cp in checkpoints.values())}")
     
     x_coords = [cp['position']['x'] for cp in checkpoints.values()]
     y_coords = [cp['position']['y'] for cp in checkpoints.values()]
@@ -672,6 +676,18 @@ def show_checkpoint_statistics():
     print(f"\nMost Connected Checkpoint: CP{most_connected} ({connection_counts[most_connected]} connections)")
     print(f"Least Connected Checkpoint: CP{least_connected} ({connection_counts[least_connected]} connections)")
     
+    # Averaged on the circle, so headings either side of +-180 degrees don't cancel out
+    headings = {}
+    for cp_id, cp in checkpoints.items():
+        heading = circular_mean(cp['passage_stats'], 'yaw')
+        if heading is not None:
+            headings[int(cp_id)] = (heading, circular_spread(cp['passage_stats'], 'yaw'))
+    
+    if headings:
+        print(f"\nMean Passage Heading (Yaw):")
+        for cp_id, (heading, spread) in sorted(headings.items()):
+            print(f"CP{cp_id}: {np.degrees(heading):7.1f}° ± {np.degrees(spread):.1f}°")
+    
     approach_sides = {'left': 0, 'right': 0}
     for cp in checkpoints.values():
         if cp['passage_history']:
@@ -0,0 +1,47 @@
+class SensorFrame:
+    """
+    One consistent sample of every flight sensor, taken once per
+    robot.step. Ranges are in meters (device value / 1000), NaN when the
+    device profile keeps that range sensor disabled.
+    """
+    __slots__ = ('time', 'x', 'y', 'z', 'roll', 'pitch', 'yaw',
+                 'roll_rate', 'pitch_rate', 'yaw_rate',
+                 'range_front', 'range_back', 'range_left', 'range_right')
+
+    def __init__(self):
+        self.time = None
+        self.x = self.y = self.z = 0.0
+        self.roll = self.pitch = self.yaw = 0.0
+        self.roll_rate = self.pitch_rate = self.yaw_rate = 0.0
+        self.range_front = self.range_back = self.range_left = self.range_right = 0.0
+
+    def capture(self, drone, time):
+        self.time = time
+        self.x, self.y, self.z = drone.gps.getValues()
+        self.roll, self.pitch, self.yaw = drone.imu.getRollPitchYaw()
+        self.roll_rate, self.pitch_rate, self.yaw_rate = drone.gyro.getValues()
+        self.range_front = drone.range_reading("range_front")
+        self.range_back = drone.range_reading("range_back")
+        self.range_left = drone.range_reading("range_left")
+        self.range_right = drone.range_reading("range_right")
+
+    @property
+    def position(self):
+        return (self.x, self.y, self.z)
+
+    @property
+    def orientation(self):
+        return (self.roll, self.pitch, self.yaw)
+
+    @property
+    def rates(self):
+        return (self.roll_rate, self.pitch_rate, self.yaw_rate)
+
+    @property
+    def lidar_readings(self):
+        return {
+            "front": self.range_front,
+            "back": self.range_back,
+            "left": self.range_left,
+            "right": self.range_right
+        }
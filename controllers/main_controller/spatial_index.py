@@ -0,0 +1,128 @@
+from math import floor, sqrt
+import numpy as np
+
+
+class GridIndex:
+    """
+    Uniform grid over 3D points keyed by id. With the cell size equal to
+    the usual query radius, a radius query only visits the 27 cells around
+    the query point, and a nearest-neighbour query grows cube shells
+    around it until nothing closer can remain.
+    """
+    def __init__(self, cell_size=3.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell(self, position):
+        size = self.cell_size
+        return (floor(position[0] / size), floor(position[1] / size), floor(position[2] / size))
+
+    def insert(self, key, position):
+        if key in self.positions:
+            self.remove(key)
+        position = (position[0], position[1], position[2])
+        self.positions[key] = position
+        self.cells.setdefault(self._cell(position), []).append(key)
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        cell = self._cell(position)
+        bucket = self.cells[cell]
+        bucket.remove(key)
+        if not bucket:
+            del self.cells[cell]
+
+    def rebuild(self, items):
+        """Replaces the whole index from (key, position) pairs."""
+        self.cells = {}
+        self.positions = {}
+        for key, position in items:
+            self.insert(key, position)
+
+    def _distance(self, position, key):
+        other = self.positions[key]
+        return sqrt((position[0] - other[0])**2 + (position[1] - other[1])**2 + (position[2] - other[2])**2)
+
+    def within(self, position, radius):
+        """(key, distance) for every point within radius, unordered."""
+        reach = max(1, int(radius // self.cell_size) + 1)
+        cx, cy, cz = self._cell(position)
+        cells = self.cells
+        found = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for dz in range(-reach, reach + 1):
+                    bucket = cells.get((cx + dx, cy + dy, cz + dz))
+                    if not bucket:
+                        continue
+                    for key in bucket:
+                        distance = self._distance(position, key)
+                        if distance <= radius:
+                            found.append((key, distance))
+        return found
+
+    def nearest(self, position, k=1):
+        """Up to k (key, distance) pairs, closest first."""
+        if not self.positions:
+            return []
+        k = min(k, len(self.positions))
+        cx, cy, cz = self._cell(position)
+        found = []
+        ring = 0
+        while True:
+            # Past the occupied volume a plain scan is cheaper than more shells
+            if (2 * ring + 1) ** 3 > 8 * len(self.cells):
+                found = [(key, self._distance(position, key)) for key in self.positions]
+                found.sort(key=lambda item: item[1])
+                return found[:k]
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    for dz in range(-ring, ring + 1):
+                        if max(abs(dx), abs(dy), abs(dz)) != ring:
+                            continue
+                        for key in self.cells.get((cx + dx, cy + dy, cz + dz), ()):
+                            found.append((key, self._distance(position, key)))
+            if len(found) >= k:
+                found.sort(key=lambda item: item[1])
+                # Anything in a further shell is at least ring cells away
+                if found[k - 1][1] <= ring * self.cell_size:
+                    return found[:k]
+            ring += 1
+
+
+def radius_pairs(queries, points, radius, chunk=256):
+    """
+    Every (i, j, distance) with |queries[i] - points[j]| <= radius, for
+    (n, 3) arrays. Points are sorted on x so each chunk of queries is only
+    compared with the slab of points within radius of it along x.
+    """
+    queries = np.asarray(queries, dtype=float).reshape(-1, 3)
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    order = np.argsort(points[:, 0], kind='stable')
+    xs = points[order, 0]
+    query_order = np.argsort(queries[:, 0], kind='stable')
+    found_i, found_j, found_distance = [], [], []
+    for start in range(0, len(queries), chunk):
+        rows = query_order[start:start + chunk]
+        low = np.searchsorted(xs, queries[rows, 0].min() - radius, 'left')
+        high = np.searchsorted(xs, queries[rows, 0].max() + radius, 'right')
+        candidates = order[low:high]
+        delta = queries[rows, None, :] - points[None, candidates, :]
+        # Cheap prefilter with a little slack, then the exact distance
+        i, j = np.nonzero(np.einsum('ijk,ijk->ij', delta, delta) <= radius * radius * (1 + 1e-9))
+        # float_power matches Python's x**2 bit for bit (x * x can differ in the last ulp)
+        square = np.float_power(delta[i, j], 2)
+        distance = np.sqrt(square[:, 0] + square[:, 1] + square[:, 2])
+        keep = distance <= radius
+        found_i.append(rows[i[keep]])
+        found_j.append(candidates[j[keep]])
+        found_distance.append(distance[keep])
+    if not found_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distance)
@@ -0,0 +1,73 @@
+class TaskRunner:
+    """
+    Cooperative scheduler for generator tasks. A task runs until its next
+    `yield`, which means "wait for the next simulation step"; its return
+    value ends up in `results`. The main loop calls tick() once per
+    robot.step, so several tasks share the same timestep without nested
+    blocking loops.
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.results = {}
+
+    def spawn(self, task, name=None):
+        """
+        Starts a task and runs it up to its first yield, like the code
+        before the first robot.step() of a blocking loop.
+        A running task with the same name is cancelled first.
+        """
+        if name is None:
+            name = f"task_{id(task)}"
+        self.cancel(name)
+        self.results.pop(name, None)
+        try:
+            next(task)
+        except StopIteration as done:
+            self.results[name] = done.value
+            return name
+        self.tasks[name] = task
+        return name
+
+    def is_running(self, name):
+        return name in self.tasks
+
+    def cancel(self, name):
+        task = self.tasks.pop(name, None)
+        if task is None:
+            return False
+        task.close()
+        return True
+
+    def cancel_all(self):
+        for name in list(self.tasks):
+            self.cancel(name)
+
+    def tick(self):
+        """Advances every task by one step."""
+        for name, task in list(self.tasks.items()):
+            if self.tasks.get(name) is not task:
+                continue
+            try:
+                next(task)
+            except StopIteration as done:
+                if self.tasks.get(name) is task:
+                    del self.tasks[name]
+                self.results[name] = done.value
+
+
+def run_blocking(robot, timestep, task):
+    """
+    Runs a single task with its own step loop (the pre-scheduler behavior).
+    Returns the task result, or False if the simulation ends first.
+    """
+    try:
+        next(task)
+    except StopIteration as done:
+        return done.value
+    while robot.step(timestep) != -1:
+        try:
+            next(task)
+        except StopIteration as done:
+            return done.value
+    task.close()
+    return False
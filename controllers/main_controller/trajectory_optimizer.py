@@ -0,0 +1,204 @@
+"""
+Offline minimum-time trajectory through an ordered gate sequence.
+
+The racing line is relaxed inside every gate opening (each gate point may
+move up to the gate tolerance within the plane across the flight
+direction), smoothed with a centripetal Catmull-Rom spline and then
+time-parameterized with the usual forward/backward pass: speed is capped
+by the velocity limit, by the lateral acceleration limit in the curves
+and by the longitudinal acceleration limit between them. The result is
+cached on disk, keyed by a hash of the gates, the start point and the
+limits, so a course is optimized once and every later lap loads it.
+"""
+import hashlib
+import os
+import numpy as np
+import persistence
+
+# SolidPipe rings in Parkour.wbt: radius 0.5, thickness 0.05
+GATE_RADIUS = 0.5
+GATE_THICKNESS = 0.05
+# Crazyflie half span, tracking error and checkpoint-vs-ring offset
+DRONE_CLEARANCE = 0.3
+GATE_TOLERANCE = GATE_RADIUS - GATE_THICKNESS - DRONE_CLEARANCE
+
+CACHE_DIR = "trajectories"
+# Laps starting within this of the same point share a cached trajectory
+START_RESOLUTION = 0.5
+# Bumped whenever the optimizer output changes for the same inputs
+FORMAT_VERSION = 1
+
+
+class Trajectory:
+    """Position / velocity samples at a fixed time step, and the time each gate is passed."""
+    def __init__(self, times, positions, velocities, gate_times):
+        self.times = times
+        self.positions = positions
+        self.velocities = velocities
+        self.gate_times = gate_times
+        self.duration = float(times[-1])
+
+    def __len__(self):
+        return len(self.times)
+
+    def sample(self, t):
+        """(position, velocity) at time t, linearly interpolated and held at the ends."""
+        times = self.times
+        if t <= 0.0:
+            return tuple(self.positions[0].tolist()), tuple(self.velocities[0].tolist())
+        if t >= self.duration:
+            return tuple(self.positions[-1].tolist()), (0.0, 0.0, 0.0)
+        # Uniform steps except the last, which ends at the duration
+        i = min(int(t / (times[1] - times[0])), len(times) - 2)
+        w = (t - times[i]) / (times[i + 1] - times[i])
+        position = self.positions[i] + w * (self.positions[i + 1] - self.positions[i])
+        velocity = self.velocities[i] + w * (self.velocities[i + 1] - self.velocities[i])
+        return tuple(position.tolist()), tuple(velocity.tolist())
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, times=self.times, positions=self.positions, velocities=self.velocities,
+                     gate_times=self.gate_times)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['times'], data['positions'], data['velocities'], data['gate_times'])
+
+
+def _write_trajectory(path, trajectory):
+    # Same write-then-rename as persistence.write_json
+    tmp_path = path + ".tmp"
+    trajectory.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def relax_racing_line(waypoints, tolerance=GATE_TOLERANCE, iterations=200):
+    """
+    Moves every interior waypoint towards the midpoint of its neighbours,
+    keeping it within `tolerance` of the original gate centre across the
+    local flight direction. Start and end stay fixed.
+    """
+    centres = np.asarray(waypoints, dtype=float)
+    points = centres.copy()
+    if len(points) < 3:
+        return points
+    tangent = centres[2:] - centres[:-2]
+    tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-9)
+    for _ in range(iterations):
+        shift = 0.5 * (points[:-2] + points[2:]) - centres[1:-1]
+        shift -= np.sum(shift * tangent, axis=1, keepdims=True) * tangent
+        norm = np.linalg.norm(shift, axis=1, keepdims=True)
+        shift *= np.minimum(1.0, tolerance / np.maximum(norm, 1e-12))
+        points[1:-1] = centres[1:-1] + shift
+    return points
+
+
+def catmull_rom(points, spacing=0.05):
+    """
+    Dense samples of the centripetal Catmull-Rom spline through `points`,
+    and the sample index of every input point.
+    """
+    points = np.asarray(points, dtype=float)
+    padded = np.vstack([2 * points[0] - points[1], points, 2 * points[-1] - points[-2]])
+    knots = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(padded, axis=0), axis=1) ** 0.5)])
+    samples = [points[:1]]
+    point_index = [0]
+    for i in range(1, len(padded) - 2):
+        p0, p1, p2, p3 = padded[i - 1:i + 3]
+        t0, t1, t2, t3 = knots[i - 1:i + 3]
+        count = max(2, int(np.ceil(np.linalg.norm(p2 - p1) / spacing)))
+        t = np.linspace(t1, t2, count + 1)[1:, None]
+        a1 = ((t1 - t) * p0 + (t - t0) * p1) / max(t1 - t0, 1e-12)
+        a2 = ((t2 - t) * p1 + (t - t1) * p2) / max(t2 - t1, 1e-12)
+        a3 = ((t3 - t) * p2 + (t - t2) * p3) / max(t3 - t2, 1e-12)
+        b1 = ((t2 - t) * a1 + (t - t0) * a2) / max(t2 - t0, 1e-12)
+        b2 = ((t3 - t) * a2 + (t - t1) * a3) / max(t3 - t1, 1e-12)
+        samples.append(((t2 - t) * b1 + (t - t1) * b2) / max(t2 - t1, 1e-12))
+        point_index.append(point_index[-1] + count)
+    return np.vstack(samples), np.array(point_index)
+
+
+def _curvature(path):
+    # Menger curvature of every sample triple, zero at the ends
+    a, b, c = path[:-2], path[1:-1], path[2:]
+    ab = np.linalg.norm(b - a, axis=1)
+    bc = np.linalg.norm(c - b, axis=1)
+    ca = np.linalg.norm(a - c, axis=1)
+    area2 = np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    curvature = np.zeros(len(path))
+    curvature[1:-1] = 2 * area2 / np.maximum(ab * bc * ca, 1e-12)
+    return curvature
+
+
+def speed_profile(path, max_velocity, max_acceleration, max_lateral_acceleration=None):
+    """
+    Fastest speed at every sample that starts and ends at rest. The
+    longitudinal and lateral limits are applied separately, per axis.
+    """
+    if max_lateral_acceleration is None:
+        max_lateral_acceleration = max_acceleration
+    step = np.linalg.norm(np.diff(path, axis=0), axis=1)
+    limit = np.minimum(max_velocity, np.sqrt(max_lateral_acceleration / np.maximum(_curvature(path), 1e-9)))
+    limit[0] = limit[-1] = 0.0
+    speed = limit.tolist()
+    budget = (2 * max_acceleration * step).tolist()
+    for i in range(1, len(speed)):
+        speed[i] = min(speed[i], (speed[i - 1] ** 2 + budget[i - 1]) ** 0.5)
+    for i in range(len(speed) - 2, -1, -1):
+        speed[i] = min(speed[i], (speed[i + 1] ** 2 + budget[i]) ** 0.5)
+    return np.array(speed)
+
+
+def optimize_trajectory(waypoints, max_velocity=2.0, max_acceleration=1.0, tolerance=GATE_TOLERANCE,
+                        sample_time=0.02):
+    """
+    Minimum-time trajectory from waypoints[0] (at rest) through the gates
+    waypoints[1:] in order, stopping at the last one.
+    """
+    line = relax_racing_line(waypoints, tolerance)
+    path, point_index = catmull_rom(line)
+    speed = speed_profile(path, max_velocity, max_acceleration)
+
+    step = np.linalg.norm(np.diff(path, axis=0), axis=1)
+    # Mean speed over each step; the first step from rest uses its end speed
+    mean_speed = np.maximum(0.5 * (speed[:-1] + speed[1:]), 1e-6)
+    arrival = np.concatenate([[0.0], np.cumsum(step / mean_speed)])
+    tangent = np.gradient(path, axis=0)
+    tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-12)
+    velocity = tangent * speed[:, None]
+
+    times = np.arange(0.0, arrival[-1] + sample_time, sample_time)
+    times[-1] = arrival[-1]
+    positions = np.column_stack([np.interp(times, arrival, path[:, k]) for k in range(3)])
+    velocities = np.column_stack([np.interp(times, arrival, velocity[:, k]) for k in range(3)])
+    return Trajectory(times, positions, velocities, arrival[point_index[1:]])
+
+
+def trajectory_key(waypoints, **params):
+    digest = hashlib.blake2b(repr((FORMAT_VERSION, sorted(params.items()))).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(waypoints, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def snap_start(position, resolution=START_RESOLUTION):
+    return tuple(float(np.round(value / resolution) * resolution) for value in position)
+
+
+def load_or_optimize(start, gates, cache_dir=CACHE_DIR, **params):
+    """
+    Trajectory from `start` through `gates`, from the disk cache when this
+    course was optimized before. The start is snapped to START_RESOLUTION
+    so laps beginning near the same point reuse one file.
+    """
+    waypoints = np.vstack([snap_start(start), np.asarray(gates, dtype=float).reshape(-1, 3)])
+    path = os.path.join(cache_dir, f"trajectory_{trajectory_key(waypoints, **params)}.npz")
+    if os.path.exists(path):
+        try:
+            return Trajectory.load(path)
+        except Exception as e:
+            print(f"Trajectory cache okunamadı, yeniden hesaplanıyor: {e}")
+    trajectory = optimize_trajectory(waypoints, **params)
+    os.makedirs(cache_dir, exist_ok=True)
+    persistence.get_worker().submit(path, trajectory, writer=_write_trajectory)
+    return trajectory
@@ -0,0 +1,94 @@
+from math import sqrt, acos
+
+
+class PurePursuit:
+    """
+    Pure-pursuit tracker over a 3D polyline. update() projects the drone on
+    the path (searching only a few segments ahead of the last projection,
+    so progress is monotonic and the cost per step is constant) and
+    target() returns the carrot point `lookahead` meters further along it.
+    """
+    SEARCH_SEGMENTS = 3
+
+    def __init__(self, points, lookahead=0.6):
+        self.points = []
+        # Index in `points` of every kept vertex (repeated points are dropped)
+        self.source_index = []
+        for index, point in enumerate(points):
+            point = (float(point[0]), float(point[1]), float(point[2]))
+            if not self.points or point != self.points[-1]:
+                self.points.append(point)
+                self.source_index.append(index)
+        self.lookahead = lookahead
+
+        # Arc length at every vertex
+        self.arc = [0.0]
+        for a, b in zip(self.points, self.points[1:]):
+            self.arc.append(self.arc[-1] + sqrt((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2 + (b[2] - a[2]) ** 2))
+        self.length = self.arc[-1]
+
+        self.segment = 0
+        self.progress = 0.0
+
+    def update(self, x, y, z):
+        """Projects (x, y, z) on the path and returns the arc-length progress."""
+        points = self.points
+        if len(points) < 2:
+            return self.progress
+        best_distance = float('inf')
+        best_segment = self.segment
+        best_progress = self.progress
+        last_segment = min(self.segment + self.SEARCH_SEGMENTS, len(points) - 2)
+        for i in range(self.segment, last_segment + 1):
+            ax, ay, az = points[i]
+            bx, by, bz = points[i + 1]
+            dx, dy, dz = bx - ax, by - ay, bz - az
+            seg_len2 = dx * dx + dy * dy + dz * dz
+            t = ((x - ax) * dx + (y - ay) * dy + (z - az) * dz) / seg_len2 if seg_len2 > 0 else 0.0
+            t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+            px, py, pz = ax + t * dx - x, ay + t * dy - y, az + t * dz - z
+            distance = px * px + py * py + pz * pz
+            if distance < best_distance:
+                best_distance = distance
+                best_segment = i
+                best_progress = self.arc[i] + t * (self.arc[i + 1] - self.arc[i])
+        if best_progress >= self.progress:
+            self.segment = best_segment
+            self.progress = best_progress
+        return self.progress
+
+    def point_at(self, s):
+        points = self.points
+        if s >= self.length or len(points) < 2:
+            return points[-1]
+        i = self.segment
+        while i < len(points) - 2 and self.arc[i + 1] < s:
+            i += 1
+        seg_len = self.arc[i + 1] - self.arc[i]
+        t = (s - self.arc[i]) / seg_len if seg_len > 0 else 0.0
+        a, b = points[i], points[i + 1]
+        return (a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]), a[2] + t * (b[2] - a[2]))
+
+    def target(self):
+        return self.point_at(self.progress + self.lookahead)
+
+    def last_passed_index(self):
+        """Index in the input points of the last vertex behind the drone."""
+        return self.source_index[self.segment]
+
+    def turn_ahead(self, distance):
+        """Largest heading change (rad) at a vertex within `distance` meters."""
+        points = self.points
+        largest = 0.0
+        i = self.segment + 1
+        while i < len(points) - 1 and self.arc[i] - self.progress <= distance:
+            a, b, c = points[i - 1], points[i], points[i + 1]
+            ux, uy = b[0] - a[0], b[1] - a[1]
+            vx, vy = c[0] - b[0], c[1] - b[1]
+            norm = sqrt((ux * ux + uy * uy) * (vx * vx + vy * vy))
+            if norm > 0:
+                cos_angle = (ux * vx + uy * vy) / norm
+                angle = acos(1.0 if cos_angle > 1.0 else (-1.0 if cos_angle < -1.0 else cos_angle))
+                largest = max(largest, angle)
+            i += 1
+        return largest
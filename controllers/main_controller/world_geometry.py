@@ -0,0 +1,305 @@
+"""
+Gate geometry read from the Webots world file.
+
+The SolidPipe rings of Parkour.wbt are parsed once into a GateTable
+(centres, axis normals, inner / outer radii and depth as arrays) and
+cached as .npz under CACHE_DIR, keyed by a hash of the world file, so
+later runs load the arrays instead of parsing VRML. The table also
+answers the geometric queries the controller and the headless simulator
+need: nearest gate, segment crossings and range-sensor raycasts.
+"""
+import hashlib
+import os
+import re
+import numpy as np
+import persistence
+
+DEFAULT_WORLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "worlds", "Parkour.wbt")
+CACHE_DIR = "world_cache"
+# Bumped whenever the parsed table changes for the same world file
+FORMAT_VERSION = 1
+
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]|[^\s{}\[\]"]+')
+
+
+def _tokens(text):
+    # Drops comments ('#' to end of line, outside strings); commas are whitespace in VRML
+    for line in text.splitlines():
+        for token in _TOKEN.findall(line):
+            if token.startswith('#'):
+                break
+            if token != ',':
+                yield token
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return token in ('TRUE', 'FALSE')
+    return True
+
+
+def _value(token):
+    if token.startswith('"'):
+        return token[1:-1]
+    if token in ('TRUE', 'FALSE'):
+        return token == 'TRUE'
+    return float(token)
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = list(_tokens(text))
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def nodes(self, end=None):
+        nodes = []
+        while self.peek() is not None and self.peek() != end:
+            token = self.take()
+            if token == 'EXTERNPROTO':
+                self.take()
+            elif token == 'DEF':
+                name = self.take()
+                node = self.node(self.take())
+                node['DEF'] = name
+                nodes.append(node)
+            elif token == 'USE':
+                nodes.append({'type': 'USE', 'name': self.take()})
+            else:
+                nodes.append(self.node(token))
+        return nodes
+
+    def node(self, node_type):
+        node = {'type': node_type}
+        if self.peek() != '{':
+            return node
+        self.take()
+        while self.peek() not in ('}', None):
+            field = self.take()
+            node[field] = self.field_value()
+        self.take()
+        return node
+
+    def field_value(self):
+        token = self.peek()
+        if token == '[':
+            self.take()
+            if self.peek() not in (']', None) and not _is_number(self.peek()) and not self.peek().startswith('"'):
+                values = self.nodes(']')
+            else:
+                values = []
+                while self.peek() not in (']', None):
+                    values.append(_value(self.take()))
+            self.take()
+            return values
+        if token.startswith('"') or _is_number(token):
+            values = [_value(self.take())]
+            while self.peek() is not None and _is_number(self.peek()):
+                values.append(_value(self.take()))
+            return values[0] if len(values) == 1 else values
+        if token in ('DEF', 'USE'):
+            return self.nodes_one()
+        return self.node(self.take())
+
+    def nodes_one(self):
+        keyword = self.take()
+        if keyword == 'USE':
+            return {'type': 'USE', 'name': self.take()}
+        name = self.take()
+        node = self.node(self.take())
+        node['DEF'] = name
+        return node
+
+
+def parse_world(text):
+    """Top-level nodes of a .wbt file as dicts: {'type': ..., field: value, ...}."""
+    return _Parser(text).nodes()
+
+
+def axis_angle_matrix(rotation):
+    """Rotation matrix of a VRML rotation (x, y, z, angle)."""
+    x, y, z, angle = rotation
+    axis = np.array([x, y, z], dtype=float)
+    norm = np.linalg.norm(axis)
+    if norm == 0.0:
+        return np.eye(3)
+    x, y, z = axis / norm
+    c, s = np.cos(angle), np.sin(angle)
+    t = 1.0 - c
+    return np.array([
+        [t * x * x + c, t * x * y - s * z, t * x * z + s * y],
+        [t * x * y + s * z, t * y * y + c, t * y * z - s * x],
+        [t * x * z - s * y, t * y * z + s * x, t * z * z + c],
+    ])
+
+
+class GateTable:
+    """
+    One row per gate ring: centre, unit normal (the pipe axis, oriented
+    along the course), inner / outer radius and depth along the normal.
+    """
+    def __init__(self, names, centres, normals, inner_radii, outer_radii, depths):
+        self.names = list(names)
+        self.centres = centres
+        self.normals = normals
+        self.inner_radii = inner_radii
+        self.outer_radii = outer_radii
+        self.depths = depths
+
+    @classmethod
+    def from_world(cls, nodes):
+        pipes = [node for node in nodes if node['type'] == 'SolidPipe']
+        n = len(pipes)
+        centres = np.zeros((n, 3))
+        normals = np.zeros((n, 3))
+        outer_radii = np.zeros(n)
+        inner_radii = np.zeros(n)
+        depths = np.zeros(n)
+        for row, pipe in enumerate(pipes):
+            # Fields left out of the world file take the SolidPipe defaults
+            centres[row] = pipe.get('translation', (0.0, 0.0, 0.0))
+            # The pipe runs along its local z axis
+            normals[row] = axis_angle_matrix(pipe.get('rotation', (0.0, 0.0, 1.0, 0.0)))[:, 2]
+            outer_radii[row] = pipe.get('radius', 1.0)
+            inner_radii[row] = outer_radii[row] - pipe.get('thickness', 0.5)
+            depths[row] = pipe.get('height', 2.0)
+        table = cls([pipe.get('name', 'solid pipe') for pipe in pipes], centres, normals, inner_radii,
+                    outer_radii, depths)
+        table.orient_normals()
+        return table
+
+    def __len__(self):
+        return len(self.centres)
+
+    def orient_normals(self):
+        """Flips each normal to point from the previous gate towards the next (file order is course order)."""
+        if len(self) < 2:
+            return
+        ahead = np.roll(self.centres, -1, axis=0) - np.roll(self.centres, 1, axis=0)
+        flip = np.einsum('ij,ij->i', ahead, self.normals) < 0
+        self.normals[flip] *= -1
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, names=np.array(self.names), centres=self.centres, normals=self.normals,
+                     inner_radii=self.inner_radii, outer_radii=self.outer_radii, depths=self.depths)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['names'].tolist(), data['centres'], data['normals'], data['inner_radii'],
+                       data['outer_radii'], data['depths'])
+
+    def nearest(self, point):
+        """(row, distance) of the gate centre closest to point."""
+        distances = np.linalg.norm(self.centres - np.asarray(point, dtype=float), axis=1)
+        row = int(np.argmin(distances))
+        return row, float(distances[row])
+
+    def crossings(self, start, end):
+        """
+        Rows of the gates whose opening the segment start -> end passes
+        through (crossing the gate plane within the inner radius), in the
+        order they are crossed.
+        """
+        start = np.asarray(start, dtype=float)
+        direction = np.asarray(end, dtype=float) - start
+        side = np.einsum('ij,ij->i', self.centres - start, self.normals)
+        speed = self.normals @ direction
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = side / speed
+        hit = (speed != 0) & (t >= 0) & (t <= 1)
+        offset = start + t[:, None] * direction - self.centres
+        hit &= np.linalg.norm(np.where(hit[:, None], offset, 0.0), axis=1) <= self.inner_radii
+        rows = np.nonzero(hit)[0]
+        return rows[np.argsort(t[rows])].tolist()
+
+    def raycast(self, origin, direction, max_range):
+        """
+        Distance along a unit ray to the first ring wall or the floor
+        (z = 0), max_range when nothing is hit. Rings are hollow
+        cylinders: inner and outer walls plus the two annular faces.
+        """
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        best = max_range
+        if direction[2] < 0.0:
+            best = min(best, -origin[2] / direction[2])
+
+        relative = origin - self.centres
+        # Only rings whose bounding sphere the ray reaches within max_range
+        along = -(relative @ direction)
+        bound = np.hypot(self.outer_radii, 0.5 * self.depths)
+        closest = np.einsum('ij,ij->i', relative, relative) - along * along
+        rows = np.nonzero((closest <= bound * bound) & (along >= -bound) & (along <= max_range + bound))[0]
+        if not len(rows):
+            return best
+        relative = relative[rows]
+        normals = self.normals[rows]
+        inner_radii, outer_radii = self.inner_radii[rows], self.outer_radii[rows]
+        half_depth = 0.5 * self.depths[rows]
+
+        # Components along the pipe axis
+        axial_origin = np.einsum('ij,ij->i', relative, normals)
+        axial_direction = normals @ direction
+        radial_origin = relative - axial_origin[:, None] * normals
+        radial_direction = direction - axial_direction[:, None] * normals
+
+        a = np.einsum('ij,ij->i', radial_direction, radial_direction)
+        b = 2.0 * np.einsum('ij,ij->i', radial_origin, radial_direction)
+        c0 = np.einsum('ij,ij->i', radial_origin, radial_origin)
+        candidates = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for radius in (inner_radii, outer_radii):
+                root = np.sqrt(b * b - 4.0 * a * (c0 - radius * radius))
+                for sign in (-1.0, 1.0):
+                    t = (-b + sign * root) / (2.0 * a)
+                    axial = axial_origin + t * axial_direction
+                    candidates.append(np.where(np.abs(axial) <= half_depth, t, np.nan))
+            for face in (-half_depth, half_depth):
+                t = (face - axial_origin) / axial_direction
+                radial = np.sqrt(np.maximum(c0 + b * t + a * t * t, 0.0))
+                candidates.append(np.where((radial >= inner_radii) & (radial <= outer_radii), t, np.nan))
+        hits = np.stack(candidates)
+        hits = hits[np.isfinite(hits) & (hits > 1e-9)]
+        if hits.size:
+            best = min(best, float(hits.min()))
+        return best
+
+
+def world_hash(world_path):
+    digest = hashlib.blake2b(str(FORMAT_VERSION).encode(), digest_size=16)
+    with open(world_path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _write_gate_table(path, table):
+    # Same write-then-rename as persistence.write_json
+    tmp_path = path + ".tmp"
+    table.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_gate_table(world_path=DEFAULT_WORLD, cache_dir=CACHE_DIR):
+    """GateTable of a world file, from the cache when this exact file was parsed before."""
+    path = os.path.join(cache_dir, f"gates_{world_hash(world_path)}.npz")
+    if os.path.exists(path):
+        try:
+            return GateTable.load(path)
+        except Exception as e:
+            print(f"Kapı önbelleği okunamadı, dünya dosyası yeniden okunuyor: {e}")
+    with open(world_path, encoding='utf-8') as f:
+        table = GateTable.from_world(parse_world(f.read()))
+    os.makedirs(cache_dir, exist_ok=True)
+    persistence.get_worker().submit(path, table, writer=_write_gate_table)
+    return table